@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks.conftest import POOL_SIZES, rerollable_roll
+from bot.advisor import StrategyAdvisor
+from bot.roll import RollHistory, RollPhase
+
+
+def _roll_history(num_dice: int) -> RollHistory:
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, rerollable_roll(num_dice))
+    return roll_history
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_advise(benchmark, num_dice):
+    roll_history = _roll_history(num_dice)
+    advisor = StrategyAdvisor()
+    advisor.advise(roll_history)
+    benchmark(advisor.advise, roll_history)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_advise_cold(benchmark, num_dice):
+    roll_history = _roll_history(num_dice)
+    def advise():
+        StrategyAdvisor().advise(roll_history)
+    benchmark(advise)
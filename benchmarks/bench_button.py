@@ -0,0 +1,42 @@
+"""Benchmarks the complete path of a button press, from the custom id to the edited message."""
+import pytest
+
+from benchmarks.conftest import POOL_SIZES, rerollable_roll
+from benchmarks.fakes import FakeInteraction, FakeMessage, button_custom_ids, press_button
+from bot.controller import RollController, RollView, roll_embeds
+from bot.dice import DiceSet
+from bot.message import MessageGenerator
+from bot.roll import RollHistory, RollPhase
+
+USER_ID = 1234
+
+
+async def roll_message(num_dice: int, dice_set: DiceSet) -> FakeMessage:
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, rerollable_roll(num_dice))
+    pages = MessageGenerator(dice_set).generate_roll_pages(roll_history)
+    view = RollView(user_id=USER_ID, dice_set=dice_set, roll_history=roll_history)
+    return FakeMessage(roll_embeds(pages), view)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_roll_command(benchmark, run, num_dice):
+    controller = RollController()
+    async def roll():
+        await controller.handle_roll(FakeInteraction(user_id=USER_ID), num_dice)
+    benchmark(lambda: run(roll()))
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+@pytest.mark.parametrize('encoded_state', [True, False], ids=['state', 'parsed'])
+def test_free_reroll_button(benchmark, run, num_dice, encoded_state):
+    message = run(roll_message(num_dice, DiceSet.OCTANE))
+    custom_id = next(custom_id for custom_id in button_custom_ids(message) if custom_id.startswith('roll:free_reroll'))
+    if not encoded_state:
+        # Buttons on old messages, or on rolls too large to encode, parse the message instead.
+        custom_id = custom_id.split(':s:')[0]
+    def press():
+        # Every press starts from the original message.
+        return run(press_button(custom_id, FakeMessage(message.embeds, message.view), user_id=USER_ID))
+    interaction = benchmark(press)
+    assert interaction.api_calls == 1
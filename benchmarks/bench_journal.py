@@ -0,0 +1,60 @@
+"""Benchmarks journaling a roll, and scanning a large roll journal."""
+import struct
+
+import numpy as np
+import pytest
+
+from benchmarks.conftest import representative_roll_history
+from bot.dice import DiceSet
+from bot.journal import FORMAT_VERSION, HEADER_FORMAT, MAGIC, RECORD_DTYPE, JournalReader, pack_record
+
+# The number of records in the scanned journal
+JOURNAL_SIZE = 1_000_000
+NUM_USERS = 10_000
+
+
+@pytest.fixture(scope='module')
+def large_journal(tmp_path_factory):
+    """Returns the directory of a journal with JOURNAL_SIZE random rolls, in two segments."""
+    directory = tmp_path_factory.mktemp('journal')
+    rng = np.random.default_rng(0)
+    for index, size in enumerate([JOURNAL_SIZE // 2, JOURNAL_SIZE - JOURNAL_SIZE // 2], start=1):
+        records = np.zeros(size, dtype=RECORD_DTYPE)
+        records['timestamp'] = 1_700_000_000_000 + np.arange(size)
+        records['guild_id'] = 1
+        records['channel_id'] = rng.integers(1, 100, size)
+        records['user_id'] = rng.integers(1, NUM_USERS, size)
+        records['phases'] = 1
+        records['counts'][:, 0] = rng.multinomial(6, [1 / 6] * 6, size)
+        with open(directory / f'rolls-{index:06d}.journal', 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, RECORD_DTYPE.itemsize))
+            records.tofile(f)
+    return str(directory)
+
+
+@pytest.mark.parametrize('num_dice', [6, 10000])
+def test_pack_record(benchmark, num_dice):
+    roll_history = representative_roll_history(num_dice)
+    benchmark(pack_record, roll_history, DiceSet.OCTANE, 1, 2, 3)
+
+
+def test_scan_rolls_per_user(benchmark, large_journal):
+    reader = JournalReader(large_journal)
+    def rolls_per_user():
+        totals = np.zeros(NUM_USERS, dtype=np.int64)
+        for records in reader.scan():
+            totals += np.bincount(records['user_id'].astype(np.int64), minlength=NUM_USERS)
+        return totals
+    assert benchmark(rolls_per_user).sum() == JOURNAL_SIZE
+
+
+def test_find_user_rolls(benchmark, large_journal):
+    reader = JournalReader(large_journal)
+    entries = benchmark(reader.find, user_id=42, last=10)
+    assert len(entries) == 10
+
+
+def test_find_last_rolls(benchmark, large_journal):
+    reader = JournalReader(large_journal)
+    entries = benchmark(reader.find, last=10)
+    assert [entry.timestamp.timestamp() for entry in entries][-1] == (1_700_000_000_000 + JOURNAL_SIZE // 2 - 1) / 1000
@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks.conftest import POOL_SIZES, representative_roll_history
+from benchmarks.fakes import FakeInteraction, FakeMessage
+from bot.controller import roll_embeds
+from bot.dice import DiceSet
+from bot.message import MessageGenerator, MessageParser
+from bot.roll_state import encode_roll_history
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+@pytest.mark.parametrize('dice_set', DiceSet)
+def test_generate_roll_message(benchmark, dice_set, num_dice):
+    roll_history = representative_roll_history(num_dice)
+    def render():
+        MessageGenerator(dice_set).generate_roll_message(roll_history)
+    benchmark(render)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+@pytest.mark.parametrize('dice_set', DiceSet)
+def test_parse_roll_message(benchmark, dice_set, num_dice):
+    roll_history = representative_roll_history(num_dice)
+    pages = MessageGenerator(dice_set).generate_roll_pages(roll_history)
+    interaction = FakeInteraction(message=FakeMessage(roll_embeds(pages)))
+    parsed = benchmark(MessageParser, interaction, dice_set)
+    assert encode_roll_history(parsed.roll_history) == encode_roll_history(roll_history)
@@ -0,0 +1,50 @@
+import pytest
+
+from benchmarks.conftest import POOL_SIZES, rerollable_roll
+from bot.rng import dice_source
+from bot.roll import Roll, RollHistory, RollPhase, Roller
+
+
+def _roll(num_dice: int) -> Roll:
+    dice_source.seed(num_dice)
+    roller = Roller(num_dice=num_dice)
+    roller.roll()
+    return roller.roll_history.get_roll(RollPhase.INITIAL)
+
+
+def _roll_history(initial_roll: Roll) -> RollHistory:
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, initial_roll)
+    return roll_history
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_roll(benchmark, num_dice):
+    def roll():
+        Roller(num_dice=num_dice).roll()
+    benchmark(roll)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+@pytest.mark.parametrize('action', ['reroll', 'free_reroll', 'all_in'])
+def test_reroll(benchmark, num_dice, action):
+    if action == 'reroll' and num_dice < 4:
+        pytest.skip('Rerolls require at least one success.')
+    initial_roll = rerollable_roll(num_dice)
+    def reroll():
+        getattr(Roller(roll_history=_roll_history(initial_roll)), action)()
+    benchmark(reroll)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_group_matches(benchmark, num_dice):
+    benchmark(_roll(num_dice)._group_matches)
+
+
+@pytest.mark.parametrize('num_dice', POOL_SIZES)
+def test_is_better_than(benchmark, num_dice):
+    roll = _roll(num_dice)
+    def compare():
+        # Fresh rolls, so the scores aren't served from the cache
+        Roll.from_counts(roll.counts).is_better_than(Roll.from_counts(roll.counts[::-1]))
+    benchmark(compare)
@@ -0,0 +1,48 @@
+import asyncio
+import random
+
+import pytest
+
+from benchmarks.render_roll import generate_roll_histories
+from bot.channel_settings import InMemorySettingsBackend, channel_settings
+from bot.rng import dice_source
+from bot.roll import Roll
+
+POOL_SIZES = [1, 10, 100, 1000, 10000]
+
+
+def representative_roll_history(num_dice: int):
+    """Returns a roll history of the given size with as many roll phases as possible."""
+    return max(generate_roll_histories(num_dice, 12), key=lambda roll_history: len(roll_history.rolls))
+
+
+def rerollable_roll(num_dice: int) -> Roll:
+    """Returns a roll with two non-matched dice and, from 4 dice on, at least one success.
+
+    Large random rolls rarely have any non-matched dice left, so they can't be rerolled.
+    """
+    if num_dice < 4:
+        return Roll.from_counts([1] * num_dice + [0] * (6 - num_dice))
+    matched, remainder = divmod(num_dice - 2, 4)
+    return Roll.from_counts([1, 1, matched + remainder, matched, matched, matched])
+
+
+@pytest.fixture
+def run():
+    """Returns a function that runs a coroutine to completion on a dedicated event loop."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(autouse=True)
+def seeded_random():
+    """Makes every benchmark roll the same dice on every run, so runs are comparable."""
+    random.seed(0)
+    dice_source.seed(0)
+
+
+@pytest.fixture(autouse=True)
+def in_memory_channel_settings(monkeypatch):
+    """Keeps the channel settings in memory, so benchmarks never touch the disk."""
+    monkeypatch.setattr(channel_settings, 'backend', InMemorySettingsBackend())
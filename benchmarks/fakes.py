@@ -0,0 +1,160 @@
+"""Local stand-ins for discord.Interaction and friends.
+
+They implement just enough of the interaction API for the controllers and the
+dynamic buttons to run without a connection to Discord. Every API call can be
+delayed by a configurable latency, to simulate the round trip to Discord.
+
+Like discord.py, the fakes keep the views of sent and edited messages in a
+view store (see view_store) unless the view has already finished.
+"""
+import asyncio
+import itertools
+
+import discord
+
+_ids = itertools.count(1)
+
+# The views that discord.py would keep to dispatch component interactions
+view_store = discord.ui.view.ViewStore(None)
+
+
+class FakeUser:
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeMessage:
+    """A sent message, with the embeds and view of the last send or edit."""
+    def __init__(self, embeds: list[discord.Embed], view: discord.ui.View | None = None):
+        self.id = next(_ids)
+        self.embeds = embeds
+        self.view = view
+
+    def components(self) -> list[dict]:
+        """Returns the message's components, as sent to Discord."""
+        return self.view.to_components() if self.view else []
+
+
+class FakeResponse:
+    """Stands in for discord.InteractionResponse."""
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content=None, *, embed=None, embeds=None, view=None, ephemeral=False):
+        await self._respond()
+        self._interaction.sent_message = FakeMessage(_embeds(embed, embeds), view)
+        _store_view(view, self._interaction.sent_message)
+        self._interaction.ephemeral = ephemeral
+        self._interaction.content = content
+
+    async def edit_message(self, *, embed=None, embeds=None, view=None):
+        await self._respond()
+        self._interaction.message.embeds = _embeds(embed, embeds)
+        self._interaction.message.view = view
+        _store_view(view, self._interaction.message)
+
+    async def defer(self, *, thinking=False, ephemeral=False):
+        await self._respond()
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        await self._interaction.api_call()
+        self._done = True
+
+
+class FakeFollowup:
+    """Stands in for the interaction's followup webhook."""
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, embed=None, embeds=None, view=None, ephemeral=False):
+        await self._interaction.api_call()
+        self._interaction.sent_message = FakeMessage(_embeds(embed, embeds), view)
+        _store_view(view, self._interaction.sent_message)
+        self._interaction.ephemeral = ephemeral
+        self._interaction.content = content
+
+
+class FakeInteraction:
+    """Stands in for discord.Interaction.
+
+    Attributes:
+        latency: The number of seconds each API call takes.
+        sent_message: The message sent in response to a command, if any.
+        message: The message a component belongs to, if any.
+        api_calls: The number of API calls made.
+    """
+    def __init__(self, *, user_id: int = 1, channel_id: int = 1, guild_id: int | None = 1,
+                 message: FakeMessage | None = None, custom_id: str | None = None, latency: float = 0):
+        self.id = next(_ids)
+        self.type = discord.InteractionType.component if message else discord.InteractionType.application_command
+        self.user = FakeUser(user_id)
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.message = message
+        self.data = {'custom_id': custom_id} if custom_id else {}
+        self.latency = latency
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent_message = None
+        self.ephemeral = False
+        self.content = None
+        self.api_calls = 0
+
+    async def edit_original_response(self, *, embed=None, embeds=None, view=None):
+        await self.api_call()
+        target = self.message or self.sent_message
+        target.embeds = _embeds(embed, embeds)
+        target.view = view
+        _store_view(view, target)
+
+    async def api_call(self):
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            # Yield to the event loop, like a real API call would.
+            await asyncio.sleep(0)
+
+
+async def press_button(custom_id: str, message: FakeMessage, *, user_id: int, latency: float = 0) -> FakeInteraction:
+    """Presses the button with the given custom id, the way discord.py dispatches dynamic items.
+
+    Returns:
+        The interaction of the button press.
+    """
+    # Imported here, so the fakes can be imported before the bot is configured.
+    from bot.controller import DynamicAllInButton, DynamicFreeRerollButton, DynamicRerollButton
+
+    interaction = FakeInteraction(user_id=user_id, message=message, custom_id=custom_id, latency=latency)
+    for button_class in [DynamicRerollButton, DynamicFreeRerollButton, DynamicAllInButton]:
+        match = button_class.__discord_ui_compiled_template__.fullmatch(custom_id)
+        if match:
+            button = await button_class.from_custom_id(interaction, None, match)
+            if await button.interaction_check(interaction):
+                await button.callback(interaction)
+            return interaction
+    raise ValueError(f'No button matches {custom_id!r}')
+
+
+def button_custom_ids(message: FakeMessage) -> list[str]:
+    """Returns the custom ids of the buttons on the message."""
+    return [
+        component['custom_id']
+        for row in message.components()
+        for component in row['components']
+    ]
+
+
+def _store_view(view: discord.ui.View | None, message: FakeMessage):
+    if view is not None and not view.is_finished():
+        view_store.add_view(view, message.id)
+
+
+def _embeds(embed, embeds):
+    return [embed] if embed is not None else list(embeds or [])
@@ -0,0 +1,165 @@
+"""Offline load test for the /roll command and the reroll buttons.
+
+Simulates many users who concurrently roll dice and press the reroll buttons,
+as fast as the bot responds. The interactions are local stand-ins (see
+benchmarks/fakes.py) that delay each API call by a configurable latency, so
+no network or Discord connection is needed.
+
+For each concurrency level, reports the handler latency (from receiving the
+interaction to the handler returning), the event loop lag (how late a
+periodic timer fires), and the throughput. Discord cancels interactions that
+aren't responded to within 3 seconds, so the p99 latency must stay well below
+that.
+
+Usage: python -m benchmarks.loadtest [--concurrency 10 100 1000] [--duration S] [--latency S] [--dice N]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeInteraction, button_custom_ids, press_button
+from bot.channel_settings import InMemorySettingsBackend, channel_settings
+from bot.controller import RollController
+
+CONCURRENCY_LEVELS = [10, 100, 1000, 5000]
+# Discord's deadline for the initial response to an interaction
+INTERACTION_DEADLINE = 3.0
+# How often the lag monitor wakes up
+LAG_INTERVAL = 0.01
+
+
+class LoadTestResult:
+    """The measurements of a load test at one concurrency level.
+
+    Attributes:
+        concurrency: The number of simulated users.
+        duration: The number of seconds the test ran.
+        latencies: The handler latency of each interaction, in seconds.
+        lags: How late each wake up of the lag monitor was, in seconds.
+        errors: The number of interactions whose handler raised an exception.
+    """
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.duration = 0.0
+        self.latencies = []
+        self.lags = []
+        self.errors = 0
+
+    def throughput(self) -> float:
+        """Returns the number of handled interactions per second."""
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    def latency_percentile(self, percentile: int) -> float:
+        return _percentile(self.latencies, percentile)
+
+    def lag_percentile(self, percentile: int) -> float:
+        return _percentile(self.lags, percentile)
+
+    def missed_deadlines(self) -> int:
+        """Returns the number of interactions that took longer than Discord allows."""
+        return sum(latency > INTERACTION_DEADLINE for latency in self.latencies)
+
+
+async def run_load_test(concurrency: int, duration: float, latency: float, num_dice: int) -> LoadTestResult:
+    """Runs the given number of simulated users for the given number of seconds.
+
+    Each user rolls the dice, then presses random reroll buttons on the
+    resulting message until none are left, and starts over.
+    """
+    result = LoadTestResult(concurrency)
+    controller = RollController()
+    deadline = time.monotonic() + duration
+
+    async def timed(handler):
+        start = time.monotonic()
+        try:
+            interaction = await handler
+        except Exception:
+            result.errors += 1
+            interaction = None
+        result.latencies.append(time.monotonic() - start)
+        return interaction
+
+    async def user(user_id: int):
+        # Spread out the first rolls, rather than starting every user at once.
+        await asyncio.sleep(random.uniform(0, min(duration, 1.0)))
+        while time.monotonic() < deadline:
+            interaction = FakeInteraction(user_id=user_id, channel_id=user_id % 100, latency=latency)
+            await timed(_roll(controller, interaction, num_dice))
+            message = interaction.sent_message
+            while message is not None and message.view is not None and time.monotonic() < deadline:
+                custom_ids = button_custom_ids(message)
+                if not custom_ids:
+                    break
+                interaction = await timed(
+                    press_button(random.choice(custom_ids), message, user_id=user_id, latency=latency))
+                if interaction is None:
+                    break
+
+    async def monitor_lag():
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            result.lags.append(max(0.0, time.monotonic() - start - LAG_INTERVAL))
+
+    monitor = asyncio.create_task(monitor_lag())
+    start = time.monotonic()
+    await asyncio.gather(*(user(user_id) for user_id in range(1, concurrency + 1)))
+    result.duration = time.monotonic() - start
+    monitor.cancel()
+    return result
+
+
+async def _roll(controller: RollController, interaction: FakeInteraction, num_dice: int) -> FakeInteraction:
+    await controller.handle_roll(interaction, num_dice)
+    return interaction
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[percentile - 1]
+
+
+async def main_async(args):
+    # Keep the channel settings in memory, so the load test never touches the disk.
+    channel_settings.backend = InMemorySettingsBackend()
+    print(f'{args.dice} dice, {args.latency * 1000:.0f} ms API latency, {args.duration:.0f} s per level')
+    print(f'{"users":>7}{"handled":>10}{"per sec":>10}{"p50":>10}{"p99":>10}'
+          f'{"lag p50":>10}{"lag p99":>10}{"lag max":>10}{"> 3 s":>8}{"errors":>8}')
+    sustainable = None
+    for concurrency in args.concurrency:
+        result = await run_load_test(concurrency, args.duration, args.latency, args.dice)
+        print(f'{concurrency:>7}{len(result.latencies):>10}{result.throughput():>10,.0f}'
+              f'{_ms(result.latency_percentile(50)):>10}{_ms(result.latency_percentile(99)):>10}'
+              f'{_ms(result.lag_percentile(50)):>10}{_ms(result.lag_percentile(99)):>10}'
+              f'{_ms(max(result.lags, default=0)):>10}{result.missed_deadlines():>8}{result.errors:>8}')
+        if result.latency_percentile(99) < INTERACTION_DEADLINE and not result.errors:
+            if sustainable is None or result.throughput() > sustainable.throughput():
+                sustainable = result
+    if sustainable:
+        print(f'Highest throughput with a p99 latency below {INTERACTION_DEADLINE:.0f} s: '
+              f'{sustainable.throughput():,.0f} interactions/s with {sustainable.concurrency} users')
+    else:
+        print(f'No concurrency level kept the p99 latency below {INTERACTION_DEADLINE:.0f} s')
+
+
+def _ms(seconds: float) -> str:
+    return f'{seconds * 1000:.1f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY_LEVELS,
+                        help='The numbers of concurrent users to simulate')
+    parser.add_argument('--duration', type=float, default=10.0, help='The number of seconds per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.1, help='The number of seconds each API call takes')
+    parser.add_argument('--dice', type=int, default=6, help='The number of dice per roll')
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Throughput benchmark for parsing roll messages.
+
+Parses a corpus of generated roll messages (as sent in embeds) for every dice
+set, the way the reroll buttons do for messages without an encoded roll state.
+
+Usage: python -m benchmarks.parse_roll [--rolls N]
+"""
+import argparse
+import timeit
+from types import SimpleNamespace
+
+import discord
+
+from benchmarks.render_roll import POOL_SIZES, generate_roll_histories
+from bot.dice import DiceSet
+from bot.message import MessageGenerator, MessageParser
+
+
+def generate_interactions(dice_set: DiceSet, roll_histories):
+    """Returns stand-ins for the interactions of buttons on the rendered roll messages."""
+    generator = MessageGenerator(dice_set)
+    return [
+        SimpleNamespace(message=SimpleNamespace(embeds=[
+            discord.Embed(description=page) for page in generator.generate_roll_pages(roll_history)]))
+        for roll_history in roll_histories
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rolls', type=int, default=2000, help='The number of messages per dice set and pool size')
+    args = parser.parse_args()
+
+    roll_histories = [
+        roll_history for num_dice in POOL_SIZES for roll_history in generate_roll_histories(num_dice, args.rolls)]
+    print(f'{"dice set":<18}{"messages/s":>12}{"per message":>14}')
+    for dice_set in DiceSet:
+        interactions = generate_interactions(dice_set, roll_histories)
+        def parse():
+            for interaction in interactions:
+                MessageParser(interaction, dice_set)
+        seconds = min(timeit.repeat(parse, number=1, repeat=5))
+        print(f'{dice_set.value:<18}{len(interactions) / seconds:>12,.0f}{f"{seconds / len(interactions) * 1e6:.1f} µs":>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Micro-benchmark for rendering roll messages.
+
+Measures the cost per roll of creating a MessageGenerator and rendering a roll
+message, as the controllers do for every interaction.
+
+Usage: python -m benchmarks.render_roll [--rolls N]
+"""
+import argparse
+import timeit
+
+from bot.dice import DiceSet
+from bot.message import MessageGenerator
+from bot.rng import dice_source
+from bot.roll import Roller
+
+POOL_SIZES = [2, 6, 12, 30]
+
+
+def generate_roll_histories(num_dice: int, count: int):
+    """Generates roll histories with a mix of rerolls, free rerolls, and going all in."""
+    dice_source.seed(num_dice)
+    roll_histories = []
+    for i in range(count):
+        roller = Roller(num_dice=num_dice)
+        roller.roll()
+        if roller.roll_history.can_reroll() and i % 3 == 0:
+            roller.reroll()
+        elif roller.roll_history.can_free_reroll() and i % 3 == 1:
+            roller.free_reroll()
+        if roller.roll_history.can_go_all_in() and i % 2 == 0:
+            roller.all_in()
+        roll_histories.append(roller.roll_history)
+    return roll_histories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rolls', type=int, default=2000, help='The number of rolls to render per pool size')
+    args = parser.parse_args()
+
+    print(f'{"dice set":<18}' + ''.join(f'{f"{num_dice} dice":>12}' for num_dice in POOL_SIZES))
+    roll_histories = {num_dice: generate_roll_histories(num_dice, args.rolls) for num_dice in POOL_SIZES}
+    for dice_set in DiceSet:
+        timings = []
+        for num_dice in POOL_SIZES:
+            def render():
+                for roll_history in roll_histories[num_dice]:
+                    MessageGenerator(dice_set).generate_roll_message(roll_history)
+            seconds = min(timeit.repeat(render, number=1, repeat=5))
+            timings.append(seconds / args.rolls * 1e6)
+        print(f'{dice_set.value:<18}' + ''.join(f'{f"{timing:.1f} µs":>12}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Soak test that checks that memory stays flat over many rolls.
+
+Rolls the dice and presses a reroll button on the result, over and over,
+through the fake interactions (see benchmarks/fakes.py), which keep views in
+a view store the way discord.py does. At regular checkpoints, reports the
+memory traced by tracemalloc, the resident set size, and the number of views
+in the view store.
+
+Exits with a non-zero status if the traced memory grew by more than the
+allowed amount between the first and the last checkpoint. The first
+checkpoint is taken after a warm-up, once the caches have filled up.
+
+Usage: python -m benchmarks.soak [--rolls N] [--checkpoints N] [--max-growth MB]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeInteraction, button_custom_ids, press_button, view_store
+from bot.channel_settings import InMemorySettingsBackend, channel_settings
+from bot.controller import MAX_TRACKED_INTERACTIONS, MAX_TRACKED_MESSAGES, RollController
+
+# The number of distinct users and channels, which bounds the size of the caches
+NUM_USERS = 1000
+NUM_CHANNELS = 100
+# The number of rolls after which the caches have filled up. Most, but not all, rolls have
+# buttons to press, and the duplicate detection remembers the recently pressed messages.
+WARM_UP_ROLLS = 2 * max(MAX_TRACKED_MESSAGES, MAX_TRACKED_INTERACTIONS)
+
+
+def resident_set_size() -> int | None:
+    """Returns the current resident set size in bytes, if available (Linux only)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+async def soak(rolls: int, checkpoints: int, num_dice: int) -> list[int]:
+    """Performs the given number of rolls, and returns the traced memory at each checkpoint."""
+    controller = RollController()
+    warm_up = min(rolls // (checkpoints + 1), WARM_UP_ROLLS)
+    interval = max(1, (rolls - warm_up) // checkpoints)
+    traced = []
+    start = time.monotonic()
+    print(f'{"rolls":>10}{"traced":>12}{"rss":>12}{"views":>8}{"rolls/s":>10}')
+    for i in range(rolls):
+        user_id = i % NUM_USERS + 1
+        interaction = FakeInteraction(user_id=user_id, channel_id=i % NUM_CHANNELS)
+        await controller.handle_roll(interaction, num_dice)
+        custom_ids = button_custom_ids(interaction.sent_message)
+        if custom_ids:
+            await press_button(custom_ids[i % len(custom_ids)], interaction.sent_message, user_id=user_id)
+
+        done = i + 1
+        if done >= warm_up and (done - warm_up) % interval == 0:
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            traced.append(current)
+            rss = resident_set_size()
+            views = len(view_store._views) + len(view_store._synced_message_views)
+            print(f'{done:>10,}{_mb(current):>12}{_mb(rss) if rss else "n/a":>12}{views:>8,}'
+                  f'{done / (time.monotonic() - start):>10,.0f}')
+    return traced
+
+
+def _mb(size: int) -> str:
+    return f'{size / 2**20:.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rolls', type=int, default=1_000_000, help='The number of rolls to perform')
+    parser.add_argument('--checkpoints', type=int, default=10, help='The number of memory measurements')
+    parser.add_argument('--dice', type=int, default=6, help='The number of dice per roll')
+    parser.add_argument('--max-growth', type=float, default=1.0,
+                        help='The number of MB the traced memory may grow by after the warm-up')
+    args = parser.parse_args()
+
+    # Keep the channel settings in memory, so the soak test never touches the disk.
+    channel_settings.backend = InMemorySettingsBackend()
+    tracemalloc.start()
+    traced = asyncio.run(soak(args.rolls, args.checkpoints, args.dice))
+    growth = traced[-1] - traced[0]
+    print(f'Traced memory grew by {_mb(growth)} after the warm-up')
+    if growth > args.max_growth * 2**20:
+        print(f'FAILED: more than the allowed {args.max_growth:.1f} MB')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Runs the bot.
+
+Usage: python -m bot [--force-sync] [--startup-profile]
+
+With --startup-profile, the bot isn't started. Instead, reports how long
+importing each module and creating each lazily initialized component takes,
+in the order in which the bot loads them.
+"""
+import argparse
+import importlib
+import sys
+import time
+
+# The modules in the order of their first import when starting the bot. Each
+# module's time includes any of its dependencies that weren't imported before.
+STARTUP_MODULES = [
+    'discord',
+    'numpy',
+    'bot.lazy',
+    'bot.log',
+    'bot.config',
+    'bot.dice',
+    'bot.rng',
+    'bot.roll',
+    'bot.roll_state',
+    'bot.simulate',
+    'bot.odds',
+    'bot.stats',
+    'bot.advisor',
+    'bot.message',
+    'bot.channel_settings',
+    'bot.custom_dice',
+    'bot.journal',
+    'bot.compute',
+    'bot.metrics',
+    'bot.controller',
+    'bot.command_sync',
+    'bot.bot',
+]
+
+
+def startup_initializers():
+    """Returns the components that are created on first use, with functions that create them."""
+    from bot.channel_settings import channel_settings
+    from bot.compute import compute_pool
+    from bot.config import config
+    from bot.journal import roll_journal
+    from bot.lazy import resolve
+    from bot.message import build_render_tables
+    from bot.odds import odds_calculator
+    from bot.rng import dice_source
+    from bot.stats import roll_stats
+    return [
+        ('config', lambda: resolve(config)),
+        ('channel settings', lambda: resolve(channel_settings)),
+        ('odds calculator', lambda: resolve(odds_calculator)),
+        ('dice source', lambda: resolve(dice_source)),
+        ('compute pool', lambda: resolve(compute_pool)),
+        ('roll journal', lambda: resolve(roll_journal)),
+        ('roll statistics', lambda: resolve(roll_stats)),
+        ('render tables', build_render_tables),
+    ]
+
+
+def profile_startup():
+    """Prints the import and initialization time of each module and component."""
+    total = 0.0
+    print(f'{"import":<24}{"time":>12}')
+    for module in STARTUP_MODULES:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        print(f'{module:<24}{_ms(elapsed):>12}')
+    print(f'{"initialize":<24}{"time":>12}')
+    for name, initialize in startup_initializers():
+        start = time.perf_counter()
+        initialize()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        print(f'{name:<24}{_ms(elapsed):>12}')
+    print(f'{"total":<24}{_ms(total):>12}')
+
+
+def _ms(seconds: float) -> str:
+    return f'{seconds * 1000:.1f} ms'
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run the Discord bot.', add_help=False)
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='Report the import and initialization time of each module, instead of starting the bot')
+    args, remaining = parser.parse_known_args(argv)
+    if args.startup_profile:
+        profile_startup()
+        return
+    from bot.bot import main as run_bot
+    run_bot(remaining)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+"""Exact strategy advice for the rerolls of an Octane roll.
+
+For each action the rules allow (see RollHistory.can_reroll, can_free_reroll,
+and can_go_all_in), the advisor computes the exact expected score (see
+Roll.is_better_than) of the roll's final result, assuming the best follow-up
+(e.g. going all in after a reroll, when that is expected to pay off), and
+the risk of losing successes.
+
+Rerolls only touch the non-matched dice, and the faces are interchangeable, so
+a roll's prospects only depend on its state: the counts of its matched faces,
+sorted, and the number of its non-matched dice. As every non-matched die shows
+a face of its own, there are at most six of them, so the outcomes of a reroll
+are few, no matter how large the pool is. The advice for each state and roll
+phase is kept in a transposition table, so that repeated advice for the
+states of common pool sizes is a lookup.
+
+Usage: python -m bot.advisor DICE (e.g. python -m bot.advisor 1 1 3 4 6)
+"""
+import argparse
+import functools
+import math
+import re
+from collections import OrderedDict
+from fractions import Fraction
+
+from bot.roll import NUM_FACES, Roll, RollHistory, RollPhase, match_score
+
+# The largest pool size we advise on. This keeps the expected scores within the range of floats.
+MAX_ADVISE_DICE = 1000
+# The number of states whose advice is kept in the transposition table
+DEFAULT_TABLE_SIZE = 100_000
+# The actions in the order they are listed, with the phase of the roll they add
+ACTIONS = {
+    'keep': None,
+    'reroll': RollPhase.REROLL,
+    'free_reroll': RollPhase.FREE_REROLL,
+    'all_in': RollPhase.ALL_IN,
+}
+DICE_SEPARATORS = re.compile(r'[\s,]+')
+
+
+def parse_dice(text: str) -> Roll:
+    """Returns the roll of the given dice, e.g. '1 1 3 4 6' or '11346'.
+
+    Raises:
+        ValueError: If the text contains anything but the faces 1 to 6.
+    """
+    faces = DICE_SEPARATORS.sub('', text)
+    if not faces or len(faces) > MAX_ADVISE_DICE or set(faces) - set('123456'):
+        raise ValueError(f'Expected 1 to {MAX_ADVISE_DICE} dice with faces from 1 to 6, e.g. "1 1 3 4 6".')
+    return Roll([int(face) for face in faces])
+
+
+def state_score(matched: tuple[int, ...]) -> int:
+    """Returns the score of a roll with the given matched face counts."""
+    return sum(match_score(count) for count in matched)
+
+
+@functools.lru_cache(maxsize=None)
+def reroll_outcomes(num_dice: int) -> tuple[tuple[tuple[int, ...], int], ...]:
+    """Returns the number of rerolled dice showing each face, for every outcome of rerolling num_dice dice.
+
+    Each outcome comes with the number of the 6^num_dice equally likely rolls that produce it.
+    """
+    outcomes = []
+    for counts in _compositions(num_dice, NUM_FACES):
+        rolls = math.factorial(num_dice)
+        for count in counts:
+            rolls //= math.factorial(count)
+        outcomes.append((counts, rolls))
+    return tuple(outcomes)
+
+
+def _compositions(total: int, parts: int):
+    """Yields the ways to split total into the given number of ordered, non-negative parts."""
+    if parts == 1:
+        yield (total,)
+        return
+    for first in range(total, -1, -1):
+        for rest in _compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+
+def reroll_transitions(matched: tuple[int, ...], unmatched: int) -> dict[tuple[tuple[int, ...], int], int]:
+    """Returns the states a roll can end up in when its non-matched dice are rerolled.
+
+    Maps each state (matched face counts, number of non-matched dice) to the
+    number of the 6^unmatched equally likely rolls that produce it.
+    """
+    transitions = {}
+    for counts, rolls in reroll_outcomes(unmatched):
+        # The matched faces come first, the faces of the rerolled dice keep nothing.
+        new_matched = [kept + rolled for kept, rolled in zip(matched, counts)]
+        new_matched += [count for count in counts[len(matched):] if count > 1]
+        new_unmatched = counts[len(matched):].count(1)
+        state = (tuple(sorted(new_matched, reverse=True)), new_unmatched)
+        transitions[state] = transitions.get(state, 0) + rolls
+    return transitions
+
+
+class ActionAdvice:
+    """The prospects of an action.
+
+    Attributes:
+        action: The action, one of ACTIONS.
+        expected_score: The expected score of the final result, with the best follow-up.
+        improve_probability: The probability that the action improves the result.
+        loss_probability: The probability that the action loses successes, i.e. a failed
+            reroll or all in.
+    """
+    __slots__ = ('action', 'expected_score', 'improve_probability', 'loss_probability')
+
+    def __init__(self, action: str, expected_score: Fraction, improve_probability: Fraction = Fraction(0),
+                 loss_probability: Fraction = Fraction(0)):
+        self.action = action
+        self.expected_score = expected_score
+        self.improve_probability = improve_probability
+        self.loss_probability = loss_probability
+
+    def __repr__(self):
+        return (f'ActionAdvice({self.action}, expected_score={float(self.expected_score):.4f}, '
+                f'improve={float(self.improve_probability):.4f}, loss={float(self.loss_probability):.4f})')
+
+
+class Advice:
+    """The advice for a roll.
+
+    Attributes:
+        score: The score of the roll as it stands.
+        actions: The prospects of keeping the roll, and of each action the rules allow.
+    """
+    def __init__(self, score: int, actions: list[ActionAdvice]):
+        self.score = score
+        self.actions = actions
+
+    def best(self) -> ActionAdvice:
+        """Returns the action with the highest expected score, preferring to keep the roll on ties."""
+        return max(self.actions, key=lambda advice: advice.expected_score)
+
+
+class StrategyAdvisor:
+    """Computes the advice for rolls, memoized in a transposition table.
+
+    The table maps each (matched face counts, number of non-matched dice, roll
+    phase) to the prospects of the actions available in that phase. The least
+    recently used entries are evicted once the table is full.
+
+    Attributes:
+        table_size: The number of entries kept in the table.
+    """
+    def __init__(self, table_size: int = DEFAULT_TABLE_SIZE):
+        self.table_size = table_size
+        self._table = OrderedDict()
+
+    def __len__(self):
+        return len(self._table)
+
+    def advise(self, roll_history: RollHistory) -> Advice:
+        """Returns the advice for the roll history's final roll."""
+        roll = roll_history.get_final_roll()
+        allowed = [action for action, is_allowed in [
+            ('reroll', roll_history.can_reroll),
+            ('free_reroll', roll_history.can_free_reroll),
+            ('all_in', roll_history.can_go_all_in)] if is_allowed()]
+        actions = [ActionAdvice('keep', Fraction(roll.score))]
+        if allowed:
+            matched = tuple(sorted((count for count in roll.counts if count > 1), reverse=True))
+            phase = RollPhase(max(phase.value for phase in roll_history.rolls))
+            entry = self.action_advice(matched, len(roll.non_matched_dice()), phase)
+            actions += [entry[action] for action in allowed]
+        return Advice(roll.score, actions)
+
+    def action_advice(self, matched: tuple[int, ...], unmatched: int, phase: RollPhase) -> dict[str, ActionAdvice]:
+        """Returns the prospects of the actions available for a roll in the given state and phase.
+
+        Args:
+            matched: The counts of the roll's matched faces, in descending order.
+            unmatched: The number of the roll's non-matched dice.
+            phase: The phase of the roll, whose rules determine the available actions.
+        """
+        key = (matched, unmatched, phase)
+        entry = self._table.get(key)
+        if entry is None:
+            entry = self._table[key] = self._compute(matched, unmatched, phase)
+            while len(self._table) > self.table_size:
+                self._table.popitem(last=False)
+        else:
+            self._table.move_to_end(key)
+        return entry
+
+    def expected_score(self, matched: tuple[int, ...], unmatched: int, phase: RollPhase) -> Fraction:
+        """Returns the expected final score of a roll in the given state and phase, with the best play."""
+        score = Fraction(state_score(matched))
+        if phase == RollPhase.ALL_IN or not unmatched:
+            return score
+        return max([score] + [advice.expected_score
+                              for advice in self.action_advice(matched, unmatched, phase).values()])
+
+    def _compute(self, matched: tuple[int, ...], unmatched: int, phase: RollPhase) -> dict[str, ActionAdvice]:
+        score = state_score(matched)
+        entry = {}
+        if phase == RollPhase.ALL_IN or not unmatched:
+            return entry
+        transitions = reroll_transitions(matched, unmatched)
+        total = NUM_FACES ** unmatched
+        # The reroll's outcomes that improve the result, i.e. any new match
+        improved = [(state, rolls) for state, rolls in transitions.items() if state_score(state[0]) > score]
+        not_improved = Fraction(total - sum(rolls for _, rolls in improved), total)
+        if phase == RollPhase.INITIAL:
+            for action in ('reroll', 'free_reroll'):
+                if action == 'reroll' and not score:
+                    # Rerolls require at least one success.
+                    continue
+                # A failed reroll loses the lowest success, while a free reroll keeps the roll as it was.
+                kept_score = score - match_score(min(matched)) if action == 'reroll' else score
+                expected = sum((rolls * self.expected_score(*state, ACTIONS[action]) for state, rolls in improved),
+                               Fraction(0))
+                entry[action] = ActionAdvice(
+                    action, expected / total + not_improved * kept_score, 1 - not_improved,
+                    not_improved if action == 'reroll' else Fraction(0))
+        else:
+            # A failed all in loses every success.
+            expected = sum(rolls * state_score(state[0]) for state, rolls in improved)
+            entry['all_in'] = ActionAdvice('all_in', Fraction(expected, total), 1 - not_improved, not_improved)
+        return entry
+
+
+strategy_advisor = StrategyAdvisor()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Advise on the rerolls of an initial roll.')
+    parser.add_argument('dice', nargs='+', help='The faces of the rolled dice')
+    args = parser.parse_args(argv)
+
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, parse_dice(' '.join(args.dice)))
+    advice = strategy_advisor.advise(roll_history)
+    best = advice.best()
+    for action in advice.actions:
+        print(f'{action.action}: expected={float(action.expected_score):.4f} '
+              f'improve={float(action.improve_probability):.2%} loss={float(action.loss_probability):.2%}'
+              f'{" (best)" if action is best else ""}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,125 @@
 """A Discord bot that rolls Octane dice.
 
 """
+import argparse
+import asyncio
+import logging
+
 import discord
 from discord import app_commands
 
+from bot.channel_settings import channel_settings, migrate_shelve
+from bot.command_sync import CommandSyncState, sync_commands
+from bot.compute import compute_pool
 from bot.config import config
 from bot.controller import (
     SettingsController,
+    DiceSetController,
     RollController,
+    OddsController,
+    SimulateController,
+    AdviseController,
+    StatsController,
     CoinController,
     D6Controller,
     HelpController,
     DynamicRerollButton,
     DynamicFreeRerollButton,
-    DynamicAllInButton,)
+    DynamicAllInButton,
+    DynamicAdviseButton,)
 from bot.dice import DiceSet
+from bot.journal import roll_journal
+from bot.stats import roll_stats
+from bot.message import STRATEGY_NAMES
+from bot.log import setup_logging
+from bot.metrics import MetricsServer, metrics
+from bot.ratelimit import rate_limits
+
+logger = logging.getLogger(__name__)
+
 
+class BotClientMixin:
+    """The setup and shutdown shared by the bot's clients.
 
-class MyClient(discord.Client):
-    def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+    Attributes:
+        tree: The application command tree.
+        force_sync: Whether to sync the commands even if they didn't change.
+        sync_commands: Whether to sync the commands at all. In a shard cluster,
+            only one worker syncs them.
+        health_reporter: An optional HealthReporter, started with the client
+            (see bot.cluster).
+    """
+    def __init__(self, *, intents: discord.Intents, force_sync: bool = False, sync_commands: bool = True, **kwargs):
+        # Track the rate limits reported by Discord, for the response scheduler.
+        super().__init__(intents=intents, http_trace=rate_limits.trace_config(), **kwargs)
+        self.force_sync = force_sync
+        self.sync_commands = sync_commands
         self.tree = app_commands.CommandTree(self)
         self.dev_guild = None
+        self.metrics_server = None
+        self.health_reporter = None
+        self._health_task = None
         if config.dev_guild_id:
             self.dev_guild = discord.Object(config.dev_guild_id)
-        print(f'Development guild: {self.dev_guild}')
+        logger.info('Development guild: %s', self.dev_guild)
 
     async def setup_hook(self):
         """Setup the global commands on the guild.
         
         If a development guild is specified, the global commands are copied to that guild.
         This ensures that they are available right away, without the delay of up to an hour.
+        The commands are only synced if they changed since the last sync, or if forced.
         """
+        # Import the settings of the legacy shelve database, if there is one.
+        await migrate_shelve(config.channel_settings_db, channel_settings.backend)
+        # Pick up settings changed by other processes sharing the database.
+        channel_settings.start_refresh(config.channel_settings_refresh_interval)
+        # Start the worker processes for CPU-heavy commands.
+        compute_pool.start()
+        # Journal every finished roll.
+        roll_journal.start()
+        # Keep the roll statistics, starting from the last snapshot.
+        await roll_stats.start()
+        # Serve the metrics for Prometheus, if enabled.
+        if config.metrics_port:
+            self.metrics_server = MetricsServer(metrics, config.metrics_host, config.metrics_port)
+            await self.metrics_server.start()
+        if self.health_reporter:
+            self._health_task = asyncio.create_task(self.health_reporter.run())
         # Register dynamic buttons, so they still work after the bot restarts.
-        self.add_dynamic_items(DynamicRerollButton, DynamicFreeRerollButton, DynamicAllInButton)
+        self.add_dynamic_items(DynamicRerollButton, DynamicFreeRerollButton, DynamicAllInButton, DynamicAdviseButton)
         if self.dev_guild:
             self.tree.copy_global_to(guild=self.dev_guild)
-        await self.tree.sync(guild=self.dev_guild)
+        if self.sync_commands:
+            await sync_commands(
+                self.tree, self.dev_guild, CommandSyncState(config.command_sync_state), self.force_sync)
+
+    async def close(self):
+        """Flush the channel settings, roll journal, and roll statistics before shutting down.
+
+        Also stops the compute pool and the metrics server.
+        """
+        if self._health_task:
+            self._health_task.cancel()
+        await channel_settings.close()
+        await roll_journal.close()
+        await roll_stats.close()
+        compute_pool.shutdown()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await super().close()
+
+
+class MyClient(BotClientMixin, discord.Client):
+    """The bot's client, with a single gateway connection for all guilds."""
+
+
+class MyShardedClient(BotClientMixin, discord.AutoShardedClient):
+    """The bot's client, with a gateway connection per shard.
+
+    Without shard_ids and shard_count, connects all shards recommended by
+    Discord. A shard cluster passes a range of shards to each worker.
+    """
 
 def generate_dice_set_choices():
     """Dynamically generate the dice set choices for the /settings command."""
@@ -45,13 +128,26 @@ def generate_dice_set_choices():
         for dice_set in DiceSet
     ]
 
-def main():
-    client = MyClient(intents=discord.Intents.default())
+def generate_strategy_choices():
+    """Generate the strategy choices for the /simulate command."""
+    return [
+        app_commands.Choice(name=name, value=strategy.value)
+        for strategy, name in STRATEGY_NAMES.items()
+    ]
+
+def generate_stats_scope_choices():
+    """Generate the scope choices for the /stats command."""
+    return [
+        app_commands.Choice(name='User', value='user'),
+        app_commands.Choice(name='Channel', value='channel'),
+        app_commands.Choice(name='Server', value='guild'),
+    ]
 
+def register_commands(client: BotClientMixin):
+    """Registers the bot's slash commands and event handlers with the client."""
     @client.event
     async def on_ready():
-        print(f'Logged in as {client.user} (ID: {client.user.id})')
-        print('------')
+        logger.info('Logged in as %s (ID: %d)', client.user, client.user.id)
 
     @client.tree.command()
     @app_commands.describe(
@@ -64,6 +160,33 @@ def main():
         """Set the channel settings, such as the dice set."""
         await SettingsController().handle_settings(interaction, dice_set)
 
+    diceset = app_commands.Group(
+        name='diceset', description='Manage the custom dice sets of this server.', guild_only=True)
+
+    @diceset.command()
+    @app_commands.describe(
+        name='The name of the dice set',
+        emoji='Six emoji for the faces 1 to 6, separated by spaces',
+    )
+    async def create(interaction: discord.Interaction, name: str, emoji: str):
+        """Create a dice set with your own emoji, or replace one of the same name."""
+        await DiceSetController().handle_create(interaction, name, emoji)
+
+    @diceset.command()
+    @app_commands.describe(
+        name='The name of the dice set',
+    )
+    async def use(interaction: discord.Interaction, name: str):
+        """Use one of this server's dice sets in this channel."""
+        await DiceSetController().handle_use(interaction, name)
+
+    @diceset.command(name='list')
+    async def list_dice_sets(interaction: discord.Interaction):
+        """List this server's dice sets."""
+        await DiceSetController().handle_list(interaction)
+
+    client.tree.add_command(diceset)
+
     @client.tree.command()
     async def help(interaction: discord.Interaction):
         """Outputs help text."""
@@ -77,6 +200,47 @@ def main():
         """Roll a number of Octane dice."""
         await RollController().handle_roll(interaction, dice)
 
+    @client.tree.command()
+    @app_commands.describe(
+        dice='The number of dice to roll',
+    )
+    async def odds(interaction: discord.Interaction, dice: int):
+        """Show the odds of rolling a number of Octane dice."""
+        await OddsController().handle_odds(interaction, dice)
+
+    @client.tree.command()
+    @app_commands.describe(
+        dice='The number of dice to roll',
+        strategy='The re-rolls to perform whenever they are allowed',
+        trials='The number of rolls to simulate',
+    )
+    @app_commands.choices(
+        strategy=generate_strategy_choices(),
+    )
+    async def simulate(interaction: discord.Interaction, dice: int, strategy: str, trials: int = 100_000):
+        """Simulate many rolls of Octane dice using a re-roll strategy."""
+        await SimulateController().handle_simulate(interaction, dice, strategy, trials)
+
+    @client.tree.command()
+    @app_commands.describe(
+        dice='The faces of the rolled dice, e.g. 1 1 3 4 6',
+    )
+    async def advise(interaction: discord.Interaction, dice: str):
+        """Show the expected results of keeping or re-rolling a roll of Octane dice."""
+        await AdviseController().handle_advise(interaction, dice)
+
+    @client.tree.command()
+    @app_commands.describe(
+        scope='Whose rolls to show the statistics of',
+        user='The user to show the statistics of, defaulting to yourself',
+    )
+    @app_commands.choices(
+        scope=generate_stats_scope_choices(),
+    )
+    async def stats(interaction: discord.Interaction, scope: str = 'user', user: discord.User | None = None):
+        """Show the roll statistics of a user, this channel, or this server."""
+        await StatsController().handle_stats(interaction, scope, user.id if user else None)
+
     @client.tree.command()
     async def coin(interaction: discord.Interaction):
         """Flip a coin."""
@@ -87,7 +251,23 @@ def main():
         """Roll a d6."""
         await D6Controller().handle_d6(interaction)
 
-    client.run(config.token)
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run the Discord bot.')
+    parser.add_argument('--force-sync', action='store_true',
+                        help='Sync the commands with Discord, even if they did not change since the last sync')
+    parser.add_argument('--sharded', action='store_true',
+                        help='Connect the number of shards recommended by Discord, rather than a single connection')
+    args = parser.parse_args(argv)
+
+    log_listener = setup_logging(config.log_level, config.log_sample_rates)
+    client_class = MyShardedClient if args.sharded else MyClient
+    client = client_class(intents=discord.Intents.default(), force_sync=args.force_sync)
+    register_commands(client)
+    try:
+        # Our logging setup also handles discord.py's records.
+        client.run(config.token, log_handler=None)
+    finally:
+        log_listener.stop()
 
 if __name__ == '__main__':
     main()
@@ -1,38 +1,396 @@
-"""Encapsulates the user specified settings for a channel."""
+"""Encapsulates the user specified settings for a channel.
 
+The backends also store the guilds' custom dice sets (see bot.custom_dice).
+Settings are kept in a pluggable backend (SQLite by default). Reads are served
+from an in-process LRU cache, and writes are batched and flushed to the backend
+in the background, so the event loop never waits on disk I/O for a cache hit.
+
+Several processes (e.g. the workers of a shard cluster) may share the same
+SQLite database. Each process polls the database for changes made by the
+others, and drops its cache when there are any (see ChannelSettings.refresh).
+"""
+
+import asyncio
+import logging
+import os
 import shelve
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from bot.config import config
-from bot.dice import DiceSet
+from bot.dice import CustomDiceSet, DiceSet, custom_dice_set_id
+from bot.lazy import Lazy
 
-class ChannelSettings:
-    """Encapsulates the user specified settings for a channel."""
+logger = logging.getLogger(__name__)
+
+# The number of seconds to wait for another process's lock on the database
+BUSY_TIMEOUT = 10.0
+
+
+class SettingsBackend(ABC):
+    """Persistent storage for channel settings.
+
+    Backends are async so that implementations can move their I/O off the
+    event loop.
+    """
+    @abstractmethod
+    async def get_dice_set(self, channel_id: int) -> DiceSet | CustomDiceSet | None:
+        """Return the stored dice set for the channel, or None if not set."""
+
+    @abstractmethod
+    async def set_dice_sets(self, dice_sets: dict[int, DiceSet | CustomDiceSet]):
+        """Store the dice sets for multiple channels in a single batch."""
+
+    @abstractmethod
+    async def get_custom_dice_sets(self, guild_id: int) -> list[CustomDiceSet]:
+        """Return the guild's custom dice sets, without the ones replaced by a newer set of the same name."""
+
+    @abstractmethod
+    async def get_custom_dice_set(self, id: int) -> CustomDiceSet | None:
+        """Return the custom dice set with the given ID, or None if there is none."""
+
+    @abstractmethod
+    async def add_custom_dice_set(self, guild_id: int, name: str, emoji: tuple[str, ...]) -> CustomDiceSet:
+        """Store a new custom dice set, which replaces the guild's set of the same name, if any."""
+
+    async def data_version(self) -> int | None:
+        """Return a number that changes whenever another process changed the settings.
+
+        Returns None if the backend isn't shared with other processes.
+        """
+        return None
+
+    async def close(self):
+        """Release any resources held by the backend."""
+
+
+class InMemorySettingsBackend(SettingsBackend):
+    """Keeps the settings in a dictionary. Useful for tests and load testing."""
     def __init__(self):
-        self.db = shelve.open(config.channel_settings_db)
-    
-    def __del__(self):
-        self.db.close()
+        self.dice_sets = {}
+        self.custom_dice_sets = {}
+
+    async def get_dice_set(self, channel_id: int) -> DiceSet | CustomDiceSet | None:
+        return self.dice_sets.get(channel_id)
+
+    async def set_dice_sets(self, dice_sets: dict[int, DiceSet | CustomDiceSet]):
+        self.dice_sets.update(dice_sets)
+
+    async def get_custom_dice_sets(self, guild_id: int) -> list[CustomDiceSet]:
+        # Later sets replace earlier ones of the same name.
+        latest = {dice_set.name: dice_set for dice_set in self.custom_dice_sets.values()
+                  if dice_set.guild_id == guild_id}
+        return sorted(latest.values(), key=lambda dice_set: dice_set.name)
+
+    async def get_custom_dice_set(self, id: int) -> CustomDiceSet | None:
+        return self.custom_dice_sets.get(id)
+
+    async def add_custom_dice_set(self, guild_id: int, name: str, emoji: tuple[str, ...]) -> CustomDiceSet:
+        dice_set = CustomDiceSet(len(self.custom_dice_sets) + 1, guild_id, name, emoji)
+        self.custom_dice_sets[dice_set.id] = dice_set
+        return dice_set
+
+
+class SqliteSettingsBackend(SettingsBackend):
+    """Stores the settings in an SQLite database in WAL mode.
+
+    All database access happens on a single dedicated thread, which owns the
+    connection. The connection is opened lazily on first use.
+
+    The database may be shared by several processes. WAL mode lets readers
+    and a writer work concurrently, and writers wait for each other's locks
+    (up to the busy timeout) instead of failing.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-settings')
+
+    async def get_dice_set(self, channel_id: int) -> DiceSet | CustomDiceSet | None:
+        value = await self._run(self._get_dice_set, channel_id)
+        if not value:
+            return None
+        id = custom_dice_set_id(value)
+        return DiceSet(value) if id is None else await self.get_custom_dice_set(id)
+
+    async def set_dice_sets(self, dice_sets: dict[int, DiceSet | CustomDiceSet]):
+        await self._run(self._set_dice_sets, {k: v.value for k, v in dice_sets.items()})
+
+    async def get_custom_dice_sets(self, guild_id: int) -> list[CustomDiceSet]:
+        rows = await self._run(self._get_custom_dice_sets, guild_id)
+        return [CustomDiceSet(id, guild_id, name, emoji.split()) for id, name, emoji in rows]
+
+    async def get_custom_dice_set(self, id: int) -> CustomDiceSet | None:
+        row = await self._run(self._get_custom_dice_set, id)
+        return CustomDiceSet(id, row[0], row[1], row[2].split()) if row else None
+
+    async def add_custom_dice_set(self, guild_id: int, name: str, emoji: tuple[str, ...]) -> CustomDiceSet:
+        id = await self._run(self._add_custom_dice_set, guild_id, name, ' '.join(emoji))
+        return CustomDiceSet(id, guild_id, name, emoji)
+
+    async def is_migrated(self, source: str) -> bool:
+        """Returns true if the given source has already been migrated."""
+        return await self._run(self._is_migrated, source)
+
+    async def import_dice_sets(self, source: str, dice_sets: dict[int, DiceSet]):
+        """Imports dice sets from another store and marks the source as migrated.
+
+        Existing values take precedence over imported ones.
+        """
+        await self._run(self._import_dice_sets, source, {k: v.value for k, v in dice_sets.items()})
+
+    async def data_version(self) -> int | None:
+        return await self._run(self._data_version)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
 
-    def get_dice_set(self, channel_id: int) -> DiceSet:
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS channel_settings ('
+                'channel_id INTEGER PRIMARY KEY, dice_set TEXT NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS migrations (source TEXT PRIMARY KEY)')
+            # The emoji of the faces 1 to 6, separated by spaces
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS custom_dice_sets ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, '
+                'name TEXT NOT NULL, emoji TEXT NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS custom_dice_sets_by_guild ON custom_dice_sets (guild_id, name)')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _get_dice_set(self, channel_id: int) -> str | None:
+        row = self._connect().execute(
+            'SELECT dice_set FROM channel_settings WHERE channel_id = ?', (channel_id,)).fetchone()
+        return row[0] if row else None
+
+    def _set_dice_sets(self, dice_sets: dict[int, str]):
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT INTO channel_settings (channel_id, dice_set) VALUES (?, ?) '
+                'ON CONFLICT(channel_id) DO UPDATE SET dice_set = excluded.dice_set',
+                dice_sets.items())
+
+    def _get_custom_dice_sets(self, guild_id: int) -> list[tuple[int, str, str]]:
+        # The newest set of each name replaces the older ones. With a single MAX() aggregate,
+        # SQLite takes the other columns from the row with the largest id.
+        return self._connect().execute(
+            'SELECT MAX(id), name, emoji FROM custom_dice_sets WHERE guild_id = ? GROUP BY name ORDER BY name',
+            (guild_id,)).fetchall()
+
+    def _get_custom_dice_set(self, id: int) -> tuple[int, str, str] | None:
+        return self._connect().execute(
+            'SELECT guild_id, name, emoji FROM custom_dice_sets WHERE id = ?', (id,)).fetchone()
+
+    def _add_custom_dice_set(self, guild_id: int, name: str, emoji: str) -> int:
+        with self._connect() as connection:
+            return connection.execute(
+                'INSERT INTO custom_dice_sets (guild_id, name, emoji) VALUES (?, ?, ?)',
+                (guild_id, name, emoji)).lastrowid
+
+    def _data_version(self) -> int:
+        # Changes whenever another connection commits a change to the database.
+        return self._connect().execute('PRAGMA data_version').fetchone()[0]
+
+    def _is_migrated(self, source: str) -> bool:
+        row = self._connect().execute('SELECT 1 FROM migrations WHERE source = ?', (source,)).fetchone()
+        return row is not None
+
+    def _import_dice_sets(self, source: str, dice_sets: dict[int, str]):
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO channel_settings (channel_id, dice_set) VALUES (?, ?)',
+                dice_sets.items())
+            connection.execute('INSERT OR IGNORE INTO migrations (source) VALUES (?)', (source,))
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ChannelSettings:
+    """Encapsulates the user specified settings for a channel.
+
+    Wraps a settings backend with an LRU read cache and write-behind batching.
+
+    Attributes:
+        backend: The backend that persists the settings.
+    """
+    def __init__(self, backend: SettingsBackend, cache_size: int = 10000, cache_ttl: float = 3600,
+                 flush_delay: float = 1.0, max_batch_size: int = 100):
+        """Initializes the channel settings.
+
+        Args:
+            backend: The backend that persists the settings.
+            cache_size: The maximum number of channels to keep in the read cache.
+            cache_ttl: The number of seconds a cached value stays valid.
+            flush_delay: The number of seconds to wait before flushing pending writes.
+            max_batch_size: The number of pending writes that triggers an immediate flush.
+        """
+        self.backend = backend
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.flush_delay = flush_delay
+        self.max_batch_size = max_batch_size
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._flush_task = None
+        self._refresh_task = None
+        self._data_version = None
+
+    def get_cached_dice_set(self, channel_id: int) -> DiceSet | CustomDiceSet | None:
+        """Return the dice set for the channel if it is cached, without any I/O."""
+        entry = self._cache.get(channel_id)
+        if entry is None:
+            return None
+        dice_set, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[channel_id]
+            return None
+        self._cache.move_to_end(channel_id)
+        return dice_set
+
+    async def get_dice_set(self, channel_id: int) -> DiceSet | CustomDiceSet:
         """Return the dice set for the channel.
-        
+
         Args:
             channel_id: The ID of the channel.
-        
+
         Returns:
             The dice set for the channel, defaulting to the Octane dice set.
         """
-        return self.db.get(str(channel_id), DiceSet.OCTANE)
-    
-    def set_dice_set(self, channel_id: int, dice_set: DiceSet):
+        dice_set = self.get_cached_dice_set(channel_id) or self._pending.get(channel_id)
+        if dice_set is None:
+            dice_set = await self.backend.get_dice_set(channel_id) or DiceSet.OCTANE
+        self._cache_dice_set(channel_id, dice_set)
+        return dice_set
+
+    async def set_dice_set(self, channel_id: int, dice_set: DiceSet | CustomDiceSet):
         """Set the dice set for the channel.
-        
+
+        The new value is visible immediately, but only written to the backend
+        with the next batch.
+
         Args:
             channel_id: The ID of the channel.
             dice_set: The dice set for the channel.
         """
-        print(f'Setting dice set for channel {channel_id}:', dice_set)
-        self.db[str(channel_id)] = dice_set
+        logger.info('Setting dice set for channel %d to %s', channel_id, dice_set.value)
+        self._cache_dice_set(channel_id, dice_set)
+        self._pending[channel_id] = dice_set
+        if len(self._pending) >= self.max_batch_size:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """Write all pending changes to the backend."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self.backend.set_dice_sets(pending)
+        except Exception:
+            # Keep the changes around for the next attempt, unless they were overwritten since.
+            self._pending = pending | self._pending
+            raise
+
+    async def refresh(self):
+        """Clear the cache if another process changed the settings since the last refresh."""
+        data_version = await self.backend.data_version()
+        if self._data_version is not None and data_version != self._data_version:
+            self._cache.clear()
+        self._data_version = data_version
+
+    def start_refresh(self, interval: float):
+        """Start refreshing the cache periodically, see refresh."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically(interval))
+
+    async def close(self):
+        """Flush any pending changes and close the backend."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.backend.close()
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_delay)
+            self._flush_task = None
+            await self.flush()
+        except Exception as e:
+            logger.error('Failed to flush channel settings: %s', e)
+
+    async def _refresh_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error('Failed to refresh channel settings: %s', e)
+
+    def _cache_dice_set(self, channel_id: int, dice_set: DiceSet | CustomDiceSet):
+        self._cache[channel_id] = (dice_set, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(channel_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+async def migrate_shelve(shelve_path: str, backend: SqliteSettingsBackend) -> int:
+    """Imports the settings from a legacy shelve database into the backend.
+
+    The migration only runs once per shelve file. Settings that already exist in
+    the backend are not overwritten.
+
+    Args:
+        shelve_path: The path of the shelve database, as passed to shelve.open.
+        backend: The backend to import the settings into.
+
+    Returns:
+        The number of imported settings.
+    """
+    source = f'shelve:{os.path.abspath(shelve_path)}'
+    if await backend.is_migrated(source):
+        return 0
+    dice_sets = await asyncio.to_thread(_read_shelve, shelve_path)
+    if dice_sets is None:
+        return 0
+    await backend.import_dice_sets(source, dice_sets)
+    logger.info('Migrated %d channel settings from %s', len(dice_sets), shelve_path)
+    return len(dice_sets)
+
+
+def _read_shelve(shelve_path: str) -> dict[int, DiceSet] | None:
+    """Reads all dice sets from a shelve database, or returns None if it doesn't exist."""
+    try:
+        db = shelve.open(shelve_path, flag='r')
+    except Exception:
+        return None
+    with db:
+        return {int(channel_id): DiceSet(dice_set) for channel_id, dice_set in db.items()}
 
 
-channel_settings = ChannelSettings()
+channel_settings = Lazy(lambda: ChannelSettings(
+    SqliteSettingsBackend(config.channel_settings_sqlite),
+    cache_size=config.channel_settings_cache_size,
+    cache_ttl=config.channel_settings_cache_ttl))
@@ -0,0 +1,356 @@
+"""Runs the bot as a cluster of worker processes, each owning a range of shards.
+
+A single client handles all guilds on one gateway connection and one CPU core.
+The cluster splits the shards into contiguous ranges, and starts a worker
+process with a sharded client (see bot.bot.MyShardedClient) for each range.
+
+The supervisor (the launching process) restarts workers that exit or stop
+reporting, with an exponential backoff. Each worker periodically reports the
+latency of its shards to the supervisor, which logs a health summary. The
+workers share the SQLite channel settings database (see bot.channel_settings).
+
+Usage: python -m bot.cluster [--workers N] [--shards N] [--force-sync]
+"""
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from bot.config import config
+from bot.log import setup_logging
+from bot.metrics import shard_latency_seconds
+
+logger = logging.getLogger(__name__)
+
+# How often workers report the health of their shards, in seconds
+HEALTH_INTERVAL = 10.0
+# The number of seconds without a report after which a worker is restarted
+STALL_TIMEOUT = 120.0
+# The latency above which a shard counts as unhealthy, in seconds
+MAX_HEALTHY_LATENCY = 5.0
+# How often the supervisor logs a health summary, in seconds
+SUMMARY_INTERVAL = 60.0
+# The delay before restarting a worker, which doubles with every consecutive failure
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+# Workers that ran at least this many seconds count as healthy, resetting the backoff
+STABLE_UPTIME = 60.0
+
+
+def shard_ranges(shard_count: int, workers: int) -> list[list[int]]:
+    """Splits the shards into contiguous ranges of (almost) equal size, one per worker."""
+    if shard_count < 1 or workers < 1:
+        raise ValueError('The number of shards and workers must be at least 1.')
+    workers = min(workers, shard_count)
+    size, remainder = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker_id in range(workers):
+        end = start + size + (1 if worker_id < remainder else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class HealthReporter:
+    """Periodically reports the latency of a client's shards to the supervisor.
+
+    Works with any client that has a shards dictionary of discord.ShardInfo
+    (or equivalent) objects, such as discord.AutoShardedClient.
+
+    Attributes:
+        client: The sharded client.
+        health_queue: The queue to put the reports on.
+        worker_id: The id of the worker the client runs in.
+        interval: The number of seconds between reports.
+    """
+    def __init__(self, client, health_queue, worker_id: int, interval: float = HEALTH_INTERVAL):
+        self.client = client
+        self.health_queue = health_queue
+        self.worker_id = worker_id
+        self.interval = interval
+
+    def report(self) -> dict:
+        """Returns the health of the client's shards, and records their latency in the metrics."""
+        shards = {}
+        for shard_id, shard in self.client.shards.items():
+            shards[shard_id] = {'latency': shard.latency, 'closed': shard.is_closed()}
+            shard_latency_seconds.set(shard.latency, str(shard_id))
+        return {'worker_id': self.worker_id, 'pid': os.getpid(), 'shards': shards}
+
+    async def run(self):
+        while True:
+            self.health_queue.put(self.report())
+            await asyncio.sleep(self.interval)
+
+
+class ShardHealth:
+    """The last reported health of a shard.
+
+    Attributes:
+        worker_id: The worker that owns the shard.
+        latency: The shard's gateway latency in seconds, or nan/inf if unknown.
+        closed: Whether the shard's connection is closed.
+        reported_at: When the report was received, in time.monotonic() seconds.
+    """
+    def __init__(self, worker_id: int, latency: float, closed: bool, reported_at: float):
+        self.worker_id = worker_id
+        self.latency = latency
+        self.closed = closed
+        self.reported_at = reported_at
+
+    def is_healthy(self, now: float, stale_after: float) -> bool:
+        return (not self.closed and math.isfinite(self.latency) and self.latency <= MAX_HEALTHY_LATENCY
+                and now - self.reported_at <= stale_after)
+
+
+class Worker:
+    """A worker process of the cluster.
+
+    Attributes:
+        worker_id: The index of the worker.
+        shard_ids: The shards the worker owns.
+        process: The current process, or None while waiting for a restart.
+        started_at: When the current process was started.
+        last_report_at: When the current process last reported its health.
+        restarts: The number of times the worker was restarted.
+        failures: The number of consecutive short-lived runs, for the backoff.
+        restart_at: When to restart the worker, if it's waiting for a restart.
+    """
+    def __init__(self, worker_id: int, shard_ids: list[int]):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = 0.0
+        self.last_report_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at = None
+
+
+class ClusterSupervisor:
+    """Starts the worker processes, restarts them when needed, and collects their health.
+
+    Each worker runs target(worker_id, shard_ids, shard_count, health_queue,
+    *target_args) in a separate process. The target must be a picklable,
+    module level function.
+
+    Attributes:
+        shard_count: The total number of shards.
+        workers: The workers, in order of their shard ranges.
+        shard_health: A dictionary that maps each shard id to its last reported health.
+    """
+    def __init__(self, target, shard_count: int, workers: int, target_args: tuple = (),
+                 health_interval: float = HEALTH_INTERVAL, stall_timeout: float = STALL_TIMEOUT,
+                 restart_delay: float = RESTART_DELAY, max_restart_delay: float = MAX_RESTART_DELAY,
+                 summary_interval: float = SUMMARY_INTERVAL):
+        self.target = target
+        self.target_args = target_args
+        self.shard_count = shard_count
+        self.health_interval = health_interval
+        self.stall_timeout = stall_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.summary_interval = summary_interval
+        self.workers = [Worker(worker_id, shard_ids)
+                        for worker_id, shard_ids in enumerate(shard_ranges(shard_count, workers))]
+        self.shard_health = {}
+        # Workers start from a fresh interpreter, rather than forking the supervisor.
+        self._context = multiprocessing.get_context('spawn')
+        self._health_queue = self._context.Queue()
+        self._stopping = False
+        self._next_summary_at = 0.0
+
+    def start(self):
+        """Starts all worker processes."""
+        for worker in self.workers:
+            self._start_worker(worker)
+        self._next_summary_at = time.monotonic() + self.summary_interval
+
+    def run(self, duration: float | None = None):
+        """Starts the workers and supervises them until stopped, or for the given number of seconds."""
+        self.start()
+        deadline = None if duration is None else time.monotonic() + duration
+        try:
+            while not self._stopping and (deadline is None or time.monotonic() < deadline):
+                self.poll(timeout=min(1.0, self.health_interval))
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """Makes run return after the current poll. Safe to call from a signal handler."""
+        self._stopping = True
+
+    def poll(self, timeout: float = 1.0):
+        """Collects the health reports, and restarts workers that exited or stalled."""
+        self._receive_reports(timeout)
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if not self._stopping and now >= worker.restart_at:
+                    worker.restarts += 1
+                    self._start_worker(worker)
+            elif not worker.process.is_alive():
+                logger.warning('Worker %d (shards %s) exited with code %s',
+                               worker.worker_id, _format_shards(worker.shard_ids), worker.process.exitcode)
+                self._schedule_restart(worker, now)
+            elif now - max(worker.started_at, worker.last_report_at) > self.stall_timeout:
+                logger.warning('Worker %d (shards %s) stopped reporting, restarting it',
+                               worker.worker_id, _format_shards(worker.shard_ids))
+                _terminate(worker.process)
+                self._schedule_restart(worker, now)
+        if now >= self._next_summary_at:
+            self.log_summary()
+            self._next_summary_at = now + self.summary_interval
+
+    def unhealthy_shards(self) -> list[int]:
+        """Returns the shards that are closed, slow, or haven't reported recently."""
+        now = time.monotonic()
+        stale_after = 3 * self.health_interval
+        return [
+            shard_id for shard_id in range(self.shard_count)
+            if shard_id not in self.shard_health or not self.shard_health[shard_id].is_healthy(now, stale_after)
+        ]
+
+    def log_summary(self):
+        latencies = [health.latency for health in self.shard_health.values() if math.isfinite(health.latency)]
+        unhealthy = self.unhealthy_shards()
+        logger.info('Cluster health: %d of %d shards healthy, max latency %.0f ms, %d restarts',
+                    self.shard_count - len(unhealthy), self.shard_count, max(latencies, default=0) * 1000,
+                    sum(worker.restarts for worker in self.workers),
+                    extra={'unhealthy_shards': unhealthy})
+
+    def shutdown(self):
+        """Stops all worker processes."""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None:
+                _terminate(worker.process)
+                worker.process = None
+        self._health_queue.close()
+
+    def _start_worker(self, worker: Worker):
+        worker.process = self._context.Process(
+            target=self.target,
+            args=(worker.worker_id, worker.shard_ids, self.shard_count, self._health_queue, *self.target_args),
+            name=f'cluster-worker-{worker.worker_id}',
+            daemon=True)
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.last_report_at = 0.0
+        worker.restart_at = None
+        logger.info('Started worker %d (shards %s) with pid %d',
+                    worker.worker_id, _format_shards(worker.shard_ids), worker.process.pid)
+
+    def _schedule_restart(self, worker: Worker, now: float):
+        if now - worker.started_at >= STABLE_UPTIME:
+            worker.failures = 0
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** worker.failures)
+        worker.failures += 1
+        worker.process = None
+        worker.restart_at = now + delay
+        for shard_id in worker.shard_ids:
+            self.shard_health.pop(shard_id, None)
+        logger.info('Restarting worker %d in %.1f s', worker.worker_id, delay)
+
+    def _receive_reports(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                report = self._health_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            now = time.monotonic()
+            worker = self.workers[report['worker_id']]
+            # Ignore late reports of a previous process of the worker.
+            if worker.process is None or worker.process.pid != report['pid']:
+                continue
+            worker.last_report_at = now
+            for shard_id, shard in report['shards'].items():
+                self.shard_health[shard_id] = ShardHealth(worker.worker_id, shard['latency'], shard['closed'], now)
+
+
+def run_worker(worker_id: int, shard_ids: list[int], shard_count: int, health_queue, force_sync: bool = False):
+    """Runs a sharded client for the given shards. The target of the cluster's worker processes."""
+    # Imported here, so the supervisor doesn't load the bot's commands.
+    import discord
+    from bot.bot import MyShardedClient, register_commands
+
+    log_listener = setup_logging(config.log_level, config.log_sample_rates)
+    if config.metrics_port:
+        # Each worker serves its own metrics.
+        config.metrics_port += worker_id
+    # Each worker journals the rolls of its own guilds.
+    config.process_name = f'worker{worker_id}'
+    # Each worker keeps the statistics of its own guilds.
+    config.stats_snapshot = f'{os.path.splitext(config.stats_snapshot)[0]}-{worker_id}.json'
+    # Only one worker needs to sync the commands.
+    client = MyShardedClient(
+        intents=discord.Intents.default(), shard_ids=shard_ids, shard_count=shard_count,
+        force_sync=force_sync, sync_commands=worker_id == 0)
+    register_commands(client)
+    client.health_reporter = HealthReporter(client, health_queue, worker_id)
+    try:
+        asyncio.run(_run_client(client))
+    finally:
+        log_listener.stop()
+
+
+async def _run_client(client):
+    # Unlike client.run, close the client gracefully when the supervisor terminates the worker,
+    # so that pending channel settings are flushed.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(client.close()))
+    async with client:
+        await client.start(config.token)
+
+
+async def recommended_shard_count(token: str) -> int:
+    """Asks Discord for the recommended number of shards."""
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get('https://discord.com/api/v10/gateway/bot',
+                               headers={'Authorization': f'Bot {token}'}) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+def _terminate(process, timeout: float = 10.0):
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+def _format_shards(shard_ids: list[int]) -> str:
+    return f'{shard_ids[0]}-{shard_ids[-1]}' if len(shard_ids) > 1 else str(shard_ids[0])
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run the Discord bot as a cluster of sharded worker processes.')
+    parser.add_argument('--workers', type=int, default=config.cluster_workers, help='The number of worker processes')
+    parser.add_argument('--shards', type=int, default=config.shard_count,
+                        help="The total number of shards, defaulting to Discord's recommendation")
+    parser.add_argument('--force-sync', action='store_true',
+                        help='Sync the commands with Discord, even if they did not change since the last sync')
+    args = parser.parse_args(argv)
+
+    log_listener = setup_logging(config.log_level, config.log_sample_rates)
+    try:
+        shard_count = args.shards or asyncio.run(recommended_shard_count(config.token))
+        logger.info('Starting %d shards in %d workers', shard_count, min(args.workers, shard_count))
+        supervisor = ClusterSupervisor(run_worker, shard_count, args.workers, target_args=(args.force_sync,))
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: supervisor.stop())
+        supervisor.run()
+    finally:
+        log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Syncs the application commands with Discord only when they changed.
+
+Syncing the command tree is a slow, rate limited API call. Instead of syncing
+on every start, we hash the payload that a sync would send (the names,
+descriptions, options, and choices of all commands), and remember the hash of
+the last successful sync in a small state file. If the hash is unchanged, the
+commands Discord knows about are already up to date.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+
+def command_signature(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> str:
+    """Returns a deterministic hash of the commands that a sync of the guild would register."""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command['type'], command['name']))
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class CommandSyncState:
+    """The command signatures of the last successful syncs, stored in a JSON file.
+
+    Attributes:
+        path: The path of the state file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def get(self, scope: str) -> str | None:
+        """Returns the signature of the last sync of the scope, if any."""
+        return self._load().get(scope)
+
+    def set(self, scope: str, signature: str):
+        """Remembers the signature of a successful sync of the scope."""
+        signatures = self._load()
+        signatures[scope] = signature
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # Write to a temporary file first, so readers never see a partial file.
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(signatures, f, indent=2, sort_keys=True)
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError as e:
+            logger.warning('Failed to store the command sync state: %s', e)
+
+    def _load(self) -> dict[str, str]:
+        try:
+            with open(self.path) as f:
+                signatures = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring invalid command sync state: %s', e)
+            return {}
+        return signatures if isinstance(signatures, dict) else {}
+
+
+async def sync_commands(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None,
+                        state: CommandSyncState, force: bool = False) -> bool:
+    """Syncs the commands of the guild (or the global commands) if they changed since the last sync.
+
+    Args:
+        tree: The command tree to sync.
+        guild: The guild to sync, or None to sync the global commands.
+        state: The signatures of the previous syncs.
+        force: Whether to sync even if the commands didn't change.
+
+    Returns:
+        True if the commands were synced.
+    """
+    scope = f'{tree.client.application_id}:{guild.id if guild else "global"}'
+    signature = command_signature(tree, guild)
+    if not force and state.get(scope) == signature:
+        logger.info('Commands for %s are up to date, skipping sync', scope)
+        return False
+    await tree.sync(guild=guild)
+    state.set(scope, signature)
+    logger.info('Synced commands for %s', scope)
+    return True
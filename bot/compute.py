@@ -0,0 +1,144 @@
+"""A process pool for CPU-heavy work, such as large rolls, odds, and simulations.
+
+Running such work directly on the event loop would block the gateway heartbeat
+and every other interaction. Instead, controllers submit jobs to the compute
+pool and await the result. The pool defers the interaction if a job is likely
+to exceed Discord's 3 second response window, and rejects new jobs once too
+many are pending, rather than letting them pile up.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import discord
+
+from bot.config import config
+from bot.lazy import Lazy
+
+# Discord requires a response to an interaction within 3 seconds. We defer well
+# before that, to leave time for the round trip to Discord.
+DEFER_AFTER_SECONDS = 2.0
+
+
+class ComputeBusyError(Exception):
+    """Raised when too many jobs are pending to accept a new one."""
+
+
+class ComputeTimeoutError(Exception):
+    """Raised when a job doesn't finish within its timeout."""
+
+
+class ComputePool:
+    """A bounded pool of worker processes for CPU-heavy jobs.
+
+    Jobs must be picklable, module level functions. Until the pool is started,
+    jobs run inline on the calling thread, which keeps tests and tools simple.
+
+    Attributes:
+        max_workers: The number of worker processes.
+        max_pending: The maximum number of jobs that may be running or queued.
+        timeout: The default number of seconds after which a job is abandoned.
+        pending: The number of jobs that are currently running or queued.
+    """
+    def __init__(self, max_workers: int, max_pending: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        """Starts the worker processes."""
+        if self._executor is None:
+            # Forking a process with a running event loop and helper threads is
+            # unsafe, so the workers start from a fresh interpreter instead.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def shutdown(self):
+        """Stops the worker processes, abandoning any queued jobs."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, interaction: discord.Interaction | None, func, *args,
+                  expected_seconds: float = 0, timeout: float | None = None):
+        """Runs a job in a worker process and returns its result.
+
+        If the job is expected to take longer than the response window, or is
+        still running when the window is about to close, the interaction is
+        deferred. Callers must then respond with a followup (see
+        controller.send_response and controller.edit_response).
+
+        Args:
+            interaction: The interaction to defer if needed, or None.
+            func: The module level function to run.
+            *args: The arguments to pass to the function.
+            expected_seconds: An estimate of how long the job will take.
+            timeout: The number of seconds after which the job is abandoned,
+                defaulting to the pool's timeout.
+
+        Raises:
+            ComputeBusyError: If too many jobs are already pending.
+            ComputeTimeoutError: If the job doesn't finish in time.
+        """
+        if self.pending >= self.max_pending:
+            raise ComputeBusyError(f'{self.pending} compute jobs are already pending.')
+        self.pending += 1
+        submitted = False
+        try:
+            if self._executor is None:
+                return func(*args)
+            deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+            if expected_seconds >= DEFER_AFTER_SECONDS:
+                await defer(interaction)
+            loop = asyncio.get_running_loop()
+            job = self._executor.submit(func, *args)
+            # A running job can't be interrupted, so a job that timed out keeps its worker busy, and stays
+            # pending until it finishes. The callback runs on one of the executor's threads.
+            job.add_done_callback(lambda job: self._job_done(loop))
+            submitted = True
+            future = asyncio.wrap_future(job)
+            done, _ = await asyncio.wait({future}, timeout=min(DEFER_AFTER_SECONDS, deadline - time.monotonic()))
+            if not done and time.monotonic() < deadline:
+                await defer(interaction)
+            try:
+                return await asyncio.wait_for(future, timeout=max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError as e:
+                # The job is cancelled if it is still queued. If it is running, its result is simply discarded.
+                raise ComputeTimeoutError('The compute job timed out.') from e
+        finally:
+            if not submitted:
+                self.pending -= 1
+
+    def _job_done(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The event loop was closed, e.g. on shutdown.
+            pass
+
+    def _release(self):
+        self.pending -= 1
+
+
+async def defer(interaction: discord.Interaction | None, ephemeral: bool = False):
+    """Defers the interaction, unless it has already been responded to.
+
+    The response to a deferred command replaces its "thinking" message, which
+    is only visible to the user if ephemeral is true.
+    """
+    if interaction is None or interaction.response.is_done():
+        return
+    if interaction.type == discord.InteractionType.component:
+        # Buttons update the original message later on.
+        await interaction.response.defer()
+    else:
+        await interaction.response.defer(thinking=True, ephemeral=ephemeral)
+
+
+compute_pool = Lazy(lambda: ComputePool(
+    max_workers=config.compute_workers,
+    max_pending=config.compute_max_pending,
+    timeout=config.compute_timeout))
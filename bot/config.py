@@ -1,26 +1,116 @@
 import os
 from dotenv import load_dotenv
 
+from bot.lazy import Lazy
+from bot.log import parse_sample_rates
+
 class Config:
     """Configuration for the bot.
 
-    Reads the configuration from the environment variables.
+    Reads the configuration from the environment variables. The shared config
+    is only created on first use, so importing the bot's modules doesn't
+    require any configuration.
 
     Attributes:
-        token: The Discord app's token.
+        token: The Discord app's token. Raises a ValueError on access if unset.
         dev_guild_id: The ID of the Discord server (aka guild) used for development.
         dev_mode: Whether the bot is running in development mode.
+        channel_settings_db: The legacy shelve database, migrated on startup if it exists.
+        channel_settings_sqlite: The SQLite database that stores the channel settings.
+        channel_settings_cache_size: The number of channels kept in the settings read cache.
+        channel_settings_cache_ttl: The number of seconds a cached channel setting stays valid.
+        channel_settings_refresh_interval: How often to check for settings changed by other processes, in seconds.
+        custom_dice_set_cache_size: The number of guilds whose custom dice sets are kept in memory.
+        odds_cache_dir: The directory that caches the computed roll odds.
+        journal_dir: The directory of the roll journal's segment files.
+        journal_segment_records: The number of rolls per journal segment file.
+        process_name: The name of this process among the processes that share the journal directory (the
+            workers of a shard cluster, or HTTP replicas), or None for a single process.
+        instance_id: The name of an HTTP replica, which must be unique among the replicas that share the
+            data files. Defaults to the host name and port.
+        stats_snapshot: The file that snapshots the running roll statistics.
+        stats_snapshot_interval: How often to snapshot the roll statistics, in seconds.
+        command_sync_state: The file that remembers which commands were last synced with Discord.
+        compute_workers: The number of worker processes for CPU-heavy jobs.
+        compute_max_pending: The number of pending CPU-heavy jobs at which new ones are rejected.
+        compute_timeout: The number of seconds after which a CPU-heavy job is abandoned.
+        metrics_port: The port of the Prometheus metrics endpoint, or None to disable it.
+        metrics_host: The address the metrics endpoint listens on.
+        log_level: The minimum level of the log records to write, e.g. 'INFO'.
+        log_sample_rates: The fraction of high-volume log records to keep, per level.
+        shard_count: The total number of shards of a shard cluster, or None to use Discord's recommendation.
+        cluster_workers: The number of worker processes of a shard cluster.
+        public_key: The Discord app's public key, to verify interactions received over HTTP. Raises a
+            ValueError on access if unset.
+        interactions_host: The address the HTTP interactions endpoint listens on.
+        interactions_port: The port of the HTTP interactions endpoint.
+        rng_seed: The seed to deal the dice from, to make the rolls reproducible, or None to use the
+            OS's randomness. It must be kept secret, as it makes the rerolls of a roll predictable.
+        advise_button: Whether to show an Advise button beside the reroll buttons of rolls.
     """
     def __init__(self):
         load_dotenv()
 
-        self.token = os.getenv('DISCORD_TOKEN')
-        if not self.token:
-            raise ValueError('DISCORD_TOKEN is not set in the environment variables.')
+        self._token = os.getenv('DISCORD_TOKEN')
 
         self.dev_guild_id = os.getenv('DEV_GUILD_ID')
         self.dev_mode = bool(self.dev_guild_id)
 
         self.channel_settings_db = os.getenv('CHANNEL_SETTINGS_DB', 'channel_settings.db')
+        self.channel_settings_sqlite = os.getenv(
+            'CHANNEL_SETTINGS_SQLITE', os.path.splitext(self.channel_settings_db)[0] + '.sqlite3')
+        self.channel_settings_cache_size = int(os.getenv('CHANNEL_SETTINGS_CACHE_SIZE', '10000'))
+        self.channel_settings_cache_ttl = float(os.getenv('CHANNEL_SETTINGS_CACHE_TTL', '3600'))
+        self.channel_settings_refresh_interval = float(os.getenv('CHANNEL_SETTINGS_REFRESH_INTERVAL', '1'))
+        self.custom_dice_set_cache_size = int(os.getenv('CUSTOM_DICE_SET_CACHE_SIZE', '1000'))
+
+        self.odds_cache_dir = os.getenv(
+            'ODDS_CACHE_DIR', os.path.join(os.path.dirname(self.channel_settings_db), 'odds_cache'))
+        self.journal_dir = os.getenv(
+            'JOURNAL_DIR', os.path.join(os.path.dirname(self.channel_settings_db), 'journal'))
+        self.journal_segment_records = int(os.getenv('JOURNAL_SEGMENT_RECORDS', '1000000'))
+        self.process_name = None
+        self.instance_id = os.getenv('INSTANCE_ID')
+        self.stats_snapshot = os.getenv(
+            'STATS_SNAPSHOT', os.path.join(os.path.dirname(self.channel_settings_db), 'roll_stats.json'))
+        self.stats_snapshot_interval = float(os.getenv('STATS_SNAPSHOT_INTERVAL', '300'))
+        self.command_sync_state = os.getenv(
+            'COMMAND_SYNC_STATE', os.path.join(os.path.dirname(self.channel_settings_db), 'command_sync.json'))
+
+        self.compute_workers = int(os.getenv('COMPUTE_WORKERS', '2'))
+        self.compute_max_pending = int(os.getenv('COMPUTE_MAX_PENDING', '16'))
+        self.compute_timeout = float(os.getenv('COMPUTE_TIMEOUT', '30'))
+
+        metrics_port = os.getenv('METRICS_PORT')
+        self.metrics_port = int(metrics_port) if metrics_port else None
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+
+        self.log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+        self.log_sample_rates = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', 'DEBUG=0.01,INFO=0.1'))
+
+        shard_count = os.getenv('SHARD_COUNT')
+        self.shard_count = int(shard_count) if shard_count else None
+        self.cluster_workers = int(os.getenv('CLUSTER_WORKERS', '2'))
+
+        self._public_key = os.getenv('DISCORD_PUBLIC_KEY')
+        self.interactions_host = os.getenv('INTERACTIONS_HOST', '0.0.0.0')
+        self.interactions_port = int(os.getenv('INTERACTIONS_PORT', '8080'))
+
+        rng_seed = os.getenv('RNG_SEED')
+        self.rng_seed = int(rng_seed) if rng_seed else None
+
+        self.advise_button = os.getenv('ADVISE_BUTTON', '').lower() in ('1', 'true', 'yes')
+
+    @property
+    def token(self) -> str:
+        if not self._token:
+            raise ValueError('DISCORD_TOKEN is not set in the environment variables.')
+        return self._token
+
+    @property
+    def public_key(self) -> str:
+        if not self._public_key:
+            raise ValueError('DISCORD_PUBLIC_KEY is not set in the environment variables.')
+        return self._public_key
 
-config = Config()
+config = Lazy(Config)
@@ -5,25 +5,275 @@ including generating the view for the roll command with buttons for rerolling,
 free rerolling, and going all in.
 """
 from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+import logging
 import re
+import time
 import discord
-from bot.dice import DiceSet
+from bot.advisor import MAX_ADVISE_DICE, parse_dice, strategy_advisor
+from bot.config import config
+from bot.custom_dice import custom_dice_sets, parse_emoji, parse_name
+from bot.dice import CustomDiceSet, DiceSet
 from bot.message import MessageGenerator, MessageParser
-from bot.roll import RollHistory, Roller
+from bot.odds import MAX_ODDS_DICE, RollOdds, odds_calculator
+from bot.simulate import MAX_SIMULATE_DICE, MAX_SIMULATE_TRIALS, Strategy, simulate
+from bot.rng import dice_source
+from bot.roll import RollHistory, RollPhase, Roller
+from bot.roll_state import encode_roll_history, decode_roll_history
 from bot.channel_settings import channel_settings
+from bot.compute import ComputeBusyError, ComputeTimeoutError, compute_pool, defer
+from bot.journal import roll_journal
+from bot.log import SAMPLED, log_interaction
+from bot.metrics import (
+    duplicate_presses,
+    edit_failures,
+    invalid_rerolls,
+    rate_limited_deferrals,
+    response_delay_seconds,
+    stage)
+from bot.ratelimit import RateLimitTracker, interaction_scopes, rate_limits
+from bot.stats import roll_stats
+
+logger = logging.getLogger(__name__)
 
 EMBED_COLOR = discord.Color.gold()
-
-def dice_set_for_interaction(interaction: discord.Interaction) -> DiceSet:
-    """Returns the dice set for the interaction's channel."""
-    dice_set = channel_settings.get_dice_set(interaction.channel_id)
-    print('Channel id:', interaction.channel_id)
-    print('Dice set:', dice_set)
+# Discord rejects custom ids that are longer than this.
+MAX_CUSTOM_ID_LENGTH = 100
+# Rolls with more dice than this are rolled and rendered in the compute pool.
+LARGE_ROLL_DICE = 500
+# Rough costs of CPU-heavy jobs, used to decide whether to defer upfront
+SECONDS_PER_ROLLED_DIE = 2e-6
+SECONDS_PER_SIMULATED_DIE = 3e-7
+# The number of messages and interactions remembered to detect duplicate button presses
+MAX_TRACKED_MESSAGES = 10000
+MAX_TRACKED_INTERACTIONS = 10000
+# The longest a response may wait for a rate limit before the interaction is deferred
+MAX_RESPONSE_WAIT_SECONDS = 1.0
+
+async def dice_set_for_interaction(interaction: discord.Interaction) -> DiceSet | CustomDiceSet:
+    """Returns the dice set for the interaction's channel.
+
+    Cache hits are served directly, without awaiting the settings backend.
+    """
+    with stage('settings'):
+        dice_set = channel_settings.get_cached_dice_set(interaction.channel_id)
+        if dice_set is None:
+            dice_set = await channel_settings.get_dice_set(interaction.channel_id)
+    logger.debug('Using dice set %s', dice_set.value, extra=SAMPLED)
     return dice_set
 
 
+class ResponseScheduler:
+    """Sends the responses to interactions, taking Discord's rate limits into account.
+
+    Before each response, asks the rate limit tracker how long the response
+    would have to wait. Usually, that's not at all. If it would miss the
+    interaction's response window, the interaction is deferred first, and the
+    response is sent as a followup once the limit resets.
+
+    Edits of a message never overlap, as the presses on a message are
+    handled one at a time (see ButtonPresses), so each edit simply waits for
+    the rate limit.
+
+    Attributes:
+        tracker: The rate limit tracker.
+        max_wait: The longest wait for a rate limit before an interaction is deferred, in seconds.
+        sleep: The coroutine function that waits for a rate limit to reset, e.g. one that advances the
+            tracker's fake clock in tests.
+    """
+    def __init__(self, tracker: RateLimitTracker, max_wait: float = MAX_RESPONSE_WAIT_SECONDS, sleep=asyncio.sleep):
+        self.tracker = tracker
+        self.max_wait = max_wait
+        self.sleep = sleep
+
+    async def send(self, interaction: discord.Interaction, **kwargs):
+        """Sends a message in response to the interaction, or a followup if it was deferred."""
+        await self._defer_if_rate_limited(interaction, 'send', ephemeral=kwargs.get('ephemeral', False))
+        await self._wait_for_rate_limit(interaction, 'send')
+        if interaction.response.is_done():
+            await interaction.followup.send(**kwargs)
+        else:
+            await interaction.response.send_message(**kwargs)
+
+    async def edit(self, interaction: discord.Interaction, **kwargs):
+        """Edits the interaction's message, using the followup API if it was deferred."""
+        await self._defer_if_rate_limited(interaction, 'edit')
+        await self._wait_for_rate_limit(interaction, 'edit')
+        if interaction.response.is_done():
+            await interaction.edit_original_response(**kwargs)
+        else:
+            await interaction.response.edit_message(**kwargs)
+
+    async def _defer_if_rate_limited(self, interaction: discord.Interaction, kind: str, ephemeral: bool = False):
+        """Defers the interaction if a rate limit would make its response miss the response window."""
+        if interaction.response.is_done():
+            return
+        delay = self.tracker.delay(interaction_scopes(interaction))
+        if delay > self.max_wait:
+            rate_limited_deferrals.inc(kind)
+            logger.info('Deferring the %s, rate limited for %.2f s', kind, delay)
+            await defer(interaction, ephemeral=ephemeral)
+
+    async def _wait_for_rate_limit(self, interaction: discord.Interaction, kind: str):
+        start = time.perf_counter()
+        scopes = interaction_scopes(interaction)
+        delay = self.tracker.delay(scopes)
+        while delay > 0:
+            await self.sleep(delay)
+            delay = self.tracker.delay(scopes)
+        response_delay_seconds.observe(time.perf_counter() - start, kind)
+
+
+response_scheduler = ResponseScheduler(rate_limits)
+
+
+async def send_response(interaction: discord.Interaction, **kwargs):
+    """Sends a message in response to the interaction, or a followup if it was deferred."""
+    await response_scheduler.send(interaction, **kwargs)
+
+
+async def edit_response(interaction: discord.Interaction, **kwargs):
+    """Edits the interaction's message, using the followup API if it was deferred."""
+    await response_scheduler.edit(interaction, **kwargs)
+
+
+async def run_compute_job(interaction: discord.Interaction, func, *args, expected_seconds: float = 0):
+    """Runs a job in the compute pool, deferring the interaction if needed.
+
+    If the pool is too busy, or the job times out, responds with an ephemeral
+    message explaining this, and returns None.
+    """
+    try:
+        return await compute_pool.run(interaction, func, *args, expected_seconds=expected_seconds)
+    except ComputeBusyError:
+        message = 'The bot is busy right now. Please try again in a moment.'
+    except ComputeTimeoutError:
+        message = 'Sorry, that took too long. Please try again with fewer dice.'
+    await send_response(interaction, content=message, ephemeral=True)
+    return None
+
+
+class ButtonPresses:
+    """Serializes the button presses on each message, and detects duplicate presses.
+
+    A double click, or a retried request, delivers several presses for the
+    same roll. Each would roll again and race to edit the message. Instead,
+    the presses on a message are handled one at a time, and a press is only
+    acknowledged if its interaction was already delivered, or if it applies
+    to a roll that an earlier press already replaced on the message.
+
+    Rerolls only ever add rolls to the roll history, so the number of rolls
+    identifies the version of a message. Only the most recently pressed
+    messages and the most recent interactions are remembered. Each process
+    remembers its own, so in a shard cluster or behind a load balancer,
+    duplicates are only detected within a process.
+    """
+    def __init__(self, max_messages: int = MAX_TRACKED_MESSAGES, max_interactions: int = MAX_TRACKED_INTERACTIONS):
+        self.max_messages = max_messages
+        self.max_interactions = max_interactions
+        self._locks = OrderedDict()
+        self._versions = OrderedDict()
+        self._interactions = OrderedDict()
+
+    def is_redelivery(self, interaction_id: int) -> bool:
+        """Returns true if the interaction was delivered before, and remembers it otherwise."""
+        if interaction_id in self._interactions:
+            return True
+        self._interactions[interaction_id] = None
+        if len(self._interactions) > self.max_interactions:
+            self._interactions.popitem(last=False)
+        return False
+
+    def lock(self, message_id: int) -> asyncio.Lock:
+        """Returns the lock that serializes the presses on the message."""
+        lock = self._locks.get(message_id)
+        if lock is None:
+            lock = self._locks[message_id] = asyncio.Lock()
+        self._locks.move_to_end(message_id)
+        while len(self._locks) > self.max_messages:
+            oldest_id, oldest = next(iter(self._locks.items()))
+            if oldest.locked():
+                # Keep the locks in use, the table shrinks again once they are released.
+                break
+            del self._locks[oldest_id]
+        return lock
+
+    def is_outdated(self, message_id: int, roll_history: RollHistory) -> bool:
+        """Returns true if the message was already updated past the given roll history."""
+        version = self._versions.get(message_id)
+        return version is not None and len(roll_history.rolls) < version
+
+    def updated(self, message_id: int, roll_history: RollHistory):
+        """Remembers that the message now shows the given roll history."""
+        self._versions[message_id] = len(roll_history.rolls)
+        self._versions.move_to_end(message_id)
+        if len(self._versions) > self.max_messages:
+            self._versions.popitem(last=False)
+
+
+button_presses = ButtonPresses()
+
+
+async def acknowledge_duplicate_press(interaction: discord.Interaction, reason: str):
+    """Responds to a duplicate button press with an ephemeral message, without rolling again."""
+    duplicate_presses.inc(reason)
+    logger.info('Ignoring duplicate button press (%s)', reason)
+    await send_response(interaction, content='This roll was already updated.', ephemeral=True)
+
+
+def record_roll(interaction: discord.Interaction, dice_set: DiceSet, roll_history: RollHistory):
+    """Records a finished roll, or reroll, in the roll journal and the roll statistics."""
+    roll_journal.record(roll_history, dice_set, guild_id=interaction.guild_id, channel_id=interaction.channel_id,
+                        user_id=interaction.user.id)
+    roll_stats.record(roll_history, guild_id=interaction.guild_id, channel_id=interaction.channel_id,
+                      user_id=interaction.user.id)
+
+
+def roll_embeds(pages: list[str]) -> list[discord.Embed]:
+    """Returns the embeds for the pages of a roll message."""
+    return [discord.Embed(description=page, color=EMBED_COLOR) for page in pages]
+
+
+def roll_job(num_dice: int, dice_set: DiceSet, key: int | None = None) -> tuple[RollHistory, list[str]]:
+    """Rolls the dice and renders the pages of the roll message. Runs in the compute pool.
+
+    Seeded rolls get their key from the bot's process, so it can be logged
+    there. The stage timings of jobs that run in a worker process are
+    recorded there, and not exposed. The 'compute' stage covers such jobs as
+    a whole.
+    """
+    roller = Roller(num_dice=num_dice, key=key)
+    with stage('roll'):
+        roller.roll()
+    with stage('render'):
+        pages = MessageGenerator(dice_set).generate_roll_pages(roller.roll_history)
+    return roller.roll_history, pages
+
+
+def reroll_job(roll_history: RollHistory, action: str, dice_set: DiceSet) -> tuple[RollHistory, list[str]]:
+    """Performs a reroll action and renders the pages of the roll message. Runs in the compute pool.
+
+    Args:
+        roll_history: The roll history to continue from.
+        action: The name of the Roller method to call, e.g. 'reroll'.
+        dice_set: The dice set to render the message with.
+    """
+    with stage('roll'):
+        getattr(Roller(roll_history=roll_history), action)()
+    with stage('render'):
+        pages = MessageGenerator(dice_set).generate_roll_pages(roll_history)
+    return roll_history, pages
+
+
+def odds_job(num_dice: int) -> RollOdds:
+    """Computes the roll odds. Runs in the compute pool."""
+    return odds_calculator.roll_odds(num_dice)
+
+
 class SettingsController:
     """Handles the settings command for the Octane bot."""
+    @log_interaction('settings')
     async def handle_settings(self, interaction: discord.Interaction, dice_set_str: str):
         """Handles the /settings Discord command.
 
@@ -35,13 +285,60 @@ class SettingsController:
             dice_set_short: The short string representation of the dice set.
         """
         dice_set = DiceSet(dice_set_str)
-        channel_settings.set_dice_set(interaction.channel_id, dice_set)
+        await channel_settings.set_dice_set(interaction.channel_id, dice_set)
         embed = discord.Embed(description=f'Set the dice set to {dice_set.value}', color=EMBED_COLOR)
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=embed)
+
+
+class DiceSetController:
+    """Handles the diceset commands for the Octane bot."""
+    @log_interaction('diceset_create')
+    async def handle_create(self, interaction: discord.Interaction, name: str, emoji: str):
+        """Handles the /diceset create Discord command.
+
+        Registers six emoji as a named dice set of the guild, replacing its
+        set of the same name, if any.
+        """
+        try:
+            dice_set = await custom_dice_sets.create(interaction.guild_id, parse_name(name), parse_emoji(emoji))
+        except ValueError as e:
+            await send_response(interaction, content=str(e), ephemeral=True)
+            return
+        description = (f'Created the dice set {dice_set.name}: {" ".join(dice_set.emoji)}\n'
+                       f'Use it in a channel with `/diceset use {dice_set.name}`.')
+        await send_response(interaction, embed=discord.Embed(description=description, color=EMBED_COLOR))
+
+    @log_interaction('diceset_use')
+    async def handle_use(self, interaction: discord.Interaction, name: str):
+        """Handles the /diceset use Discord command.
+
+        Sets the channel's dice set to one of the guild's custom dice sets.
+        """
+        dice_set = await custom_dice_sets.get(interaction.guild_id, name.strip())
+        if dice_set is None:
+            await send_response(interaction, content=f'This server has no dice set named {name}.', ephemeral=True)
+            return
+        await channel_settings.set_dice_set(interaction.channel_id, dice_set)
+        embed = discord.Embed(description=f'Set the dice set to {dice_set.name}', color=EMBED_COLOR)
+        await send_response(interaction, embed=embed)
+
+    @log_interaction('diceset_list')
+    async def handle_list(self, interaction: discord.Interaction):
+        """Handles the /diceset list Discord command.
+
+        Lists the guild's custom dice sets.
+        """
+        dice_sets = await custom_dice_sets.guild_dice_sets(interaction.guild_id)
+        if dice_sets:
+            description = '\n'.join(f'{name}: {" ".join(dice_set.emoji)}' for name, dice_set in dice_sets.items())
+        else:
+            description = 'This server has no dice sets yet. Create one with `/diceset create`.'
+        await send_response(interaction, embed=discord.Embed(description=description, color=EMBED_COLOR))
 
 
 class RollController:
     """Handles roll commands for the Octane bot."""
+    @log_interaction('roll')
     async def handle_roll(self, interaction: discord.Interaction, num_dice: int):
         """Handles the /roll Discord command.
 
@@ -49,66 +346,188 @@ class RollController:
         well as a view containing buttons for rerolling, free rerolling,
         and going all in.
         """
-        dice_set = dice_set_for_interaction(interaction)
-        roller = Roller(num_dice=num_dice)
-        roller.roll()
-        view = RollView(
-            user_id=interaction.user.id,
-            dice_set=dice_set,
-            can_reroll=roller.roll_history.can_reroll(),
-            can_free_reroll=roller.roll_history.can_free_reroll(),
-            can_go_all_in=roller.roll_history.can_go_all_in())
-        content = MessageGenerator(dice_set).generate_roll_message(roller.roll_history)
-        embed = discord.Embed(description=content, color=EMBED_COLOR)
-        await interaction.response.send_message(embed=embed, view=view)    
+        dice_set = await dice_set_for_interaction(interaction)
+        key = dice_source.new_key()
+        if key is not None:
+            logger.info('Rolling %d dice with key %d', num_dice, key)
+        if num_dice > LARGE_ROLL_DICE:
+            with stage('compute'):
+                result = await run_compute_job(
+                    interaction, roll_job, num_dice, dice_set, key,
+                    expected_seconds=num_dice * SECONDS_PER_ROLLED_DIE)
+            if result is None:
+                return
+            roll_history, pages = result
+        else:
+            roll_history, pages = roll_job(num_dice, dice_set, key)
+        with stage('view'):
+            view = RollView(user_id=interaction.user.id, dice_set=dice_set, roll_history=roll_history)
+        with stage('send'):
+            await send_response(interaction, embeds=roll_embeds(pages), view=view)
+        record_roll(interaction, dice_set, roll_history)
+
+
+class OddsController:
+    """Handles the odds command for the Octane bot."""
+    @log_interaction('odds')
+    async def handle_odds(self, interaction: discord.Interaction, num_dice: int):
+        """Handles the /odds Discord command.
+
+        Responds with a message containing the exact odds of rolling the given
+        number of dice.
+        """
+        if not 0 < num_dice <= MAX_ODDS_DICE:
+            await send_response(
+                interaction, content=f'The number of dice must be between 1 and {MAX_ODDS_DICE}.', ephemeral=True)
+            return
+        odds = odds_calculator.cached_roll_odds(num_dice)
+        if odds is None:
+            odds = await run_compute_job(interaction, odds_job, num_dice)
+            if odds is None:
+                return
+            odds_calculator.remember(odds)
+        embed = discord.Embed(description=MessageGenerator().generate_odds_message(odds), color=EMBED_COLOR)
+        await send_response(interaction, embed=embed)
+
+
+class SimulateController:
+    """Handles the simulate command for the Octane bot."""
+    @log_interaction('simulate')
+    async def handle_simulate(self, interaction: discord.Interaction, num_dice: int, strategy_str: str, trials: int):
+        """Handles the /simulate Discord command.
+
+        Responds with a message summarizing many simulated rolls that follow
+        the given reroll strategy.
+        """
+        if not 0 < num_dice <= MAX_SIMULATE_DICE:
+            await send_response(
+                interaction, content=f'The number of dice must be between 1 and {MAX_SIMULATE_DICE}.', ephemeral=True)
+            return
+        if not 0 < trials <= MAX_SIMULATE_TRIALS:
+            await send_response(
+                interaction, content=f'The number of trials must be between 1 and {MAX_SIMULATE_TRIALS:,}.',
+                ephemeral=True)
+            return
+        result = await run_compute_job(
+            interaction, simulate, num_dice, Strategy(strategy_str), trials,
+            expected_seconds=num_dice * trials * SECONDS_PER_SIMULATED_DIE)
+        if result is None:
+            return
+        embed = discord.Embed(description=MessageGenerator().generate_simulation_message(result), color=EMBED_COLOR)
+        await send_response(interaction, embed=embed)
+
+
+class AdviseController:
+    """Handles the advise command for the Octane bot."""
+    @log_interaction('advise')
+    async def handle_advise(self, interaction: discord.Interaction, dice: str):
+        """Handles the /advise Discord command.
+
+        Responds with the expected results of keeping the given initial roll,
+        and of each reroll the rules allow.
+        """
+        try:
+            roll = parse_dice(dice)
+        except ValueError as e:
+            await send_response(interaction, content=str(e), ephemeral=True)
+            return
+        roll_history = RollHistory()
+        roll_history.add_roll(RollPhase.INITIAL, roll)
+        message = MessageGenerator().generate_advice_message(strategy_advisor.advise(roll_history))
+        await send_response(interaction, embed=discord.Embed(description=message, color=EMBED_COLOR))
+
+
+class StatsController:
+    """Handles the stats command for the Octane bot."""
+    @log_interaction('stats')
+    async def handle_stats(self, interaction: discord.Interaction, scope: str, user_id: int | None = None):
+        """Handles the /stats Discord command.
+
+        Responds with the roll statistics of a user, the channel, or the guild.
+        These are kept up to date as rolls finish, so no roll history is read.
+
+        Args:
+            interaction: The Discord interaction.
+            scope: 'user', 'channel', or 'guild'.
+            user_id: The user to show the statistics of, defaulting to the user of the interaction.
+        """
+        if scope == 'user':
+            id = user_id or interaction.user.id
+            title = f'Roll statistics of <@{id}>'
+        elif scope == 'channel':
+            id = interaction.channel_id
+            title = 'Roll statistics of this channel'
+        else:
+            id = interaction.guild_id
+            if id is None:
+                await send_response(interaction, content='Server statistics are only available in a server.',
+                                    ephemeral=True)
+                return
+            title = 'Roll statistics of this server'
+        message = MessageGenerator().generate_stats_message(title, roll_stats.get(scope, id))
+        await send_response(interaction, embed=discord.Embed(description=message, color=EMBED_COLOR))
 
 
 class CoinController:
     """Handles the coin commands for the Octane bot."""
+    @log_interaction('coin')
     async def handle_coin(self, interaction: discord.Interaction):
         """Handles the /coin Discord command.
 
         Responds with a message containing the result of the coin flip.
         """
         embed = discord.Embed(description=MessageGenerator().generate_coin_message(), color=EMBED_COLOR)
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=embed)
 
 
 class D6Controller:
     """Handles the d6 command for the Octane bot."""
+    @log_interaction('d6')
     async def handle_d6(self, interaction: discord.Interaction):
         """Handles the /d6 Discord command.
 
         Responds with a message containing the result of the d6 roll.
         """
         embed = discord.Embed(description=MessageGenerator().generate_d6_message(), color=EMBED_COLOR)
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=embed)
 
 
 class HelpController:
     """Handles help commands for the Octane bot."""
+    @log_interaction('help')
     async def handle_help(self, interaction: discord.Interaction):
         """Handles the /help Discord command.
 
         Responds with a help message.
         """
         embed = discord.Embed(description=MessageGenerator().generate_help_message(), color=EMBED_COLOR)
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=embed)
 
 
 class RollView(discord.ui.View):
     """A view for the roll command.
 
-    Contains buttons for rerolling, free rerolling, and going all in.
+    Contains buttons for rerolling, free rerolling, and going all in, depending on
+    which of these the roll history allows, and optionally a button for advice
+    on which of them to pick (see config.advise_button).
+
+    The view only describes the message's components. It is stopped right
+    away, so discord.py doesn't keep it in its view store for the life of the
+    process. Presses are dispatched to the dynamic buttons registered in
+    MyClient.setup_hook instead, based on their custom ids.
     """
-    def __init__(self, user_id: int, dice_set: DiceSet, can_reroll: bool, can_free_reroll: bool, can_go_all_in: bool):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory):
         super().__init__(timeout=None)
-        if can_reroll:
-            self.add_item(DynamicRerollButton(user_id, dice_set))
-        if can_free_reroll:
-            self.add_item(DynamicFreeRerollButton(user_id, dice_set))
-        if can_go_all_in:
-            self.add_item(DynamicAllInButton(user_id, dice_set))
+        if roll_history.can_reroll():
+            self.add_item(DynamicRerollButton(user_id, dice_set, roll_history))
+        if roll_history.can_free_reroll():
+            self.add_item(DynamicFreeRerollButton(user_id, dice_set, roll_history))
+        if roll_history.can_go_all_in():
+            self.add_item(DynamicAllInButton(user_id, dice_set, roll_history))
+        if config.advise_button and self.children and roll_history.num_dice <= MAX_ADVISE_DICE:
+            self.add_item(DynamicAdviseButton(user_id, dice_set, roll_history))
+        # discord.py only stores views that are still listening.
+        self.stop()
 
 
 class AbstractDynamicButton(discord.ui.DynamicItem[discord.ui.Button], ABC, template=r''):
@@ -118,19 +537,31 @@ class AbstractDynamicButton(discord.ui.DynamicItem[discord.ui.Button], ABC, temp
     after the bot restarts. And we're extracting the common functionality into
     this abstract class.
 
+    The custom id encodes the roll history the button applies to, so the callback
+    can restore it without parsing the message. Buttons on messages sent before
+    the roll state was encoded (or whose state doesn't fit into the custom id)
+    fall back to parsing the message embed.
+
     Subclasses must implement the callback method.
     """
-    def __init__(self, user_id: int, dice_set: DiceSet, label: str, style: discord.ButtonStyle, custom_id: str):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory | None,
+                 label: str, style: discord.ButtonStyle, custom_id: str):
         self.user_id = user_id
         self.dice_set = dice_set
+        self.roll_history = roll_history
+        if roll_history is not None:
+            custom_id_with_state = f'{custom_id}:s:{encode_roll_history(roll_history)}'
+            if len(custom_id_with_state) <= MAX_CUSTOM_ID_LENGTH:
+                custom_id = custom_id_with_state
         super().__init__(
             discord.ui.Button(label=label, style=style, custom_id=custom_id))
 
     @classmethod
     async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /):
         user_id = int(match['user_id'])
-        dice_set = DiceSet(match['dice_set'])
-        return cls(user_id, dice_set)
+        dice_set = await custom_dice_sets.resolve(match['dice_set'])
+        roll_history = decode_roll_history(match['state']) if match['state'] else None
+        return cls(user_id, dice_set, roll_history)
 
     @abstractmethod
     async def callback(self, interaction: discord.Interaction):
@@ -140,83 +571,146 @@ class AbstractDynamicButton(discord.ui.DynamicItem[discord.ui.Button], ABC, temp
         if interaction.user.id == self.user_id:
             return True
         else:
-            await interaction.response.send_message('You cannot re-roll someone else\'s roll.', ephemeral=True)
+            await send_response(interaction, content='You cannot re-roll someone else\'s roll.', ephemeral=True)
             return False
 
-    async def _update_message(self, interaction: discord.Interaction, roll_history: RollHistory):
-        updated_view = RollView(
-            user_id=interaction.user.id,
-            dice_set=self.dice_set,
-            can_reroll=roll_history.can_reroll(),
-            can_free_reroll=roll_history.can_free_reroll(),
-            can_go_all_in=roll_history.can_go_all_in())
+    def _current_roll_history(self, interaction: discord.Interaction) -> RollHistory:
+        """Returns the roll history encoded in the custom id, or parses it from the message."""
+        if self.roll_history is not None:
+            return self.roll_history
+        with stage('parse'):
+            return MessageParser(interaction, self.dice_set).roll_history
+
+    async def _handle_press(self, interaction: discord.Interaction, action: str, is_allowed, error: str):
+        """Performs the reroll action of a button press, unless the press is a duplicate.
+
+        Args:
+            interaction: The Discord interaction.
+            action: The name of the Roller method to call, e.g. 'reroll'.
+            is_allowed: The RollHistory method that checks whether the action is allowed.
+            error: The message of the error raised if it isn't.
+        """
+        if button_presses.is_redelivery(interaction.id):
+            await acknowledge_duplicate_press(interaction, 'redelivery')
+            return
+        message_id = interaction.message.id
+        lock = button_presses.lock(message_id)
+        if lock.locked():
+            # Another press is updating the message, which may take longer than the response window.
+            await defer(interaction)
+        async with lock:
+            roll_history = self._current_roll_history(interaction)
+            if button_presses.is_outdated(message_id, roll_history):
+                await acknowledge_duplicate_press(interaction, 'outdated')
+                return
+            if not is_allowed(roll_history):
+                invalid_rerolls.inc(action)
+                raise RuntimeError(error)
+            updated_roll_history = await self._reroll_and_update_message(interaction, roll_history, action)
+            if updated_roll_history is not None:
+                button_presses.updated(message_id, updated_roll_history)
+                record_roll(interaction, self.dice_set, updated_roll_history)
+
+    async def _reroll_and_update_message(self, interaction: discord.Interaction, roll_history: RollHistory,
+                                         action: str) -> RollHistory | None:
+        """Performs the reroll action and updates the message with the result.
+
+        Large rolls are rerolled and rendered in the compute pool.
+
+        Args:
+            interaction: The Discord interaction.
+            roll_history: The roll history to continue from.
+            action: The name of the Roller method to call, e.g. 'reroll'.
 
-        message = MessageGenerator(self.dice_set).generate_roll_message(roll_history)
-        embed = discord.Embed(description=message, color=EMBED_COLOR)
+        Returns:
+            The updated roll history, or None if the message wasn't updated.
+        """
+        if roll_history.num_dice > LARGE_ROLL_DICE:
+            with stage('compute'):
+                result = await run_compute_job(
+                    interaction, reroll_job, roll_history, action, self.dice_set,
+                    expected_seconds=roll_history.num_dice * SECONDS_PER_ROLLED_DIE)
+            if result is None:
+                return None
+        else:
+            result = reroll_job(roll_history, action, self.dice_set)
+        return result[0] if await self._update_message(interaction, *result) else None
+
+    async def _update_message(self, interaction: discord.Interaction, roll_history: RollHistory,
+                              pages: list[str]) -> bool:
+        with stage('view'):
+            updated_view = RollView(user_id=interaction.user.id, dice_set=self.dice_set, roll_history=roll_history)
         try:
-            await interaction.response.edit_message(embed=embed, view=updated_view)
+            with stage('edit'):
+                await edit_response(interaction, embeds=roll_embeds(pages), view=updated_view)
+            return True
         except Exception as e:
-            print(f"Failed to update message: {e}")
+            edit_failures.inc()
+            logger.warning('Failed to update message: %r', e)
+            return False
 
 
-class DynamicRerollButton(AbstractDynamicButton, template=r'roll:reroll:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)'):
-    def __init__(self, user_id: int, dice_set: DiceSet):
-        self.user_id = user_id
-        self.dice_set = dice_set
+class DynamicRerollButton(AbstractDynamicButton, template=r'roll:reroll:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)(?::s:(?P<state>[\w-]+))?'):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory | None = None):
         super().__init__(
             user_id=user_id,
             dice_set=dice_set,
+            roll_history=roll_history,
             label='Re-roll',
             style=discord.ButtonStyle.green,
             custom_id=f'roll:reroll:user:{user_id}:dice_set:{dice_set.value}')
 
+    @log_interaction('reroll')
     async def callback(self, interaction: discord.Interaction):
-        print('Rerolling...')
-        roll_history = MessageParser(interaction, self.dice_set).roll_history
-        if not roll_history.can_reroll():
-            raise RuntimeError('Cannot perform reroll')
-        Roller(roll_history=roll_history).reroll()
-
-        await self._update_message(interaction, roll_history)
+        await self._handle_press(interaction, 'reroll', RollHistory.can_reroll, 'Cannot perform reroll')
 
 
-class DynamicFreeRerollButton(AbstractDynamicButton, template=r'roll:free_reroll:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)'):
-    def __init__(self, user_id: int, dice_set: DiceSet):
-        self.user_id = user_id
-        self.dice_set = dice_set
+class DynamicFreeRerollButton(AbstractDynamicButton, template=r'roll:free_reroll:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)(?::s:(?P<state>[\w-]+))?'):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory | None = None):
         super().__init__(
             user_id=user_id,
             dice_set=dice_set,
+            roll_history=roll_history,
             label='Free Re-roll',
             style=discord.ButtonStyle.blurple,
             custom_id=f'roll:free_reroll:user:{user_id}:dice_set:{dice_set.value}')
 
+    @log_interaction('free_reroll')
     async def callback(self, interaction: discord.Interaction):
-        print('Free rerolling...')
-        roll_history = MessageParser(interaction, self.dice_set).roll_history
-        if not roll_history.can_free_reroll():
-            raise RuntimeError('Cannot perform free reroll')
-        Roller(roll_history=roll_history).free_reroll()
-
-        await self._update_message(interaction, roll_history)
+        await self._handle_press(interaction, 'free_reroll', RollHistory.can_free_reroll, 'Cannot perform free reroll')
 
 
-class DynamicAllInButton(AbstractDynamicButton, template=r'roll:all_in:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)'):
-    def __init__(self, user_id: int, dice_set: DiceSet):
-        self.user_id = user_id
-        self.dice_set = dice_set
+class DynamicAllInButton(AbstractDynamicButton, template=r'roll:all_in:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)(?::s:(?P<state>[\w-]+))?'):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory | None = None):
         super().__init__(
             user_id=user_id,
             dice_set=dice_set,
+            roll_history=roll_history,
             label='All In',
             style=discord.ButtonStyle.red,
             custom_id=f'roll:all_in:user:{user_id}:dice_set:{dice_set.value}')
 
+    @log_interaction('all_in')
     async def callback(self, interaction: discord.Interaction):
-        print('All in...')
-        roll_history = MessageParser(interaction, self.dice_set).roll_history
-        if not roll_history.can_go_all_in():
-            raise RuntimeError('Cannot go all in')
-        Roller(roll_history=roll_history).all_in()
+        await self._handle_press(interaction, 'all_in', RollHistory.can_go_all_in, 'Cannot go all in')
+
+
+class DynamicAdviseButton(AbstractDynamicButton, template=r'roll:advise:user:(?P<user_id>[0-9]+):dice_set:(?P<dice_set>\w+)(?::s:(?P<state>[\w-]+))?'):
+    def __init__(self, user_id: int, dice_set: DiceSet, roll_history: RollHistory | None = None):
+        super().__init__(
+            user_id=user_id,
+            dice_set=dice_set,
+            roll_history=roll_history,
+            label='Advise',
+            style=discord.ButtonStyle.grey,
+            custom_id=f'roll:advise:user:{user_id}:dice_set:{dice_set.value}')
 
-        await self._update_message(interaction, roll_history)
+    async def interaction_check(self, interaction):
+        # The advice is only shown to the user who asked for it, and doesn't change the roll.
+        return True
+
+    @log_interaction('advise_button')
+    async def callback(self, interaction: discord.Interaction):
+        roll_history = self._current_roll_history(interaction)
+        message = MessageGenerator().generate_advice_message(strategy_advisor.advise(roll_history))
+        await send_response(interaction, embed=discord.Embed(description=message, color=EMBED_COLOR), ephemeral=True)
@@ -0,0 +1,158 @@
+"""Dice sets that guilds define with their own emoji.
+
+A guild registers six emoji as a named dice set with /diceset create, and uses
+it in a channel with /diceset use. The sets are stored in the channel settings
+backend, and referenced by a short value (e.g. 'c42', see dice.CustomDiceSet)
+in the channel settings and the buttons' custom ids.
+
+The registry keeps the sets of the most recently used guilds in memory, each
+with its prebuilt lookup tables, and loads the others from the backend when
+they are used again.
+"""
+import logging
+import re
+from collections import OrderedDict
+
+from bot.channel_settings import ChannelSettings, channel_settings
+from bot.config import config
+from bot.dice import CustomDiceSet, DiceSet, custom_dice_set_id
+from bot.lazy import Lazy
+from bot.message import COUNT_SEPARATOR
+from bot.rng import NUM_FACES
+
+logger = logging.getLogger(__name__)
+
+# The number of custom dice sets a guild may define
+MAX_DICE_SETS_PER_GUILD = 25
+MAX_NAME_LENGTH = 32
+MAX_EMOJI_LENGTH = 64
+NAME_PATTERN = re.compile(r'[\w\- ]+')
+# Custom emoji (which don't need to be separated), or anything else up to the next whitespace
+EMOJI_PATTERN = re.compile(r'<a?:\w+:[0-9]+>|\S+')
+# The faces that are shown as emoji: custom emoji, keycaps (e.g. 1️⃣), or other Unicode emoji. These have no ASCII
+# characters, so no markdown, and no letters or digits. Neither may they contain the separator of the dice counts
+# in roll messages, which MessageParser splits the counts at.
+FACE_PATTERN = re.compile(rf'<a?:\w+:[0-9]+>|[0-9#]\ufe0f?\u20e3|[^\w\s\x00-\x7f{COUNT_SEPARATOR}]+')
+
+
+def parse_name(name: str) -> str:
+    """Returns the name of a dice set, stripped of surrounding whitespace.
+
+    Raises:
+        ValueError: If the name isn't valid.
+    """
+    name = name.strip()
+    if not name or len(name) > MAX_NAME_LENGTH or not NAME_PATTERN.fullmatch(name):
+        raise ValueError(f'The name must have 1 to {MAX_NAME_LENGTH} letters, digits, spaces, dashes, or underscores.')
+    return name
+
+
+def parse_emoji(text: str) -> tuple[str, ...]:
+    """Returns the emoji of the faces 1 to 6, given the emoji in order, separated by spaces.
+
+    Raises:
+        ValueError: If there aren't six distinct emoji.
+    """
+    emoji = tuple(EMOJI_PATTERN.findall(text))
+    if len(emoji) != NUM_FACES:
+        raise ValueError(f'Expected {NUM_FACES} emoji separated by spaces, one per face, but got {len(emoji)}.')
+    invalid = [face for face in emoji if not FACE_PATTERN.fullmatch(face)]
+    if invalid:
+        raise ValueError(f'Only emoji can be used as faces, not {invalid[0]}.')
+    if len(set(emoji)) != NUM_FACES:
+        raise ValueError('Each face needs an emoji of its own.')
+    if any(len(face) > MAX_EMOJI_LENGTH for face in emoji):
+        raise ValueError(f'Emoji can be at most {MAX_EMOJI_LENGTH} characters long.')
+    return emoji
+
+
+class CustomDiceSetRegistry:
+    """The custom dice sets of the guilds, kept in memory for the most recently used ones.
+
+    Each set comes with its prebuilt lookup tables from faces to emoji and back
+    (see CustomDiceSet.converter). Guilds and sets that haven't been used in a
+    while are evicted, so that thousands of guilds don't keep every set
+    resident.
+
+    Attributes:
+        settings: The channel settings, whose backend stores the sets.
+        max_guilds: The number of guilds whose sets are kept in memory.
+        max_sets: The number of sets referenced by buttons that are kept in memory.
+    """
+    def __init__(self, settings: ChannelSettings, max_guilds: int = 1000, max_sets: int = 1000):
+        self.settings = settings
+        self.max_guilds = max_guilds
+        self.max_sets = max_sets
+        # Maps each guild ID to its sets by name
+        self._guilds = OrderedDict()
+        # Maps each set ID to its set, including sets that were replaced since
+        self._sets = OrderedDict()
+
+    async def guild_dice_sets(self, guild_id: int, reload: bool = False) -> dict[str, CustomDiceSet]:
+        """Returns the guild's custom dice sets by name, loading them on first use."""
+        dice_sets = None if reload else self._guilds.get(guild_id)
+        if dice_sets is None:
+            loaded = await self.settings.backend.get_custom_dice_sets(guild_id)
+            dice_sets = self._guilds[guild_id] = {dice_set.name: dice_set for dice_set in loaded}
+            while len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        self._guilds.move_to_end(guild_id)
+        return dice_sets
+
+    async def get(self, guild_id: int, name: str) -> CustomDiceSet | None:
+        """Returns the guild's custom dice set of the given name, or None if there is none."""
+        dice_set = (await self.guild_dice_sets(guild_id)).get(name)
+        if dice_set is None:
+            # Another process may have created it since the guild's sets were loaded.
+            dice_set = (await self.guild_dice_sets(guild_id, reload=True)).get(name)
+        return dice_set
+
+    async def get_by_id(self, id: int) -> CustomDiceSet | None:
+        """Returns the custom dice set with the given ID, or None if there is none."""
+        dice_set = self._sets.get(id)
+        if dice_set is None:
+            dice_set = await self.settings.backend.get_custom_dice_set(id)
+            if dice_set is None:
+                return None
+            self._cache_set(dice_set)
+        else:
+            self._sets.move_to_end(id)
+        return dice_set
+
+    async def create(self, guild_id: int, name: str, emoji: tuple[str, ...]) -> CustomDiceSet:
+        """Creates a custom dice set, which replaces the guild's set of the same name, if any.
+
+        Raises:
+            ValueError: If the guild already has the maximum number of sets.
+        """
+        dice_sets = await self.guild_dice_sets(guild_id, reload=True)
+        if name not in dice_sets and len(dice_sets) >= MAX_DICE_SETS_PER_GUILD:
+            raise ValueError(f'A server can have at most {MAX_DICE_SETS_PER_GUILD} dice sets.')
+        dice_set = await self.settings.backend.add_custom_dice_set(guild_id, name, emoji)
+        logger.info('Created custom dice set %d (%s) for guild %d', dice_set.id, name, guild_id)
+        dice_sets[name] = dice_set
+        self._cache_set(dice_set)
+        return dice_set
+
+    async def resolve(self, value: str) -> DiceSet | CustomDiceSet:
+        """Returns the dice set a value (e.g. from a custom id) references.
+
+        Falls back to the Octane dice set if a custom dice set no longer exists.
+        """
+        id = custom_dice_set_id(value)
+        if id is None:
+            return DiceSet(value)
+        dice_set = await self.get_by_id(id)
+        if dice_set is None:
+            logger.warning('Custom dice set %d does not exist, using the default dice set', id)
+            return DiceSet.OCTANE
+        return dice_set
+
+    def _cache_set(self, dice_set: CustomDiceSet):
+        self._sets[dice_set.id] = dice_set
+        while len(self._sets) > self.max_sets:
+            self._sets.popitem(last=False)
+
+
+custom_dice_sets = Lazy(lambda: CustomDiceSetRegistry(
+    channel_settings, max_guilds=config.custom_dice_set_cache_size, max_sets=config.custom_dice_set_cache_size))
@@ -1,5 +1,7 @@
 """Handles different dice sets"""
+import re
 from enum import Enum
+from types import MappingProxyType
 from bot.config import config
 
 class DiceSet(Enum):
@@ -12,11 +14,73 @@ class DiceSet(Enum):
     SABACC = 'sabacc'
 
 
+# The value of a custom dice set, e.g. 'c42', as used in the channel settings and the buttons' custom ids
+CUSTOM_DICE_SET_PATTERN = re.compile(r'c(?P<id>[0-9]+)')
+
+
+class CustomDiceSet:
+    """A dice set a guild defined with its own emoji (see /diceset create).
+
+    Custom dice sets are immutable. Creating a set with the name of an existing
+    one adds a new set, which replaces the old one in the guild, while buttons
+    that reference the old one keep rendering its emoji.
+
+    Attributes:
+        id: The ID of the dice set, unique across guilds.
+        guild_id: The ID of the guild that defined the dice set.
+        name: The name of the dice set, unique within its guild.
+        emoji: The emoji of the faces 1 to 6.
+        value: The short string that references the dice set, e.g. 'c42'.
+        converter: The dice set's EmojiDiceConverter, with prebuilt lookup tables in both directions.
+    """
+    __slots__ = ('id', 'guild_id', 'name', 'emoji', 'value', 'converter')
+
+    def __init__(self, id: int, guild_id: int, name: str, emoji: tuple[str, ...]):
+        self.id = id
+        self.guild_id = guild_id
+        self.name = name
+        self.emoji = tuple(emoji)
+        self.value = f'c{id}'
+        self.converter = EmojiDiceConverter(self)
+
+    def __eq__(self, other):
+        return isinstance(other, CustomDiceSet) and other.id == self.id
+
+    def __hash__(self):
+        return hash((CustomDiceSet, self.id))
+
+    def __reduce__(self):
+        # The converter's lookup tables can't be pickled, so they are rebuilt instead.
+        return CustomDiceSet, (self.id, self.guild_id, self.name, self.emoji)
+
+    def __repr__(self):
+        return f'CustomDiceSet(id={self.id}, guild_id={self.guild_id}, name={self.name!r})'
+
+
+def custom_dice_set_id(value: str) -> int | None:
+    """Returns the ID of the custom dice set the value references, or None if it's a regular dice set."""
+    match = CUSTOM_DICE_SET_PATTERN.fullmatch(value)
+    return int(match['id']) if match else None
+
+
+# The environments that have their own custom emoji
+ENVIRONMENTS = ['dev', 'prod']
+
+
+def current_environment():
+    """Returns the environment the bot is running in."""
+    return 'dev' if config.dev_mode else 'prod'
+
+
 class EmojiDiceConverter:
     """Converts dice rolls to and from emoji.
     
     Uses the specified dice set, defaulting to the octane dice set.
+    Converters are immutable, so for_dice_set can share a single instance per
+    dice set and environment across the process.
     """
+    _converters = {}
+
     DICE_EMOJI_MAP_NUMBERS = {
         1: ':one:',
         2: ':two:',
@@ -119,8 +183,10 @@ class EmojiDiceConverter:
         }
     }
 
-    def __init__(self, dice_set=DiceSet.OCTANE):
-        if dice_set == DiceSet.NUMBERS:
+    def __init__(self, dice_set=DiceSet.OCTANE, env=None):
+        if isinstance(dice_set, CustomDiceSet):
+            self.dice_emoji_map = dict(enumerate(dice_set.emoji, start=1))
+        elif dice_set == DiceSet.NUMBERS:
             self.dice_emoji_map = self.DICE_EMOJI_MAP_NUMBERS
         elif dice_set == DiceSet.COLOR_SYMBOLS:
             self.dice_emoji_map = self.DICE_EMOJI_MAP_COLOR_SYMBOLS
@@ -129,10 +195,26 @@ class EmojiDiceConverter:
         else:
             # Since custom emoji are app specific, we need to use different emoji
             # ids for the development and production environments.
-            env = 'dev' if config.dev_mode else 'prod'
-            self.dice_emoji_map = self.DICE_EMOJI_MAP_SPECIAL[dice_set][env]
-        
-        self.emoji_dice_map = {v: k for k, v in self.dice_emoji_map.items()}
+            self.dice_emoji_map = self.DICE_EMOJI_MAP_SPECIAL[dice_set][env or current_environment()]
+
+        self.dice_emoji_map = MappingProxyType(self.dice_emoji_map)
+        self.emoji_dice_map = MappingProxyType({v: k for k, v in self.dice_emoji_map.items()})
+
+    @classmethod
+    def for_dice_set(cls, dice_set=DiceSet.OCTANE, env=None):
+        """Returns the shared converter for the dice set and environment.
+
+        The environment defaults to the one the bot is running in. Custom dice
+        sets have the same emoji in every environment, and their converter is
+        kept with the set instead.
+        """
+        if isinstance(dice_set, CustomDiceSet):
+            return dice_set.converter
+        key = (dice_set, env or current_environment())
+        converter = cls._converters.get(key)
+        if converter is None:
+            converter = cls._converters[key] = cls(dice_set, env=key[1])
+        return converter
 
     def dice_to_emoji(self, dice):
         return self.dice_emoji_map.get(dice)
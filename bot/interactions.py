@@ -0,0 +1,431 @@
+"""Serves Discord interactions at an HTTP endpoint, instead of over the gateway.
+
+In this mode, Discord POSTs each interaction to the bot's interactions
+endpoint URL (set in the Discord developer portal), signed with the app's
+Ed25519 key. The bot responds to the request with the initial response, and
+sends any followups through the interaction webhook. No gateway connection,
+and no bot token, is needed.
+
+The roll state is encoded in the custom ids of the buttons, so any process
+can handle a button press. The channel settings and custom dice sets are
+kept in the local SQLite database, though, which also assigns the ids of the
+custom dice sets. Several replicas can therefore only run on the same host,
+sharing the database file. Each replica journals its rolls and snapshots its
+statistics to files of its own, named after INSTANCE_ID (by default, the host
+name and port).
+
+HttpInteraction adapts the request payload to the parts of the
+discord.Interaction API that the controllers and dynamic buttons use, so they
+handle both modes alike.
+
+Usage: python -m bot.interactions [--host HOST] [--port PORT]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+
+import discord
+from aiohttp import ClientSession, web
+from discord.enums import try_enum
+from discord.utils import MISSING
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+from bot.channel_settings import channel_settings, migrate_shelve
+from bot.compute import compute_pool
+from bot.config import config
+from bot.controller import (
+    AdviseController,
+    CoinController,
+    D6Controller,
+    DiceSetController,
+    DynamicAdviseButton,
+    DynamicAllInButton,
+    DynamicFreeRerollButton,
+    DynamicRerollButton,
+    HelpController,
+    OddsController,
+    RollController,
+    SettingsController,
+    SimulateController,
+    StatsController)
+from bot.journal import roll_journal
+from bot.log import setup_logging
+from bot.metrics import MetricsServer, metrics
+from bot.ratelimit import rate_limits
+from bot.stats import roll_stats
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = 'https://discord.com/api/v10'
+# Discord requires the initial response within 3 seconds. Handlers that haven't
+# responded by then are deferred, leaving time for the round trip to Discord.
+RESPONSE_DEADLINE = 2.5
+# The number of seconds to wait for running handlers when shutting down
+SHUTDOWN_TIMEOUT = 10.0
+# The number of times a rate limited webhook request is retried
+MAX_RETRIES = 3
+
+# The interaction response types, see https://discord.com/developers/docs/interactions/receiving-and-responding
+PONG = 1
+CHANNEL_MESSAGE_WITH_SOURCE = 4
+DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE = 5
+DEFERRED_UPDATE_MESSAGE = 6
+UPDATE_MESSAGE = 7
+EPHEMERAL_FLAG = 1 << 6
+
+# The slash commands, as registered by bot.bot.register_commands. Each handler
+# takes the interaction and a dictionary of the command's options.
+COMMANDS = {
+    'help': lambda interaction, options: HelpController().handle_help(interaction),
+    'settings': lambda interaction, options: SettingsController().handle_settings(interaction, options['dice_set']),
+    'roll': lambda interaction, options: RollController().handle_roll(interaction, options['dice']),
+    'odds': lambda interaction, options: OddsController().handle_odds(interaction, options['dice']),
+    'simulate': lambda interaction, options: SimulateController().handle_simulate(
+        interaction, options['dice'], options['strategy'], options.get('trials', 100_000)),
+    'advise': lambda interaction, options: AdviseController().handle_advise(interaction, options['dice']),
+    'stats': lambda interaction, options: StatsController().handle_stats(
+        interaction, options.get('scope', 'user'), int(options['user']) if 'user' in options else None),
+    'diceset create': lambda interaction, options: DiceSetController().handle_create(
+        interaction, options['name'], options['emoji']),
+    'diceset use': lambda interaction, options: DiceSetController().handle_use(interaction, options['name']),
+    'diceset list': lambda interaction, options: DiceSetController().handle_list(interaction),
+    'coin': lambda interaction, options: CoinController().handle_coin(interaction),
+    'd6': lambda interaction, options: D6Controller().handle_d6(interaction),
+}
+DYNAMIC_BUTTONS = (DynamicRerollButton, DynamicFreeRerollButton, DynamicAllInButton, DynamicAdviseButton)
+
+
+def verify_signature(verify_key: VerifyKey, signature: str, timestamp: str, body: bytes) -> bool:
+    """Returns true if the request was signed with the app's key."""
+    try:
+        verify_key.verify(timestamp.encode() + body, bytes.fromhex(signature))
+        return True
+    except (BadSignatureError, ValueError):
+        return False
+
+
+def message_data(content=MISSING, *, embed=MISSING, embeds=MISSING, view=MISSING, ephemeral=False) -> dict:
+    """Returns the message payload for the arguments of a send or edit call.
+
+    As in discord.py, arguments that aren't passed are left unchanged by
+    edits, and a view of None removes the components.
+    """
+    data = {}
+    if content is not MISSING:
+        data['content'] = content
+    if embed is not MISSING:
+        embeds = [] if embed is None else [embed]
+    if embeds is not MISSING:
+        data['embeds'] = [embed.to_dict() for embed in embeds or []]
+    if view is not MISSING:
+        data['components'] = view.to_components() if view else []
+    if ephemeral:
+        data['flags'] = EPHEMERAL_FLAG
+    return data
+
+
+class InteractionsApi:
+    """Sends followups through the interaction webhooks, which need no bot token.
+
+    Attributes:
+        base_url: The base URL of the Discord API.
+    """
+    def __init__(self, base_url: str = API_BASE_URL):
+        self.base_url = base_url
+        self._session = None
+
+    async def request(self, method: str, path: str, payload: dict | None) -> dict:
+        if self._session is None:
+            # Track the rate limits reported by Discord, for the response scheduler.
+            self._session = ClientSession(trace_configs=[rate_limits.trace_config()])
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._session.request(method, f'{self.base_url}{path}', json=payload) as response:
+                if response.status != 429 or attempt == MAX_RETRIES:
+                    response.raise_for_status()
+                    return await response.json() if response.status != 204 else {}
+                retry_after = float(response.headers.get('Retry-After', 1))
+            logger.info('Rate limited by Discord, retrying after %.2f s', retry_after)
+            await asyncio.sleep(retry_after)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class HttpMessage:
+    """The message a component interaction belongs to, with just the parts MessageParser needs."""
+    def __init__(self, payload: dict):
+        self.id = int(payload['id'])
+        self.embeds = [discord.Embed.from_dict(embed) for embed in payload.get('embeds', [])]
+
+
+class HttpInteractionResponse:
+    """Stands in for discord.InteractionResponse.
+
+    The initial response is handed to the server (see initial_response), which
+    returns it as the body of the HTTP response. If the server deferred the
+    interaction because the handler took too long, later responses are sent
+    as followups instead. The server can't tell whether the response will be
+    ephemeral, so it defers commands publicly. An ephemeral followup then
+    deletes the public "thinking" message, rather than replacing it.
+    """
+    def __init__(self, interaction: 'HttpInteraction'):
+        self._interaction = interaction
+        self._initial_response = asyncio.get_running_loop().create_future()
+        self._auto_deferred = False
+        # Set once Discord received the initial response, after which followups can be sent.
+        self.acknowledged = asyncio.Event()
+        # Whether the initial response is a public "thinking" message, which the next followup replaces.
+        self.public_thinking = False
+
+    def is_done(self) -> bool:
+        return self._initial_response.done()
+
+    @property
+    def initial_response(self) -> asyncio.Future:
+        return self._initial_response
+
+    async def send_message(self, content=MISSING, *, embed=MISSING, embeds=MISSING, view=MISSING, ephemeral=False):
+        if self._auto_deferred and (ephemeral or self._interaction.type == discord.InteractionType.component):
+            await self._interaction.followup.send(content, embed=embed, embeds=embeds, view=view, ephemeral=ephemeral)
+        elif self._auto_deferred:
+            await self._interaction.edit_original_response(content=content, embed=embed, embeds=embeds, view=view)
+        else:
+            self._respond(CHANNEL_MESSAGE_WITH_SOURCE, message_data(
+                content, embed=embed, embeds=embeds, view=view, ephemeral=ephemeral))
+
+    async def edit_message(self, *, content=MISSING, embed=MISSING, embeds=MISSING, view=MISSING):
+        if self._auto_deferred:
+            await self._interaction.edit_original_response(content=content, embed=embed, embeds=embeds, view=view)
+        else:
+            self._respond(UPDATE_MESSAGE, message_data(content, embed=embed, embeds=embeds, view=view))
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        if self._auto_deferred:
+            return
+        if self._interaction.type == discord.InteractionType.component and not thinking:
+            self._respond(DEFERRED_UPDATE_MESSAGE)
+        else:
+            self._respond(DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE, {'flags': EPHEMERAL_FLAG} if ephemeral else None)
+
+    def auto_defer(self):
+        """Defers the interaction on behalf of a handler that is about to miss the deadline."""
+        if self._interaction.type == discord.InteractionType.component:
+            self._respond(DEFERRED_UPDATE_MESSAGE)
+        else:
+            self._respond(DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE)
+        self._auto_deferred = True
+
+    def _respond(self, response_type: int, data: dict | None = None):
+        if self.is_done():
+            raise discord.InteractionResponded(self._interaction)
+        response = {'type': response_type}
+        if data is not None:
+            response['data'] = data
+        self._initial_response.set_result(response)
+        self.public_thinking = response_type == DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE and data is None
+
+
+class HttpFollowup:
+    """Stands in for the interaction's followup webhook."""
+    def __init__(self, interaction: 'HttpInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content=MISSING, *, embed=MISSING, embeds=MISSING, view=MISSING, ephemeral=False):
+        response = self._interaction.response
+        if response.public_thinking:
+            response.public_thinking = False
+            if ephemeral:
+                # The "thinking" message would turn into a public response, so it's deleted instead, and the
+                # ephemeral followup sent as a message of its own.
+                await self._interaction.webhook_request('DELETE', '/messages/@original', None)
+        await self._interaction.webhook_request('POST', '', message_data(
+            content, embed=embed, embeds=embeds, view=view, ephemeral=ephemeral))
+
+
+class HttpInteraction:
+    """Stands in for discord.Interaction, for an interaction received over HTTP.
+
+    Attributes:
+        id: The interaction's ID.
+        type: The interaction's type, a discord.InteractionType.
+        application_id: The ID of the app the interaction was sent to.
+        token: The interaction's token, which authorizes the followups.
+        data: The interaction's data, e.g. the command's name and options.
+        guild_id: The ID of the guild the interaction was sent from, if any.
+        channel_id: The ID of the channel the interaction was sent from.
+        user: The user who triggered the interaction (just its ID).
+        message: The message of a component interaction, or None.
+        response: The initial response.
+        followup: The followup webhook.
+    """
+    def __init__(self, payload: dict, api: InteractionsApi):
+        self.id = int(payload['id'])
+        self.type = try_enum(discord.InteractionType, payload['type'])
+        self.application_id = int(payload['application_id'])
+        self.token = payload['token']
+        self.data = payload.get('data', {})
+        self.guild_id = int(payload['guild_id']) if 'guild_id' in payload else None
+        channel_id = payload.get('channel_id') or payload.get('channel', {}).get('id')
+        self.channel_id = int(channel_id) if channel_id else None
+        # Guild interactions carry the member, direct messages the user.
+        user = payload['member']['user'] if 'member' in payload else payload['user']
+        self.user = discord.Object(int(user['id']))
+        self.message = HttpMessage(payload['message']) if 'message' in payload else None
+        self.response = HttpInteractionResponse(self)
+        self.followup = HttpFollowup(self)
+        self._api = api
+
+    async def edit_original_response(self, *, content=MISSING, embed=MISSING, embeds=MISSING, view=MISSING):
+        self.response.public_thinking = False
+        await self.webhook_request('PATCH', '/messages/@original', message_data(
+            content, embed=embed, embeds=embeds, view=view))
+
+    async def webhook_request(self, method: str, path: str, payload: dict | None) -> dict:
+        """Sends a request to the interaction's webhook, once Discord received the initial response."""
+        await self.response.acknowledged.wait()
+        return await self._api.request(method, f'/webhooks/{self.application_id}/{self.token}{path}', payload)
+
+
+def command_name_and_options(data: dict) -> tuple[str, dict]:
+    """Returns the full name of a command (e.g. 'diceset create') and its options by name."""
+    name = data['name']
+    options = data.get('options', [])
+    # Subcommands (and subcommand groups) are passed as the only option, with their own options.
+    while len(options) == 1 and options[0]['type'] in (discord.AppCommandOptionType.subcommand.value,
+                                                       discord.AppCommandOptionType.subcommand_group.value):
+        name = f'{name} {options[0]["name"]}'
+        options = options[0].get('options', [])
+    return name, {option['name']: option['value'] for option in options}
+
+
+async def dispatch(interaction: HttpInteraction):
+    """Calls the handler of the command or button the interaction is for."""
+    if interaction.type == discord.InteractionType.application_command:
+        name, options = command_name_and_options(interaction.data)
+        handler = COMMANDS.get(name)
+        if handler is None:
+            raise ValueError(f'Unknown command: {name}')
+        await handler(interaction, options)
+    elif interaction.type == discord.InteractionType.component:
+        custom_id = interaction.data['custom_id']
+        for button_class in DYNAMIC_BUTTONS:
+            match = button_class.__discord_ui_compiled_template__.fullmatch(custom_id)
+            if match:
+                button = await button_class.from_custom_id(interaction, None, match)
+                if await button.interaction_check(interaction):
+                    await button.callback(interaction)
+                return
+        raise ValueError(f'Unknown component: {custom_id}')
+    else:
+        raise ValueError(f'Unsupported interaction type: {interaction.type}')
+
+
+class InteractionsServer:
+    """An aiohttp app that verifies and dispatches the interactions POSTed by Discord.
+
+    Attributes:
+        verify_key: The app's public key, to verify the requests with.
+        api: The client for the interaction webhooks.
+        response_deadline: The number of seconds after which handlers that
+            haven't responded yet are deferred.
+    """
+    def __init__(self, public_key: str, api: InteractionsApi | None = None,
+                 response_deadline: float = RESPONSE_DEADLINE):
+        self.verify_key = VerifyKey(bytes.fromhex(public_key))
+        self.api = api or InteractionsApi()
+        self.response_deadline = response_deadline
+        # The handlers that keep running after the initial response
+        self._tasks = set()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/interactions', self.handle)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.read()
+        signature = request.headers.get('X-Signature-Ed25519')
+        timestamp = request.headers.get('X-Signature-Timestamp')
+        if not signature or not timestamp or not verify_signature(self.verify_key, signature, timestamp, body):
+            return web.Response(status=401, text='Invalid request signature')
+        payload = json.loads(body)
+        if payload['type'] == discord.InteractionType.ping.value:
+            return web.json_response({'type': PONG})
+
+        interaction = HttpInteraction(payload, self.api)
+        task = asyncio.create_task(dispatch(interaction))
+        self._tasks.add(task)
+        task.add_done_callback(self._handler_done)
+        await asyncio.wait({interaction.response.initial_response, task},
+                           timeout=self.response_deadline, return_when=asyncio.FIRST_COMPLETED)
+        if not interaction.response.is_done():
+            if task.done():
+                return web.Response(status=500, text='The interaction was not handled')
+            interaction.response.auto_defer()
+
+        response = web.json_response(interaction.response.initial_response.result())
+        await response.prepare(request)
+        await response.write_eof()
+        interaction.response.acknowledged.set()
+        return response
+
+    def _handler_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning('Failed to handle interaction: %r', task.exception())
+
+    async def _cleanup(self, app: web.Application):
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=SHUTDOWN_TIMEOUT)
+        await self.api.close()
+
+
+async def start_services(app: web.Application):
+    """Starts the services the gateway bot starts in its setup hook, see bot.bot.BotClientMixin."""
+    await migrate_shelve(config.channel_settings_db, channel_settings.backend)
+    channel_settings.start_refresh(config.channel_settings_refresh_interval)
+    compute_pool.start()
+    roll_journal.start()
+    await roll_stats.start()
+    if config.metrics_port:
+        app['metrics_server'] = MetricsServer(metrics, config.metrics_host, config.metrics_port)
+        await app['metrics_server'].start()
+
+
+async def stop_services(app: web.Application):
+    await channel_settings.close()
+    await roll_journal.close()
+    await roll_stats.close()
+    compute_pool.shutdown()
+    if 'metrics_server' in app:
+        await app['metrics_server'].stop()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Serve the Discord bot at an HTTP interactions endpoint.')
+    parser.add_argument('--host', default=config.interactions_host, help='The address to listen on')
+    parser.add_argument('--port', type=int, default=config.interactions_port, help='The port to listen on')
+    args = parser.parse_args(argv)
+
+    log_listener = setup_logging(config.log_level, config.log_sample_rates)
+    # Replicas sharing the data directory each journal their own rolls, and keep their own statistics.
+    config.process_name = config.instance_id or f'{socket.gethostname()}-{args.port}'
+    config.stats_snapshot = f'{os.path.splitext(config.stats_snapshot)[0]}-{config.process_name}.json'
+    try:
+        app = InteractionsServer(config.public_key).create_app()
+        app.on_startup.append(start_services)
+        app.on_cleanup.append(stop_services)
+        web.run_app(app, host=args.host, port=args.port, access_log=None, print=None)
+    finally:
+        log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+"""An append-only journal of every roll, in a compact binary format.
+
+Each finished roll (or reroll) is appended as a fixed-width record, so that
+rolls can be audited and analyzed later on. Records are buffered in memory
+and written in batches by a background task, into segment files that rotate
+once they hold a given number of records.
+
+Segment layout:
+
+    header:     8 byte magic (b'ROLLJRNL'), uint32 format version, uint32 record size
+    records:    RECORD_SIZE bytes each, little endian (see RECORD_FORMAT):
+                int64   timestamp in milliseconds since the epoch
+                uint64  guild id (0 for direct messages)
+                uint64  channel id
+                uint64  user id
+                uint16  dice set (index into DiceSet, or CUSTOM_DICE_SET_CODE for
+                        a guild's custom dice set)
+                uint8   bits 0-3 flag which roll phases are present,
+                        bits 4-7 flag which of those rolls are failed rerolls
+                uint8   reserved
+                uint32  face counts, 6 per roll phase, in roll phase order
+
+As the records have a fixed width, JournalReader memory-maps the segments as
+numpy record arrays, so scans over millions of rolls are vectorized and never
+copy the data.
+
+Processes that share the journal directory (the workers of a shard cluster,
+or HTTP replicas) each write segments of their own, named after the process
+(e.g. rolls-worker0-000001.journal), and the reader merges the segments of all
+processes. Each writer also holds an exclusive lock on its active segment, so
+that two processes never append to, or truncate, the same segment.
+
+Usage: python -m bot.journal [--dir DIR] [--user ID] [--channel ID] [--guild ID] [--last N]
+"""
+import argparse
+import asyncio
+import datetime
+import fcntl
+import glob
+import logging
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+from bot.config import config
+from bot.dice import CustomDiceSet, DiceSet
+from bot.lazy import Lazy
+from bot.roll import NUM_FACES, Roll, RollHistory, RollPhase
+from bot.roll_state import ROLL_PHASES
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ROLLJRNL'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<8sII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = f'<qQQQHBB{len(ROLL_PHASES) * NUM_FACES}I'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('guild_id', '<u8'),
+    ('channel_id', '<u8'),
+    ('user_id', '<u8'),
+    ('dice_set', '<u2'),
+    ('phases', 'u1'),
+    ('reserved', 'u1'),
+    ('counts', '<u4', (len(ROLL_PHASES), NUM_FACES)),
+])
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+# New dice sets must be added at the end of DiceSet, so the codes of journaled rolls stay valid.
+DICE_SETS = list(DiceSet)
+DICE_SET_CODES = {dice_set: code for code, dice_set in enumerate(DICE_SETS)}
+# The code of every custom dice set. The rolls matter for audits, not the emoji they were shown with.
+CUSTOM_DICE_SET_CODE = 0xffff
+SEGMENT_PATTERN = 'rolls-*.journal'
+# The name of a segment, with the name of the process that wrote it, if any
+SEGMENT_NAME = re.compile(r'rolls-(?:(?P<writer>.+)-)?(?P<index>[0-9]{6,})\.journal')
+_EMPTY_COUNTS = (0,) * NUM_FACES
+
+
+def segment_path(directory: str, index: int, writer: str | None = None) -> str:
+    prefix = f'rolls-{writer}-' if writer else 'rolls-'
+    return os.path.join(directory, f'{prefix}{index:06d}.journal')
+
+
+def pack_record(roll_history: RollHistory, dice_set: DiceSet | CustomDiceSet, guild_id: int | None, channel_id: int | None,
+                user_id: int, timestamp: float | None = None) -> bytes:
+    """Returns the journal record of a roll."""
+    flags = 0
+    counts = []
+    for index, roll_phase in enumerate(ROLL_PHASES):
+        roll = roll_history.rolls.get(roll_phase)
+        if roll is None:
+            counts.extend(_EMPTY_COUNTS)
+            continue
+        flags |= 1 << index
+        if roll.failed_reroll:
+            flags |= 1 << (index + 4)
+        counts.extend(roll.counts)
+    timestamp_ms = int((time.time() if timestamp is None else timestamp) * 1000)
+    return struct.pack(RECORD_FORMAT, timestamp_ms, guild_id or 0, channel_id or 0, user_id,
+                       DICE_SET_CODES.get(dice_set, CUSTOM_DICE_SET_CODE), flags, 0, *counts)
+
+
+class JournalEntry:
+    """A journaled roll, decoded from its record.
+
+    Attributes:
+        timestamp: When the roll finished.
+        guild_id: The ID of the guild, or None for direct messages.
+        channel_id: The ID of the channel.
+        user_id: The ID of the user who rolled.
+        dice_set: The dice set of the channel at the time, or None for a custom dice set.
+        roll_history: The roll, including any rerolls.
+    """
+    def __init__(self, record: np.void):
+        self.timestamp = datetime.datetime.fromtimestamp(int(record['timestamp']) / 1000, datetime.timezone.utc)
+        self.guild_id = int(record['guild_id']) or None
+        self.channel_id = int(record['channel_id'])
+        self.user_id = int(record['user_id'])
+        code = int(record['dice_set'])
+        self.dice_set = DICE_SETS[code] if code != CUSTOM_DICE_SET_CODE else None
+        self.roll_history = RollHistory()
+        flags = int(record['phases'])
+        for index, roll_phase in enumerate(ROLL_PHASES):
+            if not flags & (1 << index):
+                continue
+            roll = Roll.from_counts([int(count) for count in record['counts'][index]])
+            if flags & (1 << (index + 4)):
+                if roll_phase == RollPhase.ALL_IN:
+                    roll.mark_as_failed_all_in()
+                else:
+                    roll.mark_as_failed_reroll()
+            self.roll_history.add_roll(roll_phase, roll)
+
+
+class RollJournal:
+    """Appends the finished rolls to the journal, in batches.
+
+    Records are only kept once the journal is started (see start), so that
+    tests and tools that roll dice don't write any files.
+
+    Attributes:
+        directory: The directory of the segment files.
+        records_per_segment: The number of records after which a new segment is started.
+        flush_delay: The number of seconds records are buffered before they are written.
+        max_batch_size: The number of buffered records at which they are written right away.
+        writer: The name of the process in the names of its segments, or None for a single process.
+    """
+    def __init__(self, directory: str, records_per_segment: int = 1_000_000, flush_delay: float = 1.0,
+                 max_batch_size: int = 10_000, writer: str | None = None):
+        self.directory = directory
+        self.writer = writer
+        self.records_per_segment = records_per_segment
+        self.flush_delay = flush_delay
+        self.max_batch_size = max_batch_size
+        self._started = False
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._flush_task = None
+        self._write_tasks = set()
+        self._write_lock = asyncio.Lock()
+        # The current segment, its locked file, and its number of records, found on the first write
+        self._segment_index = None
+        self._segment_file = None
+        self._segment_records = 0
+
+    def start(self):
+        """Starts keeping records."""
+        self._started = True
+
+    def record(self, roll_history: RollHistory, dice_set: DiceSet | CustomDiceSet, *, guild_id: int | None,
+               channel_id: int | None, user_id: int):
+        """Buffers the record of a finished roll, to be written with the next batch."""
+        if not self._started:
+            return
+        self._buffer += pack_record(roll_history, dice_set, guild_id, channel_id, user_id)
+        self._buffered += 1
+        if self._buffered >= self.max_batch_size:
+            task = asyncio.create_task(self._flush_later(0))
+            self._write_tasks.add(task)
+            task.add_done_callback(self._write_tasks.discard)
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(self.flush_delay))
+
+    async def flush(self):
+        """Writes the buffered records."""
+        if not self._buffered:
+            return
+        data, count = bytes(self._buffer), self._buffered
+        self._buffer.clear()
+        self._buffered = 0
+        # Keep the batches in order, even if a flush is still writing.
+        async with self._write_lock:
+            await asyncio.to_thread(self._write, data, count)
+
+    async def close(self):
+        """Writes any buffered records and stops keeping records."""
+        self._started = False
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._write_tasks:
+            await asyncio.wait(self._write_tasks)
+        await self.flush()
+        async with self._write_lock:
+            self._close_segment()
+
+    async def _flush_later(self, delay: float):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+                self._flush_task = None
+            await self.flush()
+        except Exception as e:
+            logger.error('Failed to write the roll journal: %s', e)
+
+    def _write(self, data: bytes, count: int):
+        if self._segment_file is None:
+            self._open_last_segment()
+        position = 0
+        while count:
+            if self._segment_records >= self.records_per_segment:
+                self._close_segment()
+                self._open_segment(self._segment_index + 1)
+            batch = min(count, self.records_per_segment - self._segment_records)
+            self._segment_file.write(data[position:position + batch * RECORD_SIZE])
+            self._segment_file.flush()
+            position += batch * RECORD_SIZE
+            self._segment_records += batch
+            count -= batch
+
+    def _open_last_segment(self):
+        """Continues the last segment of this writer, or starts the first one."""
+        os.makedirs(self.directory, exist_ok=True)
+        indexes = [index for writer, index in map(_parse_segment_name, glob.glob(
+            os.path.join(self.directory, SEGMENT_PATTERN))) if writer == self.writer]
+        self._open_segment(max(indexes, default=1))
+
+    def _open_segment(self, index: int):
+        """Opens the segment with the given index for appending, or the next one that no other process writes.
+
+        A partial record that a crash may have left behind is dropped, which
+        is only safe once no other process can be appending to the segment.
+        """
+        while True:
+            path = segment_path(self.directory, index, self.writer)
+            f = open(path, 'ab')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                logger.warning('The journal segment %s is locked by another process, skipping it', path)
+                index += 1
+                continue
+            break
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, RECORD_SIZE))
+            f.flush()
+            size = HEADER_SIZE
+        records = max(0, size - HEADER_SIZE) // RECORD_SIZE
+        if size > HEADER_SIZE and (size - HEADER_SIZE) % RECORD_SIZE:
+            logger.warning('Truncating a partial record at the end of %s', path)
+            f.truncate(HEADER_SIZE + records * RECORD_SIZE)
+        self._segment_index = index
+        self._segment_file = f
+        self._segment_records = records
+
+    def _close_segment(self):
+        if self._segment_file is not None:
+            # Closing the file releases the lock.
+            self._segment_file.close()
+            self._segment_file = None
+
+
+def _parse_segment_name(path: str) -> tuple[str | None, int]:
+    """Returns the writer and index of a segment."""
+    match = SEGMENT_NAME.fullmatch(os.path.basename(path))
+    if match is None:
+        return None, 0
+    return match['writer'], int(match['index'])
+
+
+class JournalReader:
+    """Reads the journal by memory-mapping its segments.
+
+    Example:
+        reader = JournalReader('journal')
+        rolls_per_user = collections.Counter()
+        for records in reader.scan():
+            users, counts = np.unique(records['user_id'], return_counts=True)
+            rolls_per_user.update(dict(zip(users.tolist(), counts.tolist())))
+
+    Attributes:
+        directory: The directory of the segment files.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self) -> list[str]:
+        """Returns the paths of the segments of all writers, each writer's oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)),
+                      key=lambda path: (_parse_segment_name(path)[0] or '', _parse_segment_name(path)[1]))
+
+    def scan(self):
+        """Yields the records of each segment as a read-only, memory-mapped numpy record array."""
+        for path in self.segments():
+            records = self.read_segment(path)
+            if len(records):
+                yield records
+
+    def read_segment(self, path: str) -> np.ndarray:
+        """Returns the records of a segment, memory-mapped.
+
+        Raises:
+            ValueError: If the file is not a journal segment of this format.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        magic, version, record_size = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f'{path} is not a roll journal segment of version {FORMAT_VERSION}.')
+        # Ignore a partial record at the end, which a running writer may be appending.
+        num_records = (os.path.getsize(path) - HEADER_SIZE) // RECORD_SIZE
+        if not num_records:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(num_records,))
+
+    def count(self) -> int:
+        """Returns the number of journaled rolls."""
+        return sum(len(records) for records in self.scan())
+
+    def find(self, *, guild_id: int | None = None, channel_id: int | None = None,
+             user_id: int | None = None, last: int | None = None) -> list[JournalEntry]:
+        """Returns the journaled rolls that match all of the given filters, oldest first.
+
+        The rolls of the segments of all writers are merged by their timestamps.
+
+        Args:
+            guild_id: Only return rolls in this guild.
+            channel_id: Only return rolls in this channel.
+            user_id: Only return rolls of this user.
+            last: Only return this many of the most recent matching rolls.
+        """
+        # Only the row indices and timestamps of the candidates are copied, the records are
+        # read from the memory-mapped segments once the rolls to return are chosen.
+        segments = []
+        candidates = []
+        filters = [(field, value) for field, value in
+                   [('guild_id', guild_id), ('channel_id', channel_id), ('user_id', user_id)] if value is not None]
+        for records in self.scan():
+            if filters:
+                mask = np.ones(len(records), dtype=bool)
+                for field, value in filters:
+                    mask &= records[field] == value
+                rows = np.flatnonzero(mask)
+            else:
+                rows = np.arange(0 if last is None else max(0, len(records) - last), len(records))
+            if last is not None:
+                # Each writer appends its rolls in order, so the most recent matches of a segment are its last ones.
+                rows = rows[max(0, len(rows) - last):]
+            if len(rows):
+                segments.append(records)
+                candidates.append(rows)
+        if not candidates:
+            return []
+        timestamps = np.concatenate([records['timestamp'][rows] for records, rows in zip(segments, candidates)])
+        segment_indices = np.repeat(np.arange(len(candidates)), [len(rows) for rows in candidates])
+        rows = np.concatenate(candidates)
+        # A stable sort keeps the order of each writer's rolls within the same millisecond.
+        order = np.argsort(timestamps, kind='stable')
+        if last is not None:
+            order = order[max(0, len(order) - last):]
+        return [JournalEntry(segments[segment][row]) for segment, row in zip(segment_indices[order], rows[order])]
+
+
+roll_journal = Lazy(lambda: RollJournal(
+    config.journal_dir, records_per_segment=config.journal_segment_records, writer=config.process_name))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Show the rolls in the roll journal.')
+    parser.add_argument('--dir', default=None, help='The journal directory, defaulting to JOURNAL_DIR')
+    parser.add_argument('--guild', type=int, help='Only show rolls in this guild')
+    parser.add_argument('--channel', type=int, help='Only show rolls in this channel')
+    parser.add_argument('--user', type=int, help='Only show rolls of this user')
+    parser.add_argument('--last', type=int, default=10, help='The number of most recent rolls to show')
+    args = parser.parse_args(argv)
+
+    reader = JournalReader(args.dir or config.journal_dir)
+    start = time.perf_counter()
+    total = reader.count()
+    entries = reader.find(guild_id=args.guild, channel_id=args.channel, user_id=args.user, last=args.last)
+    print(f'{total:,} rolls in {len(reader.segments())} segments, scanned in {time.perf_counter() - start:.2f} s')
+    for entry in entries:
+        # The number of dice showing each face, per roll phase
+        rolls = ', '.join(
+            f'{phase.name.lower()}={list(roll.counts)}{" (failed)" if roll.failed_reroll else ""}'
+            for phase, roll in entry.roll_history.rolls.items())
+        print(f'{entry.timestamp:%Y-%m-%d %H:%M:%S} guild={entry.guild_id} channel={entry.channel_id} '
+              f'user={entry.user_id} {entry.dice_set.value if entry.dice_set else "custom"}: {rolls}')
+
+
+if __name__ == '__main__':
+    main()
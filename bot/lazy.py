@@ -0,0 +1,50 @@
+"""Lazily created module level singletons.
+
+Modules such as bot.config and bot.channel_settings expose a shared instance
+(config, channel_settings, ...). Creating these on import would read the
+environment, open files, and start threads for every importer, including the
+tests and tools that never use them. Instead, they are wrapped in a Lazy
+proxy, which creates the instance on first use.
+"""
+
+
+class Lazy:
+    """A proxy that creates the wrapped object on first attribute access.
+
+    Attribute reads and writes are forwarded to the wrapped object, so the
+    proxy can be used in its place, e.g. lazy_config.token.
+    """
+    __slots__ = ('_lazy_factory', '_lazy_instance')
+
+    def __init__(self, factory):
+        """Initializes the proxy.
+
+        Args:
+            factory: A function without arguments that creates the object.
+        """
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_instance', None)
+
+    def __getattr__(self, name):
+        return getattr(resolve(self), name)
+
+    def __setattr__(self, name, value):
+        setattr(resolve(self), name, value)
+
+    def __repr__(self):
+        instance = object.__getattribute__(self, '_lazy_instance')
+        return f'Lazy({instance!r})' if instance is not None else 'Lazy(<not created yet>)'
+
+
+def resolve(proxy: Lazy):
+    """Returns the object wrapped by the proxy, creating it if needed."""
+    instance = object.__getattribute__(proxy, '_lazy_instance')
+    if instance is None:
+        instance = object.__getattribute__(proxy, '_lazy_factory')()
+        object.__setattr__(proxy, '_lazy_instance', instance)
+    return instance
+
+
+def is_created(proxy: Lazy) -> bool:
+    """Returns true if the object wrapped by the proxy has been created."""
+    return object.__getattribute__(proxy, '_lazy_instance') is not None
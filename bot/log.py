@@ -0,0 +1,191 @@
+"""Structured, non-blocking logging.
+
+Log calls on the event loop only put the record on a queue. A QueueListener
+thread formats the records as JSON lines and writes them out, so neither the
+formatting nor the I/O blocks the event loop.
+
+Records logged while handling an interaction carry its context (interaction
+id, guild, channel, user, and command), see log_interaction. High-volume
+events are logged with extra=SAMPLED, and only a configurable fraction of
+them is kept per level (see SamplingFilter).
+"""
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Pass as extra to mark a record as a high-volume event that may be sampled.
+SAMPLED = {'sampled': True}
+
+# The attributes of every log record, as opposed to the fields passed as extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'sampled'}
+
+# The context of the interaction currently being handled, if any
+_interaction_context: ContextVar[dict | None] = ContextVar('interaction_context', default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the context of the interaction being handled to each record."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _interaction_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the high-volume records, per level.
+
+    Records that aren't marked as high-volume (see SAMPLED) are always kept.
+
+    Attributes:
+        rates: A dictionary that maps levels to the fraction of high-volume
+            records to keep. Levels that aren't listed are not sampled.
+    """
+    def __init__(self, rates: dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sampled', False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line JSON object.
+
+    Besides the time, level, logger, and message, the object contains the
+    interaction context and any fields passed as extra.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves the formatting to the listener.
+
+    The standard QueueHandler formats each record before putting it on the
+    queue. This one only merges the message arguments, which may be mutable,
+    and renders the exception traceback, which can't be pickled or outlive
+    the frame.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: int | str = logging.INFO, sample_rates: dict[int, float] | None = None,
+                  stream=None) -> logging.handlers.QueueListener:
+    """Routes all logging through a queue to a JSON writer thread.
+
+    Args:
+        level: The minimum level of the records to log.
+        sample_rates: The fraction of high-volume records to keep, per level.
+        stream: The stream to write to, defaulting to stderr.
+
+    Returns:
+        The started queue listener, which must be stopped on shutdown to flush
+        the remaining records.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredFormatQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+    queue_handler.addFilter(ContextFilter())
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def parse_sample_rates(value: str) -> dict[int, float]:
+    """Parses sample rates such as 'DEBUG=0.01,INFO=0.5' into a dictionary keyed by level.
+
+    Raises:
+        ValueError: If a level or rate is invalid.
+    """
+    rates = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        level_name, _, rate = item.partition('=')
+        level = logging.getLevelName(level_name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f'Invalid log level: {level_name!r}')
+        rates[level] = float(rate)
+    return rates
+
+
+def log_interaction(command: str):
+    """Decorates an interaction handler to log with the interaction's context.
+
+    The handler must take the interaction as its first argument after self.
+    Once the handler finishes, logs its duration as a high-volume event, or
+    the error it raised.
+
+    Args:
+        command: The name of the command or button, e.g. 'roll' or 'reroll'.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, interaction: discord.Interaction, *args, **kwargs):
+            token = _interaction_context.set({
+                'interaction_id': interaction.id,
+                'guild_id': interaction.guild_id,
+                'channel_id': interaction.channel_id,
+                'user_id': interaction.user.id,
+                'command': command,
+            })
+            start = time.perf_counter()
+            try:
+                result = await handler(self, interaction, *args, **kwargs)
+            except Exception as e:
+                # discord.py logs the traceback, but without the interaction's context.
+                logger.warning('Failed to handle %s: %r', command, e,
+                               extra={'duration_ms': round((time.perf_counter() - start) * 1000, 3)})
+                raise
+            else:
+                logger.info('Handled %s', command,
+                            extra={'duration_ms': round((time.perf_counter() - start) * 1000, 3)} | SAMPLED)
+                return result
+            finally:
+                _interaction_context.reset(token)
+        return wrapper
+    return decorator
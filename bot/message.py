@@ -18,13 +18,24 @@ N/A: :two:
 In case of lost successes due to to a failed reroll, we append a line like this:
 
 LOST 1 Basic: :four: :four:
+
+Rolls too large to fit into a message this way use count notation instead:
+
+Roll: :one:×41 :two:×38 :three:×29 :four:×35 :five:×33 :six:×24
+----------
+1 Jackpot: :one:×41 , :two:×38 , ...
 """
-import random
 import re
 import textwrap
+from collections import OrderedDict
 import discord
-from bot.dice import DiceSet, EmojiDiceConverter
-from bot.roll import RollPhase, Roll, RollHistory
+from bot.advisor import Advice
+from bot.dice import ENVIRONMENTS, CustomDiceSet, DiceSet, EmojiDiceConverter, current_environment
+from bot.odds import RollOdds
+from bot.rng import dice_source
+from bot.roll import NUM_FACES, RollPhase, Roll, RollHistory
+from bot.simulate import SimulationResult, Strategy
+from bot.stats import MAX_TIER, REROLL_PHASES, RollStats
 
 class RollPhaseMessageConverter:
     """Converts roll phases to and from strings."""
@@ -43,6 +54,112 @@ class RollPhaseMessageConverter:
         return self.STRING_PHASE_MAP.get(string)
 
 
+# Discord's limits for the description of a single embed, and for all embeds of a message
+MAX_EMBED_DESCRIPTION_LENGTH = 4096
+MAX_MESSAGE_EMBEDS_LENGTH = 6000
+# Roll messages longer than this are rendered in compact count notation.
+MAX_FULL_ROLL_MESSAGE_LENGTH = MAX_MESSAGE_EMBEDS_LENGTH - 200
+# Separates the emoji from the number of dice in compact count notation
+COUNT_SEPARATOR = '×'
+
+# Thumbs up/down shown after the phase name of rerolls
+THUMBS_UP = ' :thumbsup:'
+THUMBS_DOWN = ' :thumbsdown:'
+# The prefix of each roll line, by roll phase and thumbs up/down
+PHASE_PREFIXES = {
+    (roll_phase, thumbs): f'\n{phase_name}{thumbs}: '
+    for roll_phase, phase_name in RollPhaseMessageConverter.PHASE_STRING_MAP.items()
+    for thumbs in ['', THUMBS_UP, THUMBS_DOWN]
+}
+# The largest number of matching dice with prebuilt emoji fragments
+MAX_PREBUILT_MATCHES = 9
+
+
+class RenderTables:
+    """Prebuilt emoji fragments for rendering the rolls of a dice set.
+
+    Rendering a roll then only joins cached fragments, rather than converting
+    and joining the emoji of each die.
+
+    Attributes:
+        converter: The shared EmojiDiceConverter of the dice set.
+        emoji_lengths: The length of each face's emoji plus a separator, indexed by face - 1.
+    """
+    def __init__(self, converter: EmojiDiceConverter):
+        self.converter = converter
+        self.emoji_lengths = tuple(len(converter.dice_to_emoji(face)) + 1 for face in range(1, NUM_FACES + 1))
+        # E.g. (6, 4) -> ':six: :six: :six: :six:'
+        self._fragments = {
+            (face, count): ' '.join([converter.dice_to_emoji(face)] * count)
+            for face in range(1, NUM_FACES + 1)
+            for count in range(1, MAX_PREBUILT_MATCHES + 1)
+        }
+
+    def dice_fragment(self, face: int, count: int, compact: bool = False) -> str:
+        """Returns the text for a number of dice showing the same face."""
+        if compact and count > 1:
+            return f'{self.converter.dice_to_emoji(face)}{COUNT_SEPARATOR}{count}'
+        fragment = self._fragments.get((face, count))
+        if fragment is None:
+            fragment = ' '.join([self.converter.dice_to_emoji(face)] * count)
+        return fragment
+
+
+_render_tables = {}
+# The render tables of the most recently used custom dice sets
+_custom_render_tables = OrderedDict()
+MAX_CUSTOM_RENDER_TABLES = 1000
+
+
+def build_render_tables():
+    """Builds the render tables of every dice set and environment.
+
+    The tables are otherwise built on first use, per dice set (see render_tables).
+    """
+    for dice_set in DiceSet:
+        for env in ENVIRONMENTS:
+            render_tables(dice_set, env)
+
+
+def render_tables(dice_set: DiceSet | CustomDiceSet, env: str | None = None) -> RenderTables:
+    """Returns the render tables for the dice set and environment.
+
+    The environment defaults to the one the bot is running in. Only the tables
+    of the most recently used custom dice sets are kept.
+    """
+    if isinstance(dice_set, CustomDiceSet):
+        tables = _custom_render_tables.get(dice_set.id)
+        if tables is None:
+            tables = _custom_render_tables[dice_set.id] = RenderTables(dice_set.converter)
+            while len(_custom_render_tables) > MAX_CUSTOM_RENDER_TABLES:
+                _custom_render_tables.popitem(last=False)
+        else:
+            _custom_render_tables.move_to_end(dice_set.id)
+        return tables
+    key = (dice_set, env or current_environment())
+    tables = _render_tables.get(key)
+    if tables is None:
+        tables = _render_tables[key] = RenderTables(EmojiDiceConverter.for_dice_set(*key))
+    return tables
+
+
+STRATEGY_NAMES = {
+    Strategy.KEEP: 'Keep',
+    Strategy.REROLL: 'Re-roll',
+    Strategy.FREE_REROLL: 'Free Re-roll',
+    Strategy.REROLL_ALL_IN: 'Re-roll, then All In',
+    Strategy.FREE_REROLL_ALL_IN: 'Free Re-roll, then All In',
+}
+
+# The names of the actions of the strategy advice (see bot.advisor)
+ACTION_NAMES = {
+    'keep': 'Keep',
+    'reroll': 'Re-roll',
+    'free_reroll': 'Free Re-roll',
+    'all_in': 'All In',
+}
+
+
 class MessageGenerator:
     """Generates messages for the Octane bot."""
     # NB: We considered extracting each message type into its own class, but
@@ -50,62 +167,186 @@ class MessageGenerator:
     #     message requires an OctaneRoller parameter, while the coin message
     #     doesn't.
     def __init__(self, dice_set=DiceSet.OCTANE):
-        self.emoji_dice_converter = EmojiDiceConverter(dice_set=dice_set)
+        self.render_tables = render_tables(dice_set)
+        self.emoji_dice_converter = self.render_tables.converter
 
     def generate_roll_message(self, roll_history: RollHistory):
-        """Generates a message containing the result of the roll."""
-        message = ''
+        """Generates a message containing the result of the roll.
+
+        Large rolls that wouldn't fit into the embeds of a single message are
+        rendered in compact count notation (e.g. :six:×14) instead of repeating
+        the emoji for every die.
+        """
+        compact = not self._fits_full_rendering(roll_history)
+        parts = []
         # Append rolls
         for roll_phase in [RollPhase.INITIAL, RollPhase.REROLL, RollPhase.FREE_REROLL, RollPhase.ALL_IN]:
-            message += self._generate_roll_line(roll_history, roll_phase)
+            parts.append(self._generate_roll_line(roll_history, roll_phase, compact))
+
+        parts.append('\n----------')
 
-        message += '\n----------'
- 
         # Append matches (regular and lost)
         final_roll = roll_history.get_final_roll()
-        message += self._generate_matches_text(final_roll.matches)
-        message += self._generate_matches_text(final_roll.failed_matches, lost=True)
- 
-        return message
-    
-    def _generate_roll_line(self, roll_history: RollHistory, roll_phase: RollPhase):
+        parts.append(self._generate_matches_text(final_roll.matches, compact=compact))
+        parts.append(self._generate_matches_text(final_roll.failed_matches, lost=True, compact=compact))
+
+        return ''.join(parts)
+
+    def generate_roll_pages(self, roll_history: RollHistory):
+        """Generates the roll message, split into pages that each fit into an embed."""
+        return paginate(self.generate_roll_message(roll_history))
+
+    def _fits_full_rendering(self, roll_history: RollHistory):
+        """Returns true if the roll message with one emoji per die fits into a message.
+
+        Lines can't be split across embeds, so each line has to fit into a
+        single embed, and all lines together into the embeds of one message.
+        """
+        emoji_lengths = self.render_tables.emoji_lengths
+        line_lengths = [
+            # Allow for the phase name and the separators between match groups
+            sum(count * emoji_length for count, emoji_length in zip(roll.counts, emoji_lengths)) + 40
+            for roll in roll_history.rolls.values()]
+        # The matches list each die of the final roll once more.
+        line_lengths.append(line_lengths[-1] + 40 * NUM_FACES)
+        return (max(line_lengths) <= MAX_EMBED_DESCRIPTION_LENGTH and
+                sum(line_lengths) <= MAX_FULL_ROLL_MESSAGE_LENGTH)
+
+    def _generate_roll_line(self, roll_history: RollHistory, roll_phase: RollPhase, compact: bool = False):
         """Generates a single line of the roll message."""
         roll = roll_history.get_roll(roll_phase)
         if roll:
-            roll_phase_name = RollPhaseMessageConverter().phase_to_string(roll_phase)
             # Show thumbs up/down for rerolls
             roll_emoji = ''
             if roll_phase in [RollPhase.REROLL, RollPhase.ALL_IN]:
-                roll_emoji = ' :thumbsdown:' if roll.failed_reroll else ' :thumbsup:'
+                roll_emoji = THUMBS_DOWN if roll.failed_reroll else THUMBS_UP
             elif roll_phase == RollPhase.FREE_REROLL:
                 # Free rerolls don't show thumbs down as no success is lost. Still
                 # show thumbs up if the reroll improved the result over the initial roll.
                 if roll.is_better_than(roll_history.get_roll(RollPhase.INITIAL)):
-                    roll_emoji = ' :thumbsup:'
-            return f'\n{roll_phase_name}{roll_emoji}: ' + ' '.join(
-                self.emoji_dice_converter.dice_to_emoji(die) for die in roll.dice)
+                    roll_emoji = THUMBS_UP
+            # The dice are sorted, so we can render each face's dice as one fragment.
+            return PHASE_PREFIXES[(roll_phase, roll_emoji)] + ' '.join(
+                self.render_tables.dice_fragment(face, count, compact)
+                for face, count in enumerate(roll.counts, start=1) if count)
         return ''
 
-    def _generate_matches_text(self, matches, lost=False):
+    def _generate_matches_text(self, matches, lost=False, compact=False):
         """Appends the matches (regular or lost) to the message."""
-        message = ''
         lost_text = 'LOST ' if lost else ''
-        for num_matches, dice in sorted(matches.items(), reverse=True):
-            message += (f'\n{lost_text}{len(dice)} {number_of_matches_to_success_name(num_matches)}: ' + 
-                        ' , '.join(' '.join(
-                            self.emoji_dice_converter.dice_to_emoji(die) for _ in range(num_matches)) for die in dice))
-        return message
+        return ''.join(
+            f'\n{lost_text}{len(dice)} {number_of_matches_to_success_name(num_matches)}: ' +
+            ' , '.join(self.render_tables.dice_fragment(die, num_matches, compact) for die in dice)
+            for num_matches, dice in sorted(matches.items(), reverse=True))
 
     def generate_coin_message(self):
         """Generates a message containing the result of the coin flip."""
-        coin = random.randint(1, 2)
+        # Odd and even faces of a die split the coin flips evenly.
+        coin = dice_source.roll_die() % 2 + 1
         return 'Coin flip: ' + ('HEADS (bad)' if coin == 1 else 'TAILS (good)')
     
     def generate_d6_message(self):
         """Generates a message containing the result of the d6 roll."""
-        converter = EmojiDiceConverter(dice_set=DiceSet.NUMBERS)
-        return 'D6: ' + converter.dice_to_emoji(random.randint(1, 6))
+        converter = EmojiDiceConverter.for_dice_set(DiceSet.NUMBERS)
+        return 'D6: ' + converter.dice_to_emoji(dice_source.roll_die())
     
+    def generate_odds_message(self, odds: RollOdds, max_profiles: int = 10):
+        """Generates a message containing the odds of rolling the given number of dice.
+
+        Args:
+            odds: The roll odds.
+            max_profiles: The maximum number of success profiles to list.
+        """
+        lines = [
+            f'**Odds for {odds.num_dice} {"die" if odds.num_dice == 1 else "dice"}**',
+            f'At least one success: {_format_probability(odds.success_probability())}',
+            f'Expected score: {odds.expected_score() / 3:.2f} (Basic = 1, Critical = 3, Extreme = 9, ...)',
+            '----------',
+            'Best success:',
+        ]
+        for num_matches, probability in reversed(odds.best_success_probabilities().items()):
+            name = number_of_matches_to_success_name(num_matches) if num_matches else 'None'
+            lines.append(f'{name}: {_format_probability(probability)}')
+
+        lines += ['----------', 'Most likely results:']
+        profiles = sorted(odds.profile_probabilities().items(), key=lambda item: item[1], reverse=True)
+        for profile, probability in profiles[:max_profiles]:
+            lines.append(f'{_format_success_profile(profile)}: {_format_probability(probability)}')
+        return '\n'.join(lines)
+
+    def generate_simulation_message(self, result: SimulationResult):
+        """Generates a message summarizing the result of a simulation."""
+        lines = [
+            f'**Simulated {result.trials:,} rolls of {result.num_dice} '
+            f'{"die" if result.num_dice == 1 else "dice"} ({STRATEGY_NAMES[result.strategy]})**',
+            f'Average score: {result.mean_score() / 3:.2f} (Basic = 1, Critical = 3, Extreme = 9, ...)',
+            f'At least one success: {_format_probability(result.rate(result.successes))}',
+            f'Better than the initial roll: {_format_probability(result.rate(result.improved))}',
+            f'Worse than the initial roll: {_format_probability(result.rate(result.worsened))}',
+        ]
+        if result.strategy != Strategy.KEEP:
+            reroll_name = 'Free Re-rolls' if result.strategy.free else 'Re-rolls'
+            lines += [
+                '----------',
+                f'{reroll_name}: {_format_probability(result.rate(result.rerolls))} of rolls',
+            ]
+            if not result.strategy.free:
+                lines.append(f'Failed Re-rolls: {_format_probability(result.rate(result.failed_rerolls, result.rerolls))}')
+        if result.strategy.all_in:
+            lines += [
+                f'All In: {_format_probability(result.rate(result.all_ins))} of rolls',
+                f'Failed All In: {_format_probability(result.rate(result.failed_all_ins, result.all_ins))}',
+            ]
+        return '\n'.join(lines)
+
+    def generate_advice_message(self, advice: Advice):
+        """Generates a message comparing the expected results of keeping a roll and of each allowed reroll."""
+        best = advice.best()
+        lines = [
+            f'**Advice for a roll scoring {advice.score / 3:.2f}**',
+            'Expected final scores, with the best follow-up (Basic = 1, Critical = 3, Extreme = 9, ...):',
+        ]
+        for action in advice.actions:
+            line = f'{ACTION_NAMES[action.action]}: {float(action.expected_score) / 3:.2f}'
+            if action.action != 'keep':
+                line += f' (improves: {_format_probability(float(action.improve_probability))}'
+                if action.loss_probability:
+                    lost = 'all successes' if action.action == 'all_in' else 'a success'
+                    line += f', loses {lost}: {_format_probability(float(action.loss_probability))}'
+                line += ')'
+            lines.append(f'**{line}**' if action is best else line)
+        lines += ['----------', f'Best: {ACTION_NAMES[best.action]}']
+        return '\n'.join(lines)
+
+    def generate_stats_message(self, title: str, stats: RollStats):
+        """Generates a message summarizing the roll statistics of a user, channel, or guild."""
+        if not stats.rolls:
+            return f'**{title}**\nNo rolls yet.'
+        lines = [
+            f'**{title}**',
+            f'Rolls: {stats.rolls:,} (average pool: {stats.average_dice():.1f} dice)',
+            f'Successes per roll: {stats.successes / stats.rolls:.2f} '
+            f'(expected: {stats.expected_successes / stats.rolls:.2f}, luck: {stats.luck():+.1%})',
+            f'At least one success: {_format_probability(stats.successful_rolls / stats.rolls)} '
+            f'(expected: {_format_probability(stats.expected_successful_rolls / stats.rolls)})',
+            '----------',
+            'Best success of the initial rolls:',
+        ]
+        for num_matches in range(MAX_TIER, -1, -1):
+            if num_matches == 1:
+                continue
+            name = number_of_matches_to_success_name(num_matches) if num_matches else 'None'
+            lines.append(f'{name}: {_format_probability(stats.tiers[num_matches] / stats.rolls)}')
+        lines.append('----------')
+        for phase, attempts, improved in zip(REROLL_PHASES, stats.attempts, stats.improved):
+            name = RollPhaseMessageConverter.PHASE_STRING_MAP[phase] + 's'
+            if attempts:
+                lines.append(f'{name}: {_format_probability(improved / attempts)} improved the result '
+                             f'({improved:,} of {attempts:,})')
+            else:
+                lines.append(f'{name}: none yet')
+        return '\n'.join(lines)
+
     def generate_help_message(self):
         """Generates a help message."""
         return textwrap.dedent(
@@ -117,7 +358,14 @@ class MessageGenerator:
                 `/roll <num_dice>`: Roll the specified number of dice.
                 `/coin`: Flip a coin.
                 `/d6`: Roll a d6.
+                `/odds <num_dice>`: Show the odds of rolling the specified number of dice.
+                `/simulate <num_dice> <strategy> <trials>`: Simulate many rolls using a re-roll strategy.
+                `/advise <dice>`: Show the expected results of keeping or re-rolling the given roll.
+                `/stats <scope> [user]`: Show the roll statistics of a user, the channel, or the server.
                 `/settings <dice_set>`: Set the dice set (Octane, Homestead, etc.) for the current channel.
+                `/diceset create <name> <emoji>`: Create a dice set for this server from six emoji.
+                `/diceset use <name>`: Use one of this server's dice sets in the current channel.
+                `/diceset list`: List this server's dice sets.
 
             The `/roll` command automatically sorts the rolled dice and groups them by the number of matches. It also shows any applicable reroll buttons (Reroll, Free Reroll, All In).
             """
@@ -133,32 +381,79 @@ class MessageParser:
         emoji_dice_converter: An EmojiDiceConverter instance.
         roll_history: The roll history.
     """
+    # Matches any roll line, e.g. 'Re-roll :thumbsdown: :one: :two:×3'
+    ROLL_LINE_PATTERN = re.compile(
+        '(?P<phase>' +
+        '|'.join(re.escape(name) for name in sorted(RollPhaseMessageConverter.STRING_PHASE_MAP, key=len, reverse=True)) +
+        f')(?P<thumbs>{re.escape(THUMBS_UP)}|{re.escape(THUMBS_DOWN)})?: (?P<dice>.*)')
+
     def __init__(self, interaction: discord.Interaction, dice_set=DiceSet.OCTANE):
-        self.emoji_dice_converter = EmojiDiceConverter(dice_set=dice_set)
+        self.emoji_dice_converter = EmojiDiceConverter.for_dice_set(dice_set)
         self.roll_history = None
         self._parse_roll_history(interaction.message)
     
-    def _parse_roll_history(self, message: str):
-        """Parses the dice rolls from a message."""
+    def _parse_roll_history(self, message: discord.Message):
+        """Parses the dice rolls from a message in a single pass.
+
+        Raises:
+            ValueError: If the message doesn't contain a valid roll.
+        """
         self.roll_history = RollHistory()
         if not message.embeds:
             raise ValueError('Message does not contain an embed.')
-        embed = message.embeds[0]
-        lines = embed.description.split('\n')
-        for line in lines:
-            if line.startswith('---'):
-                break
-            for roll_phase in [RollPhase.INITIAL, RollPhase.REROLL, RollPhase.FREE_REROLL, RollPhase.ALL_IN]:
-                self._parse_roll_line(line, roll_phase)
-
-    def _parse_roll_line(self, line: str, roll_phase: RollPhase):
-        """Parses a single line of the roll message."""
-        prefix_pattern = re.compile(rf'{RollPhaseMessageConverter().phase_to_string(roll_phase)}( :thumbsup:| :thumbsdown:)?: ')
-        match = prefix_pattern.match(line)
-        if match:
-            dice_string = line[match.end():]
-            dice = [self.emoji_dice_converter.emoji_to_dice(die) for die in dice_string.split(' ') if die != '']
-            self.roll_history.add_roll(roll_phase, Roll(dice))
+        # Long messages are split into multiple embeds, at line boundaries.
+        text = '\n'.join(embed.description or '' for embed in message.embeds)
+        # The roll lines end at the separator, so we don't need to look at the matches.
+        separator = text.find('\n---')
+        if separator != -1:
+            text = text[:separator]
+        for line in text.split('\n'):
+            match = self.ROLL_LINE_PATTERN.match(line)
+            if match:
+                roll_phase = RollPhaseMessageConverter.STRING_PHASE_MAP[match['phase']]
+                roll = Roll.from_counts(self._parse_dice_counts(match['dice']))
+                if match['thumbs'] == THUMBS_DOWN:
+                    if roll_phase == RollPhase.ALL_IN:
+                        roll.mark_as_failed_all_in()
+                    else:
+                        roll.mark_as_failed_reroll()
+                self.roll_history.add_roll(roll_phase, roll)
+        if RollPhase.INITIAL not in self.roll_history.rolls:
+            raise ValueError('Message does not contain a roll.')
+
+    def _parse_dice_counts(self, dice_string: str) -> list[int]:
+        """Parses the emoji of a roll line into the number of dice showing each face."""
+        counts = [0] * NUM_FACES
+        for token in dice_string.split(' '):
+            if token == '':
+                continue
+            # Compact count notation, e.g. :six:×14
+            emoji, _, count = token.partition(COUNT_SEPARATOR)
+            die = self.emoji_dice_converter.emoji_to_dice(emoji)
+            if die is None:
+                raise ValueError(f'Unknown dice emoji: {emoji}')
+            if count and not count.isdigit():
+                raise ValueError(f'Invalid dice count: {token}')
+            counts[die - 1] += int(count) if count else 1
+        return counts
+
+def paginate(message, max_length=MAX_EMBED_DESCRIPTION_LENGTH):
+    """Splits a message at line boundaries into pages of at most max_length characters.
+
+    Lines longer than max_length are not split.
+    """
+    pages = []
+    page_lines = []
+    page_length = 0
+    for line in message.split('\n'):
+        if page_lines and page_length + 1 + len(line) > max_length:
+            pages.append('\n'.join(page_lines))
+            page_lines = []
+            page_length = 0
+        page_length += len(line) + (1 if page_lines else 0)
+        page_lines.append(line)
+    pages.append('\n'.join(page_lines))
+    return pages
 
 def number_of_matches_to_success_name(num_matches):
     match num_matches:
@@ -170,13 +465,23 @@ def number_of_matches_to_success_name(num_matches):
             return 'Extreme'
         case 5:
             return 'Impossible'
-        case 6:
-            return 'Jackpot'
-        case 7:
-            return 'Jackpot'
-        case 8:
-            return 'Jackpot'
-        case 9:
+        case _ if num_matches >= 6:
             return 'Jackpot'
         case _:
             return 'N/A'
+
+def _format_success_profile(profile):
+    """Formats a success profile, e.g. (3, 2, 2) as '1 Critical, 2 Basic'."""
+    if not profile:
+        return 'No success'
+    names = {}
+    for num_matches in profile:
+        name = number_of_matches_to_success_name(num_matches)
+        names[name] = names.get(name, 0) + 1
+    return ', '.join(f'{count} {name}' for name, count in names.items())
+
+def _format_probability(probability):
+    """Formats a probability as a percentage, without rounding small values to zero."""
+    if 0 < probability < 0.0001:
+        return '<0.01%'
+    return f'{probability:.2%}'
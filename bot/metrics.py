@@ -0,0 +1,229 @@
+"""Lightweight in-process metrics, exposed in the Prometheus text format.
+
+The hot path records how long each stage of an interaction takes (settings
+lookup, parsing, rolling, rendering, view construction, and the Discord API
+calls), and counts failures. Recording a measurement only updates a few
+numbers in memory, so the instrumentation can stay on in production.
+
+If METRICS_PORT is set, the bot serves the metrics at /metrics on that port
+(see MetricsServer).
+"""
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# The upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metric:
+    """A metric, optionally split by a single label.
+
+    Attributes:
+        name: The name of the metric.
+        documentation: A short description of the metric.
+        label_name: The name of the label, or None for an unlabelled metric.
+        values: A dictionary that maps each label value to the metric's value.
+    """
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_name: str | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.values = {}
+
+    def samples(self):
+        """Yields the samples of the metric as (name, labels, value) tuples."""
+        raise NotImplementedError
+
+    def _labels(self, label: str | None) -> dict[str, str]:
+        return {self.label_name: label} if self.label_name else {}
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+    type_name = 'counter'
+
+    def inc(self, label: str | None = None, amount: float = 1):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def samples(self):
+        for label, value in self.values.items():
+            yield f'{self.name}_total', self._labels(label), value
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+    type_name = 'gauge'
+
+    def set(self, value: float, label: str | None = None):
+        self.values[label] = value
+
+    def samples(self):
+        for label, value in self.values.items():
+            yield self.name, self._labels(label), value
+
+
+class Histogram(Metric):
+    """Counts observed values in buckets.
+
+    Attributes:
+        buckets: The upper bounds of the buckets, in ascending order.
+        values: A dictionary that maps each label value to a list with the
+            number of observations per bucket (plus one for larger values),
+            followed by the sum of all observations.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_name: str | None = None,
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_name)
+        self.buckets = buckets
+
+    def observe(self, value: float, label: str | None = None):
+        counts = self.values.get(label)
+        if counts is None:
+            counts = self.values[label] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for label, counts in self.values.items():
+            labels = self._labels(label)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels | {'le': _format_value(bound)}, cumulative
+            yield f'{self.name}_sum', labels, counts[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+class StageTimer:
+    """A context manager that records the duration of a stage in a histogram."""
+    __slots__ = ('histogram', 'stage', 'start')
+
+    def __init__(self, histogram: Histogram, stage: str):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, self.stage)
+
+
+class MetricsRegistry:
+    """A collection of metrics that can be rendered in the Prometheus text format."""
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, label_name: str | None = None) -> Counter:
+        return self._register(Counter(name, documentation, label_name))
+
+    def gauge(self, name: str, documentation: str, label_name: str | None = None) -> Gauge:
+        return self._register(Gauge(name, documentation, label_name))
+
+    def histogram(self, name: str, documentation: str, label_name: str | None = None,
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_name, buckets))
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+                    name = f'{name}{{{label_text}}}'
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+
+class MetricsServer:
+    """Serves the metrics of a registry over HTTP, for Prometheus to scrape.
+
+    Attributes:
+        registry: The registry to serve.
+        host: The address to listen on. Defaults to localhost only.
+        port: The port to listen on, or 0 to pick a free one.
+    """
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        """Starts serving the metrics at /metrics."""
+        # Imported here, as aiohttp's web server takes a while to import and is rarely needed.
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolve the actual port, in case a free one was picked.
+        self.port = self._runner.addresses[0][1]
+        logger.info('Serving metrics on http://%s:%d/metrics', self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+
+def stage(name: str) -> StageTimer:
+    """Returns a context manager that records how long a stage of an interaction takes.
+
+    Example:
+        with stage('render'):
+            pages = generator.generate_roll_pages(roll_history)
+    """
+    return StageTimer(stage_seconds, name)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value != value:
+        return 'NaN'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    'dice_bot_stage_seconds', 'The duration of each stage of handling an interaction.', 'stage')
+edit_failures = metrics.counter(
+    'dice_bot_edit_failures', 'The number of roll messages that could not be updated.')
+invalid_rerolls = metrics.counter(
+    'dice_bot_invalid_rerolls', 'The number of button presses for rerolls the roll history does not allow.', 'action')
+duplicate_presses = metrics.counter(
+    'dice_bot_duplicate_presses', 'The number of button presses that were only acknowledged, as duplicates.', 'reason')
+response_delay_seconds = metrics.histogram(
+    'dice_bot_response_delay_seconds', 'The time responses waited for rate limits to reset.', 'kind')
+rate_limited_deferrals = metrics.counter(
+    'dice_bot_rate_limited_deferrals', 'The number of interactions deferred because of a rate limit.', 'kind')
+rate_limit_hits = metrics.counter(
+    'dice_bot_rate_limit_hits', 'The number of requests Discord answered with a 429.', 'scope')
+shard_latency_seconds = metrics.gauge(
+    'dice_bot_shard_latency_seconds', 'The gateway latency of each shard, when running sharded.', 'shard')
@@ -0,0 +1,184 @@
+"""Exact probabilities for Octane dice rolls.
+
+Rather than enumerating all 6^n outcomes of rolling n dice, we enumerate the
+partitions of n into at most six face counts. Each partition determines which
+successes were rolled, and the number of outcomes that produce it follows from
+the multinomial coefficient and the number of ways to assign the counts to
+faces. The number of partitions grows polynomially with n, which keeps even
+large pools fast.
+
+Results are memoized per pool size, both in memory and on disk.
+"""
+import json
+import logging
+import math
+import os
+from collections import Counter
+
+from bot.config import config
+from bot.lazy import Lazy
+from bot.roll import NUM_FACES, match_score
+
+logger = logging.getLogger(__name__)
+
+# The largest pool size that we compute odds for
+MAX_ODDS_DICE = 60
+
+
+class RollOdds:
+    """The exact outcome distribution of rolling a pool of dice.
+
+    A success profile is a tuple of the number of matches of each success,
+    sorted in descending order. E.g. (3, 2, 2) represents a roll with one
+    critical and two basic successes. The empty tuple represents a roll without
+    any success.
+
+    Attributes:
+        num_dice: The number of dice rolled.
+        total_outcomes: The number of equally likely outcomes (6^num_dice).
+        profile_outcomes: A dictionary that maps each success profile to the
+            number of outcomes that produce it.
+        score_outcomes: A dictionary that maps each score (see
+            Roll.is_better_than) to the number of outcomes that produce it.
+    """
+    def __init__(self, num_dice: int, profile_outcomes: dict[tuple[int, ...], int]):
+        self.num_dice = num_dice
+        self.total_outcomes = NUM_FACES ** num_dice
+        self.profile_outcomes = profile_outcomes
+        self.score_outcomes = {}
+        for profile, outcomes in profile_outcomes.items():
+            score = sum(match_score(num_matches) for num_matches in profile)
+            self.score_outcomes[score] = self.score_outcomes.get(score, 0) + outcomes
+
+    def profile_probabilities(self) -> dict[tuple[int, ...], float]:
+        """Returns the probability of each success profile."""
+        return {profile: outcomes / self.total_outcomes for profile, outcomes in self.profile_outcomes.items()}
+
+    def score_probabilities(self) -> dict[int, float]:
+        """Returns the probability of each score, ordered by score."""
+        return {score: self.score_outcomes[score] / self.total_outcomes for score in sorted(self.score_outcomes)}
+
+    def best_success_probabilities(self) -> dict[int, float]:
+        """Returns the probability that the best success has the given number of matches.
+
+        The key 0 represents rolls without any success.
+        """
+        best_success = Counter()
+        for profile, outcomes in self.profile_outcomes.items():
+            best_success[profile[0] if profile else 0] += outcomes
+        return {num_matches: outcomes / self.total_outcomes for num_matches, outcomes in sorted(best_success.items())}
+
+    def success_probability(self) -> float:
+        """Returns the probability of rolling at least one success."""
+        return 1 - self.profile_outcomes.get((), 0) / self.total_outcomes
+
+    def expected_score(self) -> float:
+        """Returns the expected score of the roll."""
+        return sum(score * outcomes for score, outcomes in self.score_outcomes.items()) / self.total_outcomes
+
+    def to_dict(self) -> dict:
+        # Outcome counts exceed the precision of JSON numbers, so we store them as strings.
+        return {
+            'num_dice': self.num_dice,
+            'profiles': [[list(profile), str(outcomes)] for profile, outcomes in self.profile_outcomes.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RollOdds':
+        profile_outcomes = {tuple(profile): int(outcomes) for profile, outcomes in data['profiles']}
+        return cls(data['num_dice'], profile_outcomes)
+
+
+def compute_roll_odds(num_dice: int) -> RollOdds:
+    """Computes the exact outcome distribution of rolling the given number of dice."""
+    if not 0 < num_dice <= MAX_ODDS_DICE:
+        raise ValueError(f'The number of dice must be between 1 and {MAX_ODDS_DICE}.')
+    profile_outcomes = Counter()
+    dice_permutations = math.factorial(num_dice)
+    face_permutations = math.factorial(NUM_FACES)
+    for face_counts in _partitions(num_dice, NUM_FACES, num_dice):
+        face_counts += (0,) * (NUM_FACES - len(face_counts))
+        # The number of ways to assign the counts to distinct faces
+        face_assignments = face_permutations
+        for repeats in Counter(face_counts).values():
+            face_assignments //= math.factorial(repeats)
+        # The number of orderings of the dice for a given face assignment
+        dice_orderings = dice_permutations
+        for count in face_counts:
+            dice_orderings //= math.factorial(count)
+        profile = tuple(count for count in face_counts if count > 1)
+        profile_outcomes[profile] += face_assignments * dice_orderings
+    return RollOdds(num_dice, dict(profile_outcomes))
+
+
+def _partitions(total: int, max_parts: int, max_part: int):
+    """Yields the partitions of total into at most max_parts parts, in descending order."""
+    if total == 0:
+        yield ()
+        return
+    if max_parts == 0:
+        return
+    # The first part must be large enough for the remaining parts to fit.
+    for part in range(min(total, max_part), math.ceil(total / max_parts) - 1, -1):
+        for rest in _partitions(total - part, max_parts - 1, part):
+            yield (part,) + rest
+
+
+class OddsCalculator:
+    """Memoizes the roll odds per pool size, in memory and optionally on disk.
+
+    Attributes:
+        cache_dir: The directory for the on-disk cache, or None to only cache in memory.
+    """
+    def __init__(self, cache_dir: str | None = None):
+        self.cache_dir = cache_dir
+        self._odds = {}
+
+    def roll_odds(self, num_dice: int) -> RollOdds:
+        """Returns the outcome distribution of rolling the given number of dice."""
+        odds = self._odds.get(num_dice)
+        if odds is None:
+            odds = self._load(num_dice)
+            if odds is None:
+                odds = compute_roll_odds(num_dice)
+                self._store(odds)
+            self._odds[num_dice] = odds
+        return odds
+
+    def cached_roll_odds(self, num_dice: int) -> RollOdds | None:
+        """Returns the outcome distribution if it is cached in memory, without any I/O."""
+        return self._odds.get(num_dice)
+
+    def remember(self, odds: RollOdds):
+        """Caches odds computed elsewhere, e.g. in a worker process, in memory."""
+        self._odds[odds.num_dice] = odds
+
+    def _path(self, num_dice: int) -> str:
+        return os.path.join(self.cache_dir, f'odds_{num_dice}.json')
+
+    def _load(self, num_dice: int) -> RollOdds | None:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(num_dice)) as f:
+                return RollOdds.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning('Ignoring invalid odds cache for %d dice: %s', num_dice, e)
+            return None
+
+    def _store(self, odds: RollOdds):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(odds.num_dice)
+            # Write to a temporary file first, so readers never see a partial file.
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(odds.to_dict(), f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning('Failed to store odds cache for %d dice: %s', odds.num_dice, e)
+
+
+odds_calculator = Lazy(lambda: OddsCalculator(config.odds_cache_dir))
@@ -0,0 +1,138 @@
+"""Tracks Discord's rate limits from the headers of the API responses.
+
+Discord reports the state of each rate limit bucket in the headers of every
+response (X-RateLimit-Bucket, -Remaining, and -Reset-After), and answers with
+a 429 once a bucket, or the global limit, is exhausted. discord.py waits out
+these limits on its own, but only once a request is already being sent. The
+tracker keeps the last reported state, so that the response scheduler (see
+controller.ResponseScheduler) can tell upfront how long a response would have
+to wait, and defer the interaction instead of missing its response window.
+
+The tracker sees the responses through an aiohttp TraceConfig, which both
+discord.py's HTTP client and our own sessions accept.
+
+Buckets are tracked per scope, which is the resource a request is limited by:
+a channel, an interaction, or an interaction's webhook (for followups and
+edits of the original response).
+"""
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from bot.metrics import rate_limit_hits
+
+logger = logging.getLogger(__name__)
+
+# The number of scopes to remember. Interaction scopes are short-lived, so the
+# least recently updated ones are dropped.
+MAX_TRACKED_SCOPES = 10000
+GLOBAL_SCOPE = 'global'
+
+# Matches the major parameter of an API path, which determines the scope of its buckets
+SCOPE_PATTERN = re.compile(
+    r'/api/v\d+/(?:(?P<kind>channels|interactions)/(?P<id>\d+)|webhooks/(?P<webhook>\d+/[^/?]+))')
+
+
+class BucketState:
+    """The last reported state of a rate limit bucket.
+
+    Attributes:
+        remaining: The number of requests that can be made before the reset.
+        reset_at: When the bucket resets, in time.monotonic() seconds.
+    """
+    __slots__ = ('remaining', 'reset_at')
+
+    def __init__(self, remaining: int, reset_at: float):
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+
+def request_scope(url: str) -> str | None:
+    """Returns the scope of the rate limits of a request, or None if it isn't a scoped API request."""
+    match = SCOPE_PATTERN.search(url)
+    if match is None:
+        return None
+    if match['webhook']:
+        return f'webhook:{match["webhook"]}'
+    return f'{match["kind"].rstrip("s")}:{match["id"]}'
+
+
+def interaction_scopes(interaction) -> list[str]:
+    """Returns the scopes the responses to an interaction are limited by."""
+    scopes = [f'interaction:{interaction.id}']
+    if interaction.channel_id is not None:
+        scopes.append(f'channel:{interaction.channel_id}')
+    token = getattr(interaction, 'token', None)
+    if token is not None:
+        scopes.append(f'webhook:{interaction.application_id}/{token}')
+    return scopes
+
+
+class RateLimitTracker:
+    """The last reported state of the rate limit buckets, per scope.
+
+    Attributes:
+        max_scopes: The number of scopes whose buckets are kept.
+        clock: The monotonic clock the reset times are measured with, e.g. a fake one in tests.
+    """
+    def __init__(self, max_scopes: int = MAX_TRACKED_SCOPES, clock=time.monotonic):
+        self.max_scopes = max_scopes
+        self.clock = clock
+        # Maps each scope to a dictionary of its buckets' states
+        self._scopes = OrderedDict()
+        self._global_reset_at = 0.0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Returns a trace config that records the rate limit headers of every response."""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(self._on_request_end)
+        return trace_config
+
+    def record(self, url: str, status: int, headers):
+        """Records the rate limit headers of a response to a request to the given URL."""
+        now = self.clock()
+        if status == 429:
+            retry_after = float(headers.get('Retry-After', 1))
+            if headers.get('X-RateLimit-Global') == 'true' or headers.get('X-RateLimit-Scope') == 'global':
+                rate_limit_hits.inc('global')
+                logger.warning('Hit the global rate limit, retrying after %.2f s', retry_after)
+                self._global_reset_at = max(self._global_reset_at, now + retry_after)
+                return
+            rate_limit_hits.inc('bucket')
+            remaining, reset_after = 0, retry_after
+        elif 'X-RateLimit-Remaining' in headers:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset_after = float(headers.get('X-RateLimit-Reset-After', 0))
+        else:
+            return
+        scope = request_scope(url)
+        if scope is None:
+            return
+        buckets = self._scopes.get(scope)
+        if buckets is None:
+            buckets = self._scopes[scope] = {}
+        self._scopes.move_to_end(scope)
+        buckets[headers.get('X-RateLimit-Bucket', '')] = BucketState(remaining, now + reset_after)
+        if len(self._scopes) > self.max_scopes:
+            self._scopes.popitem(last=False)
+
+    def delay(self, scopes: list[str]) -> float:
+        """Returns the number of seconds until a request limited by the given scopes can be sent."""
+        now = self.clock()
+        reset_at = self._global_reset_at
+        for scope in scopes:
+            buckets = self._scopes.get(scope)
+            if buckets:
+                for bucket in buckets.values():
+                    if bucket.remaining <= 0 and bucket.reset_at > reset_at:
+                        reset_at = bucket.reset_at
+        return max(0.0, reset_at - now)
+
+    async def _on_request_end(self, session, context, params: aiohttp.TraceRequestEndParams):
+        self.record(str(params.url), params.response.status, params.response.headers)
+
+
+rate_limits = RateLimitTracker()
@@ -0,0 +1,180 @@
+"""Random dice faces for the rolls.
+
+Rolling each die with random.randint is slow for large pools, and shares the
+global random state with everything else in the process. Instead, the dice
+are dealt from a buffer of faces, which is made by mapping random bytes to
+faces in bulk, and refilled by a background thread before it runs out.
+
+By default, the random bytes come from os.urandom. With a seed, they come
+from a random.Random stream instead, so the same seed deals the same faces.
+In seeded mode (see config.rng_seed), every roll gets a random key of its
+own, which is kept with the roll history (see roll_state). Each phase of the
+roll is dealt from a stream seeded with both the source's seed and the key,
+so any roll and its rerolls can be replayed exactly, e.g. to settle a
+dispute. The key is shown to the users in the buttons' custom ids, but as
+the seed stays on the server, it doesn't reveal the dice of the rerolls.
+
+Usage: python -m bot.rng --seed SEED --key KEY --dice N [--actions reroll all_in ...]
+"""
+import argparse
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.config import config
+from bot.lazy import Lazy, is_created, resolve
+
+# The number of faces of an Octane die
+NUM_FACES = 6
+
+# The number of faces to keep buffered, refilled once half of them are dealt
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+# Maps each random byte to a face (0 to 5). As 256 isn't a multiple of 6, the
+# top bytes are dropped, so that every face is equally likely.
+FACE_TABLE = bytes(byte % NUM_FACES for byte in range(256))
+DROPPED_BYTES = bytes(range(256 - 256 % NUM_FACES, 256))
+
+
+def generate_faces(random_bytes, count: int) -> bytes:
+    """Returns at least count faces (0 to 5), made from the bytes of the given random_bytes(n) function."""
+    faces = b''
+    while len(faces) < count:
+        missing = count - len(faces)
+        # Draw a few extra bytes, as some of them are dropped.
+        faces += random_bytes(missing + missing // 32 + 8).translate(FACE_TABLE, DROPPED_BYTES)
+    return faces
+
+
+class DiceSource:
+    """Deals dice faces from a buffer, which is filled upfront and refilled by a background thread.
+
+    Attributes:
+        buffer_size: The number of faces to keep buffered, or 0 to generate them as they are dealt.
+        seeded: Whether the faces come from a seeded stream.
+    """
+    def __init__(self, seed: int | str | None = None, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """Initializes the dice source.
+
+        Args:
+            seed: The seed of the stream to deal the faces from, or None to use the OS's randomness.
+            buffer_size: The number of faces to keep buffered.
+        """
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._executor = None
+        self.seed(seed)
+
+    def seed(self, seed: int | str | None):
+        """Deals the faces from a stream with the given seed from now on, like random.seed.
+
+        With None, the faces come from the OS's randomness again.
+        """
+        with self._lock:
+            self.seeded = seed is not None
+            self._seed = seed
+            self._random_bytes = random.Random(seed).randbytes if self.seeded else os.urandom
+            self._buffer = generate_faces(self._random_bytes, self.buffer_size) if self.buffer_size else b''
+            self._position = 0
+            # A refill of the previous stream that may still be running is dropped.
+            self._refill = None
+
+    def new_key(self) -> int | None:
+        """Returns the key for a new roll in seeded mode, or None if the source isn't seeded.
+
+        The keys come from the OS's randomness, so a restarted bot doesn't deal the same rolls again.
+        """
+        return int.from_bytes(os.urandom(4), 'little') if self.seeded else None
+
+    def roll_source(self, key: int | None, phase_value: int) -> 'DiceSource':
+        """Returns the source of the dice of the roll with the given key in the given roll phase.
+
+        Each phase has a stream of its own, so rerolls can be replayed without
+        replaying the roll. Rolls without a key, or any rolls if this source
+        isn't seeded, are dealt from this source.
+        """
+        if key is None or not self.seeded:
+            return self
+        return DiceSource(f'{self._seed}:{key}:{phase_value}', buffer_size=0)
+
+    def faces(self, num_dice: int) -> bytes:
+        """Deals the faces (0 to 5) of the given number of dice."""
+        with self._lock:
+            if len(self._buffer) - self._position < num_dice:
+                self._take_refill(num_dice)
+            faces = self._buffer[self._position:self._position + num_dice]
+            self._position += num_dice
+            if (self.buffer_size and self._refill is None and
+                    len(self._buffer) - self._position < self.buffer_size // 2):
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dice-refill')
+                self._refill = self._executor.submit(generate_faces, self._random_bytes, self.buffer_size)
+        return faces
+
+    def counts(self, num_dice: int) -> list[int]:
+        """Rolls the given number of dice and returns the number of dice showing each face."""
+        faces = self.faces(num_dice)
+        return [faces.count(face) for face in range(NUM_FACES)]
+
+    def roll_die(self) -> int:
+        """Rolls a single d6."""
+        return self.faces(1)[0] + 1
+
+    def _take_refill(self, num_dice: int):
+        """Appends the refilled faces to the rest of the buffer, so that it holds at least num_dice faces."""
+        buffer = self._buffer[self._position:]
+        if self._refill is not None:
+            buffer += self._refill.result()
+            self._refill = None
+        if len(buffer) < num_dice:
+            # Large rolls, or a refill that didn't finish in time
+            buffer += generate_faces(self._random_bytes, max(num_dice - len(buffer), self.buffer_size))
+        self._buffer = buffer
+        self._position = 0
+
+    def _after_fork(self):
+        # The refill thread doesn't exist in the child, and the child must not deal the parent's faces.
+        self._lock = threading.Lock()
+        self._executor = None
+        self._refill = None
+        if not self.seeded:
+            self._buffer = b''
+            self._position = 0
+
+
+dice_source = Lazy(lambda: DiceSource(config.rng_seed))
+
+
+def _after_fork():
+    if is_created(dice_source):
+        resolve(dice_source)._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def main(argv: list[str] | None = None):
+    # Run with -m, this module is __main__, so the Roller's dice source is imported from bot.rng.
+    from bot.rng import dice_source
+    from bot.roll import Roller
+
+    parser = argparse.ArgumentParser(description='Replay a seeded roll.')
+    parser.add_argument('--seed', type=int, required=True, help='The seed of the bot (RNG_SEED)')
+    parser.add_argument('--key', type=int, required=True, help='The key of the roll')
+    parser.add_argument('--dice', type=int, required=True, help='The number of dice rolled')
+    parser.add_argument('--actions', nargs='*', default=[], choices=['reroll', 'free_reroll', 'all_in'],
+                        help='The rerolls performed, in order')
+    args = parser.parse_args(argv)
+
+    dice_source.seed(args.seed)
+    roller = Roller(num_dice=args.dice, key=args.key)
+    roller.roll()
+    for action in args.actions:
+        getattr(roller, action)()
+    # The number of dice showing each face, per roll phase
+    for phase, roll in roller.roll_history.rolls.items():
+        print(f'{phase.name.lower()}={list(roll.counts)}{" (failed)" if roll.failed_reroll else ""}')
+
+
+if __name__ == '__main__':
+    main()
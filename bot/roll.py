@@ -1,7 +1,8 @@
 """This module handles the actual dice rolling logic."""
-import random
 from enum import Enum
 
+from bot.rng import NUM_FACES, dice_source
+
 # Enum that defines the different phases of a roll
 class RollPhase(Enum):
     INITIAL = 1
@@ -10,10 +11,24 @@ class RollPhase(Enum):
     ALL_IN = 4
 
 
+def match_score(num_matches: int) -> int:
+    """Returns the score of a single success with the given number of matches.
+
+    Each additional match triples the score, so 3 lower successes are equivalent
+    to 1 higher success. Dice without a match don't count at all.
+    """
+    return 3 ** (num_matches - 1) if num_matches > 1 else 0
+
+
 class Roll:
     """Encapsulates a single Octane dice roll.
-    
+
+    Internally, a roll is represented by the number of dice showing each face,
+    so that rolling, comparing, and rerolling cost the same regardless of the
+    number of dice. The sorted dice and the match groups are derived lazily.
+
     Attributes:
+        counts: The number of dice showing each face, indexed by face - 1.
         dice: The sorted dice roll results.
         num_dice: The number of dice rolled.
         matches: A dictionary that maps the number of matches to the dice that
@@ -21,77 +36,116 @@ class Roll:
         failed_reroll: A boolean indicating if the roll was a failed reroll.
         failed_matches: A dictionary structured the same as matches, but only
             containing the dice that were lost due to a failed reroll.
+        score: The score used to compare rolls (see is_better_than).
     """
+    __slots__ = ('counts', 'num_dice', 'failed_reroll', '_lost_faces', '_dice', '_matches', '_failed_matches', '_score')
+
     def __init__(self, dice: list = []):
         """Initializes the Roll object with the given parameters.
 
         Args:
-            num_dice: The number of dice rolled.
             dice: The dice roll results.
         """
-        self.dice = sorted(dice)
-        self.num_dice = len(dice)
-        self.matches = self._group_matches()
+        counts = [0] * NUM_FACES
+        for die in dice:
+            counts[die - 1] += 1
+        self._init_counts(counts)
+
+    @classmethod
+    def from_counts(cls, counts: list[int]) -> 'Roll':
+        """Creates a roll from the number of dice showing each face."""
+        if len(counts) != NUM_FACES:
+            raise ValueError(f'Expected {NUM_FACES} face counts, got {len(counts)}.')
+        roll = cls.__new__(cls)
+        roll._init_counts(list(counts))
+        return roll
+
+    def _init_counts(self, counts: list[int]):
+        self.counts = tuple(counts)
+        self.num_dice = sum(counts)
         self.failed_reroll = False
-        self.failed_matches = {}
+        self._lost_faces = frozenset()
+        self._invalidate()
+
+    @property
+    def dice(self) -> list[int]:
+        if self._dice is None:
+            self._dice = [face for face, count in enumerate(self.counts, start=1) for _ in range(count)]
+        return self._dice
+
+    @property
+    def matches(self) -> dict[int, list[int]]:
+        if self._matches is None:
+            self._matches = self._group_matches()
+        return self._matches
+
+    @property
+    def failed_matches(self) -> dict[int, list[int]]:
+        if self._failed_matches is None:
+            self._failed_matches = self._group_matches(lost=True)
+        return self._failed_matches
+
+    @property
+    def score(self) -> int:
+        if self._score is None:
+            self._score = sum(
+                match_score(count) for face, count in enumerate(self.counts, start=1)
+                if face not in self._lost_faces)
+        return self._score
+
+    def matched_counts(self) -> list[int]:
+        """Returns the face counts of the dice that matched at least one other die."""
+        return [count if count > 1 else 0 for count in self.counts]
 
     def matched_dice(self):
         """Returns the dice that matched at least one other die."""
-        # Determine matched dice by excluding non_matched dice (i.e. matches[1]) from the full dice list
-        non_matches = self.matches.get(1, [])
-        return [die for die in self.dice if die not in non_matches]
-    
+        return [face for face, count in enumerate(self.counts, start=1) if count > 1 for _ in range(count)]
+
     def non_matched_dice(self):
         """Returns the dice that did not match any other die."""
-        return self.matches.get(1, [])
+        return [face for face, count in enumerate(self.counts, start=1) if count == 1]
 
     def mark_as_failed_reroll(self):
         """Marks the roll as a failed reroll.
-        
+
         This means that the player attempted to reroll, but the result was not
         better than the original roll. In this case, we need to remove one of
         the successes from the original roll.
         """
         self.failed_reroll = True
 
-        # Move the lowest success from matches to failed_matches
+        # Move the lowest success (using the lowest face for ties) from matches to failed_matches
         lowest_match = min(key for key in self.matches.keys() if key > 1)
-        lost_dice = self.matches[lowest_match].pop(0)
-        self.failed_matches = {lowest_match: [lost_dice]}
-
-        # Remove the key if there are no more dice with that number of matches
-        if not self.matches[lowest_match]:
-            del self.matches[lowest_match]
+        lost_die = self.matches[lowest_match][0]
+        self._lost_faces = frozenset([lost_die])
+        self._invalidate()
 
     def mark_as_failed_all_in(self):
         """Marks the roll as a failed attempt to go all in.
-        
+
         This means that the player attempted to go all in, but the result was not
         better than the previous roll. In this case, we need to remove all of the
         successes from the original roll.
         """
         self.failed_reroll = True
-        non_matched_dice = self.matches.pop(1, None)
-        self.failed_matches = self.matches
-        self.matches = {1: non_matched_dice}
+        self._lost_faces = frozenset(face for face, count in enumerate(self.counts, start=1) if count > 1)
+        self._invalidate()
 
     def is_better_than(self, other_roll: 'Roll'):
         """Compares this roll to another roll and returns true if it is better.
-        
+
         A roll is considered better if it either has more successes than the other
         roll, or if it has higher magnitude successes. Note that 3 lower successes
         are equivalent to 1 higher success, and vice versa.
         """
-        # Iterate over both sets of matches. For each basic success (matches[2]), count it as 1.
-        # For each critical success (matches[3]), count it as 3. And so on (matches[4] = 9,
-        # matches[5] = 27, etc.). Then compare the total scores.
-        score = sum((3 ** (num_matches - 1)) * len(dice) for num_matches, dice in self.matches.items() if num_matches > 1)
-        other_score = sum((3 ** (num_matches - 1)) * len(dice) for num_matches, dice in other_roll.matches.items() if num_matches > 1)
-        return score > other_score
-
-    def _group_matches(self):
+        # Each success counts as 3 ** (num_matches - 1), so a critical success
+        # counts three times as much as a basic success, and so on. The scores
+        # are cached, so repeated comparisons don't recompute them.
+        return self.score > other_roll.score
+
+    def _group_matches(self, lost: bool = False):
         """Groups the dice by the number of matches.
-        
+
         Octane is based on different numbers of matches, so we keep track of
         these using a dictionary. The keys are the number of matches
         (e.g. 1, 2, 3, 4, 5, 6), and the values are lists of the dice that
@@ -99,18 +153,24 @@ class Roll:
         match any other dice.
         E.g. {1: [1, 2, 3], 2: [4, 5], 3: [6]} represents a roll that had 3 6s,
         2 4s and 5s, and single 1, 2, and 3.
+
+        Args:
+            lost: Whether to group the dice lost due to a failed reroll, rather
+                than the remaining dice.
         """
-        counts = {}
-        for die in self.dice:
-            counts[die] = counts.get(die, 0) + 1
-        
         matches = {}
-        for die, count in counts.items():
-            if count not in matches:
-                matches[count] = []
-            matches[count].append(die)
+        for face, count in enumerate(self.counts, start=1):
+            if count and (face in self._lost_faces) == lost:
+                matches.setdefault(count, []).append(face)
         return matches
-    
+
+    def _invalidate(self):
+        """Resets the lazily derived views after the roll changed."""
+        self._dice = None
+        self._matches = None
+        self._failed_matches = None
+        self._score = None
+
     def __str__(self):
         return f'Roll(dice={self.dice}, num_dice={self.num_dice}, matches={self.matches})'
 
@@ -123,11 +183,14 @@ class RollHistory:
     Attributes:
         num_dice: The number of dice rolled.
         rolls: A dictionary that maps the phase of the roll to the Roll object.
+        key: The key of a seeded roll, from which the streams of its dice are seeded (see
+            bot.rng), or None if it wasn't seeded.
     """
     def __init__(self):
         """Initializes the RollHistory object."""
         self.num_dice = None
         self.rolls = {}
+        self.key = None
 
     def add_roll(self, phase: RollPhase, roll: Roll):
         """Adds a roll to the history."""
@@ -187,7 +250,7 @@ class RollHistory:
 
     def _has_at_least_one_success(self):
         """Returns true if the roll includes at least one basic success."""
-        return any(num_matches > 1 for num_matches in self.get_final_roll().matches)
+        return self.get_final_roll().score > 0
     
     def __str__(self):
         return f'RollHistory(num_dice={self.num_dice}, rolls={self.rolls})'
@@ -200,14 +263,17 @@ class Roller:
         num_dice: The number of dice to roll.
         roll_history: The roll history.
     """
-    def __init__(self, num_dice: int = 0, roll_history: RollHistory = None):
+    def __init__(self, num_dice: int = 0, roll_history: RollHistory = None, key: int | None = None):
         """Initializes the Octane roller.
         
-        Only one of the following parameters should be provided.
+        Only one of num_dice and roll_history should be provided.
 
         Args:
             num_dice: The number of dice to roll.
-            roll_history: The roll history to continue from.
+            roll_history: The roll history to continue from. Its rerolls are
+                dealt from the streams of its key, if it has one.
+            key: The key of a new seeded roll (see DiceSource.new_key), or
+                None to deal it and its rerolls from the shared dice source.
         """
         if roll_history:
             self.num_dice = roll_history.num_dice
@@ -215,19 +281,22 @@ class Roller:
         elif num_dice > 0:
             self.num_dice = num_dice
             self.roll_history = RollHistory()
+            self.roll_history.key = key
         else:
             raise ValueError('Either num_dice or roll_history must be provided.')
+        self._source = dice_source
 
     def roll(self):
         """Roll a number of Octane dice."""
-        roll = Roll(self.roll_dice(self.num_dice))
+        self._deal_from(RollPhase.INITIAL)
+        roll = Roll.from_counts(self.roll_counts(self.num_dice))
         self.roll_history.add_roll(RollPhase.INITIAL, roll)
 
     def reroll(self):
         initial_roll = self.roll_history.get_roll(RollPhase.INITIAL)
         if initial_roll:
-            rerolled_dice = self.roll_dice(len(initial_roll.matches[1]))
-            combined_roll = Roll(initial_roll.matched_dice() + rerolled_dice)
+            self._deal_from(RollPhase.REROLL)
+            combined_roll = self._reroll_non_matched(initial_roll)
 
             # Check if the reroll is better than the initial roll.
             # If not, we need to remove one of the previous successes.
@@ -241,8 +310,8 @@ class Roller:
     def free_reroll(self):
         initial_roll = self.roll_history.get_roll(RollPhase.INITIAL)
         if initial_roll:
-            rerolled_dice = self.roll_dice(len(initial_roll.matches[1]))
-            combined_roll = Roll(initial_roll.matched_dice() + rerolled_dice)
+            self._deal_from(RollPhase.FREE_REROLL)
+            combined_roll = self._reroll_non_matched(initial_roll)
             self.roll_history.add_roll(RollPhase.FREE_REROLL, combined_roll)
             # NB: We don't mark free rerolls as failed, as no successes are lost.
         else:
@@ -251,8 +320,8 @@ class Roller:
     def all_in(self):
         last_roll = self.roll_history.get_final_roll()
         if last_roll:
-            rerolled_dice = self.roll_dice(len(last_roll.matches[1]))
-            combined_roll = Roll(last_roll.matched_dice() + rerolled_dice)
+            self._deal_from(RollPhase.ALL_IN)
+            combined_roll = self._reroll_non_matched(last_roll)
 
             # Check if the reroll is better than the initial roll.
             # If not, we need to remove ALL of the previous successes.
@@ -265,4 +334,17 @@ class Roller:
 
     def roll_dice(self, num_dice: int):
         """Rolls a number of dice and returns the sorted result."""
-        return sorted([random.randint(1, 6) for _ in range(num_dice)])
+        return sorted(face + 1 for face in self._source.faces(num_dice))
+
+    def roll_counts(self, num_dice: int) -> list[int]:
+        """Rolls a number of dice and returns the number of dice showing each face."""
+        return self._source.counts(num_dice)
+
+    def _deal_from(self, phase: RollPhase):
+        """Deals the dice of the phase from the roll's seeded stream, or the shared dice source if it has no key."""
+        self._source = dice_source.roll_source(self.roll_history.key, phase.value)
+
+    def _reroll_non_matched(self, roll: Roll) -> Roll:
+        """Rerolls the non-matched dice of the roll, keeping the matched ones."""
+        rerolled_counts = self.roll_counts(len(roll.non_matched_dice()))
+        return Roll.from_counts([kept + rerolled for kept, rerolled in zip(roll.matched_counts(), rerolled_counts)])
@@ -0,0 +1,99 @@
+"""Compact binary encoding of a roll history.
+
+The encoded state is small enough to be embedded in a button's custom id, which
+lets the reroll buttons restore the roll history without parsing the message.
+
+Layout (before base64 encoding):
+
+    byte 0:     bits 0-3 flag which roll phases are present,
+                bits 4-7 flag which of those rolls are failed rerolls
+    per phase:  six unsigned LEB128 varints with the number of dice showing
+                each face (1 to 6), in roll phase order
+    optional:   KEY_TAG, followed by an unsigned LEB128 varint with the key
+                of a seeded roll (see bot.rng). The key is visible to the
+                users, but the seed its dice are dealt from isn't.
+"""
+import base64
+from bot.roll import NUM_FACES, RollPhase, Roll, RollHistory
+
+ROLL_PHASES = [RollPhase.INITIAL, RollPhase.REROLL, RollPhase.FREE_REROLL, RollPhase.ALL_IN]
+# Marks the key at the end of the state
+KEY_TAG = 0xff
+
+
+def encode_roll_history(roll_history: RollHistory) -> str:
+    """Encodes the roll history as a URL-safe base64 string without padding."""
+    header = 0
+    body = bytearray()
+    for index, roll_phase in enumerate(ROLL_PHASES):
+        roll = roll_history.get_roll(roll_phase)
+        if roll is None:
+            continue
+        header |= 1 << index
+        if roll.failed_reroll:
+            header |= 1 << (index + 4)
+        for count in roll.counts:
+            _write_varint(body, count)
+    if roll_history.key is not None:
+        body.append(KEY_TAG)
+        _write_varint(body, roll_history.key)
+    data = bytes([header]) + body
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_roll_history(state: str) -> RollHistory:
+    """Decodes a roll history previously encoded with encode_roll_history.
+
+    Raises:
+        ValueError: If the state is not a valid encoded roll history.
+    """
+    try:
+        data = base64.urlsafe_b64decode(state + '=' * (-len(state) % 4))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid roll state: {state!r}') from e
+    if not data or not data[0] & 0x1:
+        raise ValueError(f'Invalid roll state: {state!r}')
+
+    header = data[0]
+    position = 1
+    roll_history = RollHistory()
+    for index, roll_phase in enumerate(ROLL_PHASES):
+        if not header & (1 << index):
+            continue
+        counts = []
+        for _ in range(NUM_FACES):
+            count, position = _read_varint(data, position)
+            counts.append(count)
+        roll = Roll.from_counts(counts)
+        if header & (1 << (index + 4)):
+            if roll_phase == RollPhase.ALL_IN:
+                roll.mark_as_failed_all_in()
+            else:
+                roll.mark_as_failed_reroll()
+        roll_history.add_roll(roll_phase, roll)
+    if position < len(data) and data[position] == KEY_TAG:
+        roll_history.key, position = _read_varint(data, position + 1)
+    if position != len(data):
+        raise ValueError(f'Invalid roll state: {state!r}')
+    return roll_history
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError('Truncated roll state')
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
@@ -0,0 +1,165 @@
+"""Monte Carlo simulation of complete Octane rolls, including rerolls.
+
+Each trial is a complete roll sequence (initial roll, then a reroll or free
+reroll, then optionally going all in), following the same rules as
+RollHistory and Roll. Rather than looping over trials in Python, all trials
+of a batch are simulated at once as NumPy arrays of face counts (one row per
+trial, one column per face).
+"""
+from enum import Enum
+
+import numpy as np
+
+from bot.roll import NUM_FACES, match_score
+
+# The largest pool size we simulate. This keeps the scores within int64.
+MAX_SIMULATE_DICE = 40
+# The largest number of trials per simulation
+MAX_SIMULATE_TRIALS = 5_000_000
+# The number of trials simulated at once, which bounds the memory usage
+BATCH_SIZE = 200_000
+
+FACE_PROBABILITIES = [1 / NUM_FACES] * NUM_FACES
+# The score of a success by number of matches (see Roll.is_better_than)
+MATCH_SCORES = np.array([match_score(num_matches) for num_matches in range(MAX_SIMULATE_DICE + 1)], dtype=np.int64)
+
+
+class Strategy(Enum):
+    """The rerolls a player performs whenever the rules allow them."""
+    KEEP = 'keep'
+    REROLL = 'reroll'
+    FREE_REROLL = 'free_reroll'
+    REROLL_ALL_IN = 'reroll_all_in'
+    FREE_REROLL_ALL_IN = 'free_reroll_all_in'
+
+    @property
+    def free(self) -> bool:
+        return self in [Strategy.FREE_REROLL, Strategy.FREE_REROLL_ALL_IN]
+
+    @property
+    def all_in(self) -> bool:
+        return self in [Strategy.REROLL_ALL_IN, Strategy.FREE_REROLL_ALL_IN]
+
+
+class SimulationResult:
+    """Aggregated results of a simulation.
+
+    Attributes:
+        num_dice: The number of dice rolled.
+        strategy: The simulated strategy.
+        trials: The number of simulated rolls.
+        total_score: The sum of the final scores of all trials.
+        successes: The number of trials that ended with at least one success.
+        improved: The number of trials that ended with a better score than the initial roll.
+        worsened: The number of trials that ended with a worse score than the initial roll.
+        rerolls: The number of trials that performed a reroll or free reroll.
+        failed_rerolls: The number of failed rerolls.
+        all_ins: The number of trials that went all in.
+        failed_all_ins: The number of failed attempts to go all in.
+    """
+    def __init__(self, num_dice: int, strategy: Strategy):
+        self.num_dice = num_dice
+        self.strategy = strategy
+        self.trials = 0
+        self.total_score = 0
+        self.successes = 0
+        self.improved = 0
+        self.worsened = 0
+        self.rerolls = 0
+        self.failed_rerolls = 0
+        self.all_ins = 0
+        self.failed_all_ins = 0
+
+    def mean_score(self) -> float:
+        return self.total_score / self.trials
+
+    def rate(self, count: int, total: int | None = None) -> float:
+        """Returns count as a fraction of total, which defaults to the number of trials."""
+        total = self.trials if total is None else total
+        return count / total if total else 0.0
+
+
+def simulate(num_dice: int, strategy: Strategy, trials: int, seed: int | None = None) -> SimulationResult:
+    """Simulates the given number of rolls, following the strategy whenever the rules allow it.
+
+    Args:
+        num_dice: The number of dice to roll.
+        strategy: The rerolls to perform.
+        trials: The number of rolls to simulate.
+        seed: An optional seed for reproducible results.
+    """
+    if not 0 < num_dice <= MAX_SIMULATE_DICE:
+        raise ValueError(f'The number of dice must be between 1 and {MAX_SIMULATE_DICE}.')
+    if not 0 < trials <= MAX_SIMULATE_TRIALS:
+        raise ValueError(f'The number of trials must be between 1 and {MAX_SIMULATE_TRIALS}.')
+    rng = np.random.default_rng(seed)
+    result = SimulationResult(num_dice, strategy)
+    for start in range(0, trials, BATCH_SIZE):
+        _simulate_batch(rng, result, min(BATCH_SIZE, trials - start))
+    return result
+
+
+def _simulate_batch(rng: np.random.Generator, result: SimulationResult, trials: int):
+    strategy = result.strategy
+    initial = rng.multinomial(result.num_dice, FACE_PROBABILITIES, size=trials)
+    initial_score = scores(initial)
+    final_score = initial_score
+
+    if strategy != Strategy.KEEP:
+        # RollHistory.can_reroll / can_free_reroll
+        can_reroll = non_matched(initial) > 0
+        if not strategy.free:
+            can_reroll &= initial_score > 0
+        rerolled = reroll_non_matched(rng, initial)
+        rerolled_score = scores(rerolled)
+        if strategy.free:
+            # Free rerolls never lose any successes.
+            failed = np.zeros(trials, dtype=bool)
+            reroll_score = rerolled_score
+        else:
+            failed = rerolled_score <= initial_score
+            reroll_score = np.where(failed, rerolled_score - lowest_success_scores(rerolled), rerolled_score)
+        failed &= can_reroll
+        final_score = np.where(can_reroll, reroll_score, initial_score)
+        result.rerolls += int(can_reroll.sum())
+        result.failed_rerolls += int(failed.sum())
+
+        if strategy.all_in:
+            # RollHistory.can_go_all_in
+            can_go_all_in = can_reroll & ~failed & (rerolled_score > initial_score) & (non_matched(rerolled) > 0)
+            all_in_score = scores(reroll_non_matched(rng, rerolled))
+            # Roll.mark_as_failed_all_in loses all successes.
+            failed_all_in = can_go_all_in & (all_in_score <= rerolled_score)
+            final_score = np.where(can_go_all_in, np.where(failed_all_in, 0, all_in_score), final_score)
+            result.all_ins += int(can_go_all_in.sum())
+            result.failed_all_ins += int(failed_all_in.sum())
+
+    result.trials += trials
+    result.total_score += int(final_score.sum())
+    result.successes += int((final_score > 0).sum())
+    result.improved += int((final_score > initial_score).sum())
+    result.worsened += int((final_score < initial_score).sum())
+
+
+def scores(counts: np.ndarray) -> np.ndarray:
+    """Returns the score of each roll (see Roll.is_better_than)."""
+    return MATCH_SCORES[counts].sum(axis=1)
+
+
+def non_matched(counts: np.ndarray) -> np.ndarray:
+    """Returns the number of non-matched dice of each roll."""
+    return (counts == 1).sum(axis=1)
+
+
+def lowest_success_scores(counts: np.ndarray) -> np.ndarray:
+    """Returns the score of the lowest success of each roll, which a failed reroll loses.
+
+    Rolls without any success have a score of 0.
+    """
+    successes = np.where(counts > 1, counts, MAX_SIMULATE_DICE + 1).min(axis=1)
+    return np.where(successes <= MAX_SIMULATE_DICE, MATCH_SCORES[np.minimum(successes, MAX_SIMULATE_DICE)], 0)
+
+
+def reroll_non_matched(rng: np.random.Generator, counts: np.ndarray) -> np.ndarray:
+    """Rerolls the non-matched dice of each roll, keeping the matched ones."""
+    return np.where(counts > 1, counts, 0) + rng.multinomial(non_matched(counts), FACE_PROBABILITIES)
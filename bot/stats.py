@@ -0,0 +1,282 @@
+"""Running roll statistics per user, channel, and guild.
+
+Each finished roll (or reroll) updates the aggregates of its user, channel,
+and guild in constant time, so /stats is answered from memory, no matter how
+many rolls a guild made. The aggregates are snapshotted to a JSON file
+periodically and on shutdown, and loaded again on startup.
+
+Luck compares the number of successes of the initial rolls with the number
+expected for their pool sizes. Both the expected number of successes and the
+chance of at least one success have closed forms, so they are cheap to
+compute for any number of dice (unlike the full odds, see bot.odds).
+
+Each process keeps its own statistics. In a shard cluster, guilds are split
+between the workers, so the statistics of guilds and channels are complete,
+while a user's are split across the workers their guilds are on. HTTP
+replicas each keep the statistics of the interactions they handled.
+"""
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+
+from bot.config import config
+from bot.lazy import Lazy
+from bot.roll import NUM_FACES, RollHistory, RollPhase
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# The best success tiers counted in the histogram: no success, then 2 (Basic) to 6 or more (Jackpot) matches
+MAX_TIER = 6
+# The reroll phases whose outcomes are counted, in the order of RollStats.attempts
+REROLL_PHASES = (RollPhase.REROLL, RollPhase.FREE_REROLL, RollPhase.ALL_IN)
+# The scopes statistics are kept for, as in StatsStore.get
+SCOPES = ('user', 'channel', 'guild')
+# The number of changed entries copied for a snapshot before yielding to the event loop
+SNAPSHOT_BATCH_SIZE = 10_000
+
+
+@functools.lru_cache(maxsize=1024)
+def expected_successes(num_dice: int) -> float:
+    """Returns the expected number of successes (faces showing at least twice) of a roll."""
+    # For each face, the chance of showing at least twice is 1 - P(0) - P(1) of a binomial distribution.
+    p = 1 / NUM_FACES
+    return NUM_FACES * (1 - (1 - p) ** num_dice - num_dice * p * (1 - p) ** (num_dice - 1))
+
+
+@functools.lru_cache(maxsize=1024)
+def success_probability(num_dice: int) -> float:
+    """Returns the probability of a roll having at least one success."""
+    if num_dice > NUM_FACES:
+        return 1.0
+    # The probability that all dice show different faces
+    return 1 - math.perm(NUM_FACES, num_dice) / NUM_FACES ** num_dice
+
+
+def best_tier(counts) -> int:
+    """Returns the number of matches of the best success of a roll (capped at MAX_TIER), or 0 if none."""
+    best = max(counts)
+    return min(best, MAX_TIER) if best > 1 else 0
+
+
+class RollStats:
+    """The running aggregates of a user's, channel's, or guild's rolls.
+
+    Attributes:
+        rolls: The number of initial rolls.
+        dice: The total number of dice of the initial rolls.
+        tiers: The number of initial rolls per best success tier, indexed by the number of matches
+            (0 for no success, 1 is unused).
+        successes: The total number of successes of the initial rolls.
+        expected_successes: The total number of successes expected for the initial rolls' pool sizes.
+        successful_rolls: The number of initial rolls with at least one success.
+        expected_successful_rolls: The number of initial rolls expected to have at least one success.
+        attempts: The number of rerolls, free rerolls, and all ins.
+        improved: The number of rerolls, free rerolls, and all ins that improved the result.
+    """
+    __slots__ = ('rolls', 'dice', 'tiers', 'successes', 'expected_successes', 'successful_rolls',
+                 'expected_successful_rolls', 'attempts', 'improved')
+
+    def __init__(self):
+        self.rolls = 0
+        self.dice = 0
+        self.tiers = [0] * (MAX_TIER + 1)
+        self.successes = 0
+        self.expected_successes = 0.0
+        self.successful_rolls = 0
+        self.expected_successful_rolls = 0.0
+        self.attempts = [0] * len(REROLL_PHASES)
+        self.improved = [0] * len(REROLL_PHASES)
+
+    def add_roll(self, num_dice: int, tier: int, successes: int):
+        """Adds an initial roll, given its best success tier and number of successes."""
+        self.rolls += 1
+        self.dice += num_dice
+        self.tiers[tier] += 1
+        self.successes += successes
+        self.expected_successes += expected_successes(num_dice)
+        self.successful_rolls += successes > 0
+        self.expected_successful_rolls += success_probability(num_dice)
+
+    def add_reroll(self, phase: RollPhase, improved: bool):
+        """Adds a reroll, free reroll, or all in, and whether it improved the result."""
+        index = REROLL_PHASES.index(phase)
+        self.attempts[index] += 1
+        self.improved[index] += improved
+
+    def average_dice(self) -> float:
+        return self.dice / self.rolls if self.rolls else 0.0
+
+    def luck(self) -> float:
+        """Returns the relative difference between the number of successes and the expected number.
+
+        E.g. 0.1 means 10% more successes than expected.
+        """
+        if not self.expected_successes:
+            return 0.0
+        return self.successes / self.expected_successes - 1
+
+    def to_list(self) -> list:
+        """Returns the aggregates as a list of plain values, which don't change with later rolls."""
+        return [self.rolls, self.dice, list(self.tiers), self.successes, self.expected_successes,
+                self.successful_rolls, self.expected_successful_rolls, list(self.attempts), list(self.improved)]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'RollStats':
+        stats = cls()
+        (stats.rolls, stats.dice, stats.tiers, stats.successes, stats.expected_successes, stats.successful_rolls,
+         stats.expected_successful_rolls, stats.attempts, stats.improved) = values
+        return stats
+
+
+def improved_result(roll_history: RollHistory, phase: RollPhase) -> bool:
+    """Returns true if the reroll of the given phase improved the result of the previous roll."""
+    roll = roll_history.get_roll(phase)
+    if phase == RollPhase.FREE_REROLL:
+        # Free rerolls are never marked as failed, as no successes are lost.
+        return roll.is_better_than(roll_history.get_roll(RollPhase.INITIAL))
+    return not roll.failed_reroll
+
+
+class StatsStore:
+    """The roll statistics of every user, channel, and guild, kept in memory.
+
+    The statistics are keyed by scope and ID, e.g. ('user', 1234). Rolls are
+    always counted, but snapshots are only loaded and written once started,
+    so tests and tools that roll dice don't read or write any files.
+
+    Each snapshot only copies the entries that changed since the previous
+    one, on top of the copies it kept, so the cost on the event loop doesn't
+    grow with the number of users, channels, and guilds that ever rolled.
+
+    Attributes:
+        path: The path of the snapshot file.
+        snapshot_interval: The number of seconds between snapshots.
+    """
+    def __init__(self, path: str, snapshot_interval: float = 300):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self._stats = {}
+        # The keys whose entries changed since the last snapshot
+        self._changed = set()
+        # The entries as of the last snapshot, as plain lists by key (e.g. 'user:1234')
+        self._snapshot = {}
+        self._started = False
+        self._snapshot_task = None
+        self._snapshot_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def get(self, scope: str, id: int) -> RollStats:
+        """Returns the statistics of the given user, channel, or guild, which are empty if it never rolled."""
+        return self._stats.get((scope, id)) or RollStats()
+
+    def record(self, roll_history: RollHistory, *, guild_id: int | None, channel_id: int | None, user_id: int):
+        """Adds the latest roll of the roll history to the statistics of its user, channel, and guild."""
+        phase = RollPhase(max(phase.value for phase in roll_history.rolls))
+        if phase == RollPhase.INITIAL:
+            roll = roll_history.get_roll(phase)
+            num_dice, tier = roll.num_dice, best_tier(roll.counts)
+            successes = sum(1 for count in roll.counts if count > 1)
+            update = lambda stats: stats.add_roll(num_dice, tier, successes)
+        else:
+            improved = improved_result(roll_history, phase)
+            update = lambda stats: stats.add_reroll(phase, improved)
+        for key in zip(SCOPES, (user_id, channel_id, guild_id)):
+            if key[1] is None:
+                continue
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RollStats()
+            update(stats)
+            self._changed.add(key)
+
+    async def start(self):
+        """Loads the last snapshot, and starts taking snapshots periodically."""
+        self._started = True
+        loaded = await asyncio.to_thread(self._load)
+        # Rolls recorded before the snapshot was loaded are added on top.
+        for key, stats in self._stats.items():
+            loaded[key] = _merge(loaded[key], stats) if key in loaded else stats
+        self._stats = loaded
+        self._changed.update(loaded)
+        self._snapshot_task = asyncio.create_task(self._snapshot_periodically())
+
+    async def snapshot(self):
+        """Writes the statistics to the snapshot file."""
+        async with self._snapshot_lock:
+            # The changed entries are copied to plain lists on the event loop, so each of them is
+            # consistent while rolls keep updating them. Entries changed again after they were copied
+            # are copied by the next snapshot. Only the JSON encoding and writing happen in a thread.
+            changed, self._changed = self._changed, set()
+            for count, (scope, id) in enumerate(changed, start=1):
+                self._snapshot[f'{scope}:{id}'] = self._stats[(scope, id)].to_list()
+                if not count % SNAPSHOT_BATCH_SIZE:
+                    await asyncio.sleep(0)
+            await asyncio.to_thread(self._write, self._snapshot)
+
+    async def close(self):
+        """Stops the periodic snapshots and writes a final one."""
+        if not self._started:
+            return
+        self._started = False
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        await self.snapshot()
+
+    async def _snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.snapshot()
+            except Exception as e:
+                logger.error('Failed to snapshot the roll statistics: %s', e)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring the unreadable roll statistics snapshot %s: %s', self.path, e)
+            return {}
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            logger.warning('Ignoring the roll statistics snapshot %s of version %s', self.path, snapshot.get('version'))
+            return {}
+        stats = {}
+        for key, values in snapshot['stats'].items():
+            scope, id = key.split(':')
+            stats[(scope, int(id))] = RollStats.from_list(values)
+        logger.info('Loaded the roll statistics of %d users, channels, and guilds', len(stats))
+        return stats
+
+    def _write(self, stats: dict):
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'stats': stats,
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a partial snapshot.
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def _merge(stats: RollStats, other: RollStats) -> RollStats:
+    merged = RollStats()
+    for name in RollStats.__slots__:
+        value, other_value = getattr(stats, name), getattr(other, name)
+        if isinstance(value, list):
+            setattr(merged, name, [a + b for a, b in zip(value, other_value)])
+        else:
+            setattr(merged, name, value + other_value)
+    return merged
+
+
+roll_stats = Lazy(lambda: StatsStore(config.stats_snapshot, snapshot_interval=config.stats_snapshot_interval))
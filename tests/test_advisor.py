@@ -0,0 +1,123 @@
+import itertools
+from fractions import Fraction
+import pytest
+from bot.advisor import StrategyAdvisor, parse_dice
+from bot.config import config
+from bot.controller import DynamicAdviseButton, RollView
+from bot.dice import DiceSet
+from bot.lazy import resolve
+from bot.message import MessageGenerator
+from bot.roll import NUM_FACES, Roll, RollHistory, RollPhase, Roller
+
+USER_ID = 12345678901234567890
+ACTION_CHECKS = {
+    'reroll': RollHistory.can_reroll,
+    'free_reroll': RollHistory.can_free_reroll,
+    'all_in': RollHistory.can_go_all_in,
+}
+
+class FixedRoller(Roller):
+    """Rerolls the dice to the given faces, rather than random ones."""
+    def __init__(self, roll_history, faces):
+        super().__init__(roll_history=roll_history)
+        self.faces = faces
+
+    def roll_counts(self, num_dice):
+        return [self.faces.count(face) for face in range(1, NUM_FACES + 1)]
+
+def _roll_history(*rolls):
+    roll_history = RollHistory()
+    for phase, roll in rolls:
+        roll_history.add_roll(phase, roll)
+    return roll_history
+
+def _brute_force(roll_history, action):
+    """Returns the expected final score of the action, by playing out every outcome with the Roller."""
+    unmatched = len(roll_history.get_final_roll().non_matched_dice())
+    total = Fraction(0)
+    for faces in itertools.product(range(1, NUM_FACES + 1), repeat=unmatched):
+        rerolled = _roll_history(*roll_history.rolls.items())
+        getattr(FixedRoller(rerolled, list(faces)), action)()
+        total += max([Fraction(rerolled.get_final_roll().score)] + [
+            _brute_force(rerolled, follow_up) for follow_up, is_allowed in ACTION_CHECKS.items()
+            if is_allowed(rerolled)])
+    return total / NUM_FACES ** unmatched
+
+@pytest.mark.parametrize('dice', [[1, 1, 3, 4], [2, 2, 2, 5, 5, 6], [1, 2, 3], [1, 1, 2, 3, 5]])
+def test_expected_scores_match_playing_out_every_outcome(dice):
+    roll_history = _roll_history((RollPhase.INITIAL, Roll(dice)))
+    advice = StrategyAdvisor().advise(roll_history)
+    assert advice.actions[0].action == 'keep'
+    assert advice.actions[0].expected_score == Roll(dice).score
+    assert [action.action for action in advice.actions[1:]] == [
+        action for action, is_allowed in ACTION_CHECKS.items() if is_allowed(roll_history)]
+    for action in advice.actions[1:]:
+        assert action.expected_score == _brute_force(roll_history, action.action), action.action
+
+def test_risk_of_loss():
+    roll_history = _roll_history((RollPhase.INITIAL, Roll([1, 1, 3, 4])))
+    reroll, free_reroll = StrategyAdvisor().advise(roll_history).actions[1:]
+    # The reroll fails if the two dice show two different faces other than 1.
+    assert reroll.loss_probability == Fraction(5 * 4, 36)
+    assert reroll.improve_probability == 1 - reroll.loss_probability
+    assert free_reroll.loss_probability == 0
+
+    roll_history.add_roll(RollPhase.REROLL, Roll([1, 1, 1, 4]))
+    keep, all_in = StrategyAdvisor().advise(roll_history).actions
+    assert all_in.action == 'all_in'
+    # Going all in fails if the die shows anything but 1.
+    assert all_in.loss_probability == Fraction(5, 6)
+    assert all_in.expected_score == Fraction(27, 6)
+
+def test_only_keeping_is_advised_once_no_reroll_is_allowed():
+    failed = Roll([1, 1, 3, 4])
+    failed.mark_as_failed_reroll()
+    roll_history = _roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3])), (RollPhase.REROLL, failed))
+    advice = StrategyAdvisor().advise(roll_history)
+    assert [action.action for action in advice.actions] == ['keep']
+    assert advice.best().expected_score == 0
+
+def test_transposition_table_shares_states_and_evicts_the_least_recently_used():
+    advisor = StrategyAdvisor()
+    first = advisor.advise(_roll_history((RollPhase.INITIAL, Roll([1, 1, 3, 4]))))
+    size = len(advisor)
+    # Another roll with one pair and two non-matched dice is the same state.
+    second = advisor.advise(_roll_history((RollPhase.INITIAL, Roll([6, 6, 2, 5]))))
+    assert len(advisor) == size
+    assert second.actions[1] is first.actions[1]
+
+    advisor = StrategyAdvisor(table_size=1)
+    advisor.advise(_roll_history((RollPhase.INITIAL, Roll([1, 1, 3, 4]))))
+    assert len(advisor) == 1
+
+def test_parse_dice():
+    assert parse_dice('1 1, 3 4\n6').dice == [1, 1, 3, 4, 6]
+    assert parse_dice('11346').dice == [1, 1, 3, 4, 6]
+    for text in ['', '1 2 7', '1 a 3']:
+        with pytest.raises(ValueError):
+            parse_dice(text)
+
+def test_advice_message():
+    advice = StrategyAdvisor().advise(_roll_history((RollPhase.INITIAL, Roll([1, 1, 3, 4]))))
+    message = MessageGenerator().generate_advice_message(advice)
+    assert '**Advice for a roll scoring 1.00**' in message
+    assert 'Keep: 1.00' in message
+    assert f'loses a success: {float(advice.actions[1].loss_probability):.2%}' in message
+    assert message.endswith('Best: Free Re-roll')
+
+@pytest.mark.asyncio
+async def test_advise_button_is_optional(monkeypatch):
+    roll_history = _roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3, 4, 6])))
+    monkeypatch.setattr(resolve(config), 'advise_button', False)
+    assert not any(isinstance(item, DynamicAdviseButton)
+                   for item in RollView(user_id=USER_ID, dice_set=DiceSet.OCTANE, roll_history=roll_history).children)
+
+    monkeypatch.setattr(resolve(config), 'advise_button', True)
+    view = RollView(user_id=USER_ID, dice_set=DiceSet.OCTANE, roll_history=roll_history)
+    [button] = [item for item in view.children if isinstance(item, DynamicAdviseButton)]
+    match = DynamicAdviseButton.__discord_ui_compiled_template__.fullmatch(button.custom_id)
+    restored = await DynamicAdviseButton.from_custom_id(None, None, match)
+    assert restored.roll_history.get_roll(RollPhase.INITIAL).dice == [1, 1, 2, 3, 4, 6]
+    # Rolls without any allowed reroll get no buttons at all.
+    finished = _roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 2])))
+    assert not RollView(user_id=USER_ID, dice_set=DiceSet.OCTANE, roll_history=finished).children
@@ -0,0 +1,79 @@
+import shelve
+import pytest
+from bot.channel_settings import (
+    ChannelSettings,
+    InMemorySettingsBackend,
+    SqliteSettingsBackend,
+    migrate_shelve)
+from bot.dice import DiceSet
+
+@pytest.mark.asyncio
+async def test_get_dice_set_defaults_to_octane():
+    settings = ChannelSettings(InMemorySettingsBackend())
+    assert await settings.get_dice_set(1) == DiceSet.OCTANE
+
+@pytest.mark.asyncio
+async def test_set_dice_set_is_cached_before_flush():
+    backend = InMemorySettingsBackend()
+    settings = ChannelSettings(backend, flush_delay=60)
+    await settings.set_dice_set(1, DiceSet.HOMESTEAD)
+    assert settings.get_cached_dice_set(1) == DiceSet.HOMESTEAD
+    assert backend.dice_sets == {}, 'Writes should be batched'
+    await settings.close()
+    assert backend.dice_sets == {1: DiceSet.HOMESTEAD}, 'Pending writes should be flushed on close'
+
+@pytest.mark.asyncio
+async def test_write_batch_flushes_when_full():
+    backend = InMemorySettingsBackend()
+    settings = ChannelSettings(backend, flush_delay=60, max_batch_size=2)
+    await settings.set_dice_set(1, DiceSet.NUMBERS)
+    await settings.set_dice_set(2, DiceSet.SABACC)
+    assert backend.dice_sets == {1: DiceSet.NUMBERS, 2: DiceSet.SABACC}
+    await settings.close()
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used():
+    settings = ChannelSettings(InMemorySettingsBackend(), cache_size=2)
+    await settings.get_dice_set(1)
+    await settings.get_dice_set(2)
+    settings.get_cached_dice_set(1)
+    await settings.get_dice_set(3)
+    assert settings.get_cached_dice_set(1) == DiceSet.OCTANE
+    assert settings.get_cached_dice_set(2) is None, 'Least recently used entry should be evicted'
+
+@pytest.mark.asyncio
+async def test_cache_entries_expire():
+    settings = ChannelSettings(InMemorySettingsBackend(), cache_ttl=-1)
+    await settings.get_dice_set(1)
+    assert settings.get_cached_dice_set(1) is None
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_round_trip(tmp_path):
+    backend = SqliteSettingsBackend(str(tmp_path / 'settings.sqlite3'))
+    await backend.set_dice_sets({1: DiceSet.COLOR_SQUARES})
+    await backend.set_dice_sets({1: DiceSet.NUMBERS, 2: DiceSet.HOMESTEAD})
+    assert await backend.get_dice_set(1) == DiceSet.NUMBERS
+    assert await backend.get_dice_set(2) == DiceSet.HOMESTEAD
+    assert await backend.get_dice_set(3) is None
+    await backend.close()
+
+@pytest.mark.asyncio
+async def test_migrate_shelve_runs_once(tmp_path):
+    shelve_path = str(tmp_path / 'channel_settings.db')
+    with shelve.open(shelve_path) as db:
+        db['1'] = DiceSet.HOMESTEAD
+        db['2'] = DiceSet.SABACC
+    backend = SqliteSettingsBackend(str(tmp_path / 'settings.sqlite3'))
+    await backend.set_dice_sets({2: DiceSet.NUMBERS})
+
+    assert await migrate_shelve(shelve_path, backend) == 2
+    assert await backend.get_dice_set(1) == DiceSet.HOMESTEAD
+    assert await backend.get_dice_set(2) == DiceSet.NUMBERS, 'Existing settings should take precedence'
+    assert await migrate_shelve(shelve_path, backend) == 0, 'Migration should only run once'
+    await backend.close()
+
+@pytest.mark.asyncio
+async def test_migrate_missing_shelve(tmp_path):
+    backend = SqliteSettingsBackend(str(tmp_path / 'settings.sqlite3'))
+    assert await migrate_shelve(str(tmp_path / 'missing.db'), backend) == 0
+    await backend.close()
@@ -0,0 +1,97 @@
+import math
+import os
+import queue
+import time
+import pytest
+from bot.channel_settings import ChannelSettings, SqliteSettingsBackend
+from bot.cluster import ClusterSupervisor, HealthReporter, shard_ranges
+from bot.dice import DiceSet
+
+
+class FakeShard:
+    def __init__(self, latency: float, closed: bool = False):
+        self.latency = latency
+        self.closed = closed
+
+    def is_closed(self):
+        return self.closed
+
+
+class FakeGatewayClient:
+    def __init__(self, shards: dict[int, FakeShard]):
+        self.shards = shards
+
+
+def report_and_exit(worker_id, shard_ids, shard_count, health_queue):
+    """A worker that reports healthy shards once, then fails."""
+    health_queue.put({
+        'worker_id': worker_id,
+        'pid': os.getpid(),
+        'shards': {shard_id: {'latency': 0.05, 'closed': False} for shard_id in shard_ids},
+    })
+    time.sleep(0.2)
+    raise SystemExit(1)
+
+
+def hang(worker_id, shard_ids, shard_count, health_queue):
+    """A worker that never reports."""
+    time.sleep(60)
+
+
+def supervise_until(supervisor: ClusterSupervisor, condition, timeout: float = 30):
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            supervisor.poll(timeout=0.05)
+    finally:
+        supervisor.shutdown()
+
+
+def test_shard_ranges_are_contiguous_and_balanced():
+    assert shard_ranges(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert shard_ranges(2, 4) == [[0], [1]]
+    with pytest.raises(ValueError):
+        shard_ranges(0, 1)
+
+def test_health_reporter_reports_each_shard():
+    client = FakeGatewayClient({4: FakeShard(0.042), 5: FakeShard(math.inf, closed=True)})
+    reporter = HealthReporter(client, queue.Queue(), worker_id=2)
+    report = reporter.report()
+    assert report['worker_id'] == 2
+    assert report['pid'] == os.getpid()
+    assert report['shards'] == {
+        4: {'latency': 0.042, 'closed': False},
+        5: {'latency': math.inf, 'closed': True},
+    }
+
+def test_supervisor_restarts_exited_workers_and_tracks_shard_health():
+    supervisor = ClusterSupervisor(report_and_exit, shard_count=4, workers=2, restart_delay=0.05)
+    supervise_until(supervisor, lambda: (
+        all(worker.restarts >= 1 for worker in supervisor.workers) and len(supervisor.shard_health) == 4))
+    assert all(worker.restarts >= 1 for worker in supervisor.workers)
+    assert sorted(supervisor.shard_health) == [0, 1, 2, 3]
+    assert supervisor.shard_health[3].worker_id == 1
+    assert supervisor.unhealthy_shards() == []
+
+def test_supervisor_restarts_stalled_workers():
+    supervisor = ClusterSupervisor(hang, shard_count=1, workers=1, stall_timeout=0.5, restart_delay=0.05)
+    supervise_until(supervisor, lambda: supervisor.workers[0].restarts >= 1)
+    assert supervisor.workers[0].restarts >= 1
+    assert supervisor.unhealthy_shards() == [0]
+
+@pytest.mark.asyncio
+async def test_refresh_picks_up_settings_changed_by_another_process(tmp_path):
+    path = str(tmp_path / 'settings.sqlite3')
+    writer = ChannelSettings(SqliteSettingsBackend(path))
+    reader = ChannelSettings(SqliteSettingsBackend(path))
+    await reader.refresh()
+    assert await reader.get_dice_set(1) == DiceSet.OCTANE
+
+    await writer.set_dice_set(1, DiceSet.SABACC)
+    await writer.flush()
+    assert await reader.get_dice_set(1) == DiceSet.OCTANE, 'The reader should still use its cache'
+    await reader.refresh()
+    assert await reader.get_dice_set(1) == DiceSet.SABACC
+    await writer.close()
+    await reader.close()
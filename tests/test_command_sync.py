@@ -0,0 +1,52 @@
+import discord
+import pytest
+from discord import app_commands
+from bot.command_sync import CommandSyncState, command_signature, sync_commands
+
+def _tree(description='Roll a number of Octane dice.', choices=('octane', 'homestead')):
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.default()))
+
+    @tree.command(description=description)
+    @app_commands.choices(dice_set=[app_commands.Choice(name=choice, value=choice) for choice in choices])
+    async def roll(interaction: discord.Interaction, dice: int, dice_set: str):
+        pass
+
+    @tree.command()
+    async def coin(interaction: discord.Interaction):
+        """Flip a coin."""
+
+    return tree
+
+def test_command_signature_is_deterministic():
+    assert command_signature(_tree()) == command_signature(_tree())
+
+def test_command_signature_changes_with_the_commands():
+    signature = command_signature(_tree())
+    assert command_signature(_tree(description='Roll dice.')) != signature
+    assert command_signature(_tree(choices=('octane',))) != signature
+
+@pytest.mark.asyncio
+async def test_sync_commands_skips_unchanged_commands(tmp_path, mocker):
+    state = CommandSyncState(str(tmp_path / 'command_sync.json'))
+    tree = _tree()
+    sync = mocker.patch.object(tree, 'sync', mocker.AsyncMock())
+
+    assert await sync_commands(tree, None, state)
+    assert not await sync_commands(tree, None, state)
+    assert await sync_commands(tree, None, state, force=True)
+    assert sync.await_count == 2
+
+@pytest.mark.asyncio
+async def test_sync_commands_retries_after_failed_sync(tmp_path, mocker):
+    state = CommandSyncState(str(tmp_path / 'command_sync.json'))
+    tree = _tree()
+    mocker.patch.object(tree, 'sync', mocker.AsyncMock(side_effect=discord.HTTPException(mocker.Mock(status=500), 'error')))
+
+    with pytest.raises(discord.HTTPException):
+        await sync_commands(tree, None, state)
+    assert state.get('None:global') is None
+
+def test_invalid_state_file_is_ignored(tmp_path):
+    path = tmp_path / 'command_sync.json'
+    path.write_text('not json')
+    assert CommandSyncState(str(path)).get('global') is None
@@ -0,0 +1,68 @@
+import asyncio
+import math
+import time
+import discord
+import pytest
+from bot.compute import ComputeBusyError, ComputePool, ComputeTimeoutError
+
+class FakeResponse:
+    def __init__(self):
+        self.deferred = None
+
+    def is_done(self):
+        return self.deferred is not None
+
+    async def defer(self, thinking=False, ephemeral=False):
+        self.deferred = {'thinking': thinking}
+
+class FakeInteraction:
+    def __init__(self, type=discord.InteractionType.application_command):
+        self.type = type
+        self.response = FakeResponse()
+
+@pytest.fixture
+def started_pool():
+    pool = ComputePool(max_workers=1, max_pending=2, timeout=10)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_runs_inline_until_started():
+    pool = ComputePool(max_workers=1, max_pending=1, timeout=1)
+    interaction = FakeInteraction()
+    assert await pool.run(interaction, math.factorial, 5, expected_seconds=10) == 120
+    assert not interaction.response.is_done()
+    assert pool.pending == 0
+
+@pytest.mark.asyncio
+async def test_rejects_jobs_when_busy():
+    pool = ComputePool(max_workers=1, max_pending=0, timeout=1)
+    with pytest.raises(ComputeBusyError):
+        await pool.run(None, math.factorial, 5)
+
+@pytest.mark.asyncio
+async def test_runs_in_worker_process_and_defers_slow_jobs(started_pool):
+    interaction = FakeInteraction()
+    assert await started_pool.run(interaction, math.factorial, 5) == 120
+    assert not interaction.response.is_done(), 'Fast jobs should not be deferred'
+
+    interaction = FakeInteraction(type=discord.InteractionType.component)
+    assert await started_pool.run(interaction, math.factorial, 5, expected_seconds=10) == 120
+    assert interaction.response.deferred == {'thinking': False}, 'Buttons should defer without thinking'
+
+@pytest.mark.asyncio
+async def test_times_out(started_pool):
+    # Wait for the worker process to start.
+    await started_pool.run(None, math.factorial, 5)
+    start = time.monotonic()
+    with pytest.raises(ComputeTimeoutError):
+        await started_pool.run(None, time.sleep, 1, timeout=0.2)
+    assert time.monotonic() - start < 1
+    # The job keeps its worker busy until it finishes.
+    assert started_pool.pending == 1
+    for _ in range(100):
+        if not started_pool.pending:
+            break
+        await asyncio.sleep(0.05)
+    assert started_pool.pending == 0
@@ -0,0 +1,225 @@
+import asyncio
+import itertools
+import discord
+import pytest
+from bot import controller
+from bot.controller import (
+    MAX_CUSTOM_ID_LENGTH,
+    ButtonPresses,
+    ResponseScheduler,
+    RollView,
+    DynamicRerollButton,
+    DynamicFreeRerollButton,
+    DynamicAllInButton)
+from bot.dice import DiceSet
+from bot.ratelimit import RateLimitTracker
+from bot.roll import Roll, RollHistory, RollPhase
+
+USER_ID = 12345678901234567890
+
+_ids = itertools.count(1)
+
+class FakeUser:
+    def __init__(self, id):
+        self.id = id
+
+class FakeMessage:
+    def __init__(self):
+        self.id = next(_ids)
+
+class FakeResponse:
+    def __init__(self):
+        self.calls = []
+
+    def is_done(self):
+        return bool(self.calls)
+
+    async def send_message(self, content=None, **kwargs):
+        self.calls.append(('send_message', content, kwargs))
+        await asyncio.sleep(0)
+
+    async def edit_message(self, **kwargs):
+        self.calls.append(('edit_message', None, kwargs))
+        await asyncio.sleep(0)
+
+    async def defer(self, **kwargs):
+        self.calls.append(('defer', None, kwargs))
+
+class FakeFollowup:
+    def __init__(self, response):
+        self.response = response
+
+    async def send(self, content=None, **kwargs):
+        self.response.calls.append(('followup', content, kwargs))
+
+class FakeInteraction:
+    def __init__(self, message, id=None):
+        self.id = id or next(_ids)
+        self.type = discord.InteractionType.component
+        self.guild_id = 1
+        self.channel_id = 1
+        self.user = FakeUser(USER_ID)
+        self.message = message
+        self.response = FakeResponse()
+        self.followup = FakeFollowup(self.response)
+
+    async def edit_original_response(self, **kwargs):
+        self.response.calls.append(('edit_original_response', None, kwargs))
+
+def _rerollable_history():
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, Roll([1, 1, 2, 3, 4, 6]))
+    return roll_history
+
+async def _button_from_custom_id(button_class, custom_id):
+    match = button_class.__discord_ui_compiled_template__.fullmatch(custom_id)
+    assert match, f'{custom_id} should match the {button_class.__name__} template'
+    return await button_class.from_custom_id(None, None, match)
+
+@pytest.mark.asyncio
+async def test_roll_view_buttons_encode_roll_history():
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, Roll([1, 1, 2, 3, 4, 6]))
+    view = RollView(user_id=USER_ID, dice_set=DiceSet.OCTANE_ADVENTURE, roll_history=roll_history)
+
+    buttons = {type(item): item for item in view.children}
+    assert buttons.keys() == {DynamicRerollButton, DynamicFreeRerollButton}
+    for button_class, button in buttons.items():
+        assert len(button.custom_id) <= MAX_CUSTOM_ID_LENGTH
+        restored = await _button_from_custom_id(button_class, button.custom_id)
+        assert restored.user_id == USER_ID
+        assert restored.dice_set == DiceSet.OCTANE_ADVENTURE
+        assert restored.roll_history.get_roll(RollPhase.INITIAL).dice == [1, 1, 2, 3, 4, 6]
+
+@pytest.mark.asyncio
+async def test_legacy_custom_id_has_no_roll_history():
+    button = await _button_from_custom_id(DynamicAllInButton, f'roll:all_in:user:{USER_ID}:dice_set:octane')
+    assert button.dice_set == DiceSet.OCTANE
+    assert button.roll_history is None
+
+@pytest.mark.asyncio
+async def test_roll_history_is_omitted_if_custom_id_is_too_long():
+    roll_history = RollHistory()
+    for phase in [RollPhase.INITIAL, RollPhase.REROLL, RollPhase.ALL_IN]:
+        roll_history.add_roll(phase, Roll([1] * 10**5 + [2] * 10**5 + [3]))
+    button = DynamicAllInButton(USER_ID, DiceSet.OCTANE_ADVENTURE, roll_history)
+    assert button.custom_id == f'roll:all_in:user:{USER_ID}:dice_set:octane_adventure'
+
+@pytest.mark.asyncio
+async def test_roll_view_is_not_kept_in_the_view_store():
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, Roll([1, 1, 2, 3, 4, 6]))
+    view = RollView(user_id=USER_ID, dice_set=DiceSet.OCTANE, roll_history=roll_history)
+
+    # discord.py only stores views that haven't finished yet.
+    assert view.is_finished()
+    assert len(view.children) == 2
+    assert all(button.is_persistent() for button in view.children)
+
+@pytest.mark.asyncio
+async def test_concurrent_presses_on_a_message_reroll_once():
+    custom_id = DynamicRerollButton(USER_ID, DiceSet.OCTANE, _rerollable_history()).custom_id
+    message = FakeMessage()
+    interactions = [FakeInteraction(message) for _ in range(2)]
+    buttons = [await _button_from_custom_id(DynamicRerollButton, custom_id) for _ in interactions]
+
+    await asyncio.gather(*(button.callback(interaction) for button, interaction in zip(buttons, interactions)))
+
+    assert [name for name, _, _ in interactions[0].response.calls] == ['edit_message']
+    # The second press waits for the first one, and is then acknowledged as outdated.
+    assert [name for name, _, _ in interactions[1].response.calls] == ['defer', 'followup']
+    assert interactions[1].response.calls[1][2]['ephemeral']
+
+@pytest.mark.asyncio
+async def test_redelivered_interaction_is_only_acknowledged():
+    custom_id = DynamicRerollButton(USER_ID, DiceSet.OCTANE, _rerollable_history()).custom_id
+    message = FakeMessage()
+    first = FakeInteraction(message)
+    await (await _button_from_custom_id(DynamicRerollButton, custom_id)).callback(first)
+    redelivered = FakeInteraction(message, id=first.id)
+    await (await _button_from_custom_id(DynamicRerollButton, custom_id)).callback(redelivered)
+    assert [name for name, _, _ in redelivered.response.calls] == ['send_message']
+
+def test_button_presses_forget_the_least_recently_used_entries():
+    presses = ButtonPresses(max_messages=2, max_interactions=2)
+    assert not presses.is_redelivery(1)
+    assert presses.is_redelivery(1)
+    presses.is_redelivery(2)
+    presses.is_redelivery(3)
+    assert not presses.is_redelivery(1)
+
+    roll_history = _rerollable_history()
+    for message_id in [1, 2, 3]:
+        presses.lock(message_id)
+        presses.updated(message_id, roll_history)
+    assert len(presses._locks) == 2
+    assert not presses.is_outdated(1, RollHistory())
+    assert presses.is_outdated(3, RollHistory())
+
+class FakeClock:
+    """A monotonic clock that only advances when the scheduler sleeps."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+def _rate_limited_scheduler(channel_id: int, seconds: float, max_wait: float) -> tuple[ResponseScheduler, FakeClock]:
+    clock = FakeClock()
+    tracker = RateLimitTracker(clock=clock)
+    tracker.record(f'https://discord.com/api/v10/channels/{channel_id}/messages', 429, {'Retry-After': str(seconds)})
+    return ResponseScheduler(tracker, max_wait=max_wait, sleep=clock.sleep), clock
+
+@pytest.mark.asyncio
+async def test_scheduler_responds_right_away_without_rate_limits():
+    interaction = FakeInteraction(FakeMessage())
+    await ResponseScheduler(RateLimitTracker()).send(interaction, content='Hello')
+    assert interaction.response.calls == [('send_message', 'Hello', {})]
+
+@pytest.mark.asyncio
+async def test_scheduler_waits_within_the_response_window():
+    interaction = FakeInteraction(FakeMessage())
+    scheduler, clock = _rate_limited_scheduler(interaction.channel_id, 0.5, max_wait=1.0)
+    await scheduler.send(interaction, content='Hello')
+    assert clock.sleeps == [0.5]
+    assert interaction.response.calls == [('send_message', 'Hello', {})]
+
+@pytest.mark.asyncio
+async def test_scheduler_defers_when_the_rate_limit_outlasts_the_response_window():
+    interaction = FakeInteraction(FakeMessage())
+    scheduler, clock = _rate_limited_scheduler(interaction.channel_id, 2.0, max_wait=1.0)
+    await scheduler.send(interaction, content='Hello')
+    assert clock.sleeps == [2.0]
+    assert [name for name, _, _ in interaction.response.calls] == ['defer', 'followup']
+
+@pytest.mark.asyncio
+async def test_scheduler_defers_commands_ephemerally_for_ephemeral_responses():
+    interaction = FakeInteraction(None)
+    interaction.type = discord.InteractionType.application_command
+    scheduler, clock = _rate_limited_scheduler(interaction.channel_id, 2.0, max_wait=1.0)
+    await scheduler.send(interaction, content='Oops', ephemeral=True)
+    assert interaction.response.calls == [
+        ('defer', None, {'thinking': True, 'ephemeral': True}), ('followup', 'Oops', {'ephemeral': True})]
+
+@pytest.mark.asyncio
+async def test_rate_limited_presses_on_a_message_edit_it_once(monkeypatch):
+    custom_id = DynamicRerollButton(USER_ID, DiceSet.OCTANE, _rerollable_history()).custom_id
+    message = FakeMessage()
+    interactions = [FakeInteraction(message) for _ in range(2)]
+    scheduler, clock = _rate_limited_scheduler(interactions[0].channel_id, 5.0, max_wait=1.0)
+    monkeypatch.setattr(controller, 'response_scheduler', scheduler)
+    buttons = [await _button_from_custom_id(DynamicRerollButton, custom_id) for _ in interactions]
+
+    await asyncio.gather(*(button.callback(interaction) for button, interaction in zip(buttons, interactions)))
+
+    # The first press is deferred, and edits the message once the rate limit resets.
+    assert [name for name, _, _ in interactions[0].response.calls] == ['defer', 'edit_original_response']
+    # The second press waits for the first one, and is then acknowledged as outdated, without another edit.
+    assert [name for name, _, _ in interactions[1].response.calls] == ['defer', 'followup']
+    assert clock.sleeps == [5.0]
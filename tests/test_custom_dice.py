@@ -0,0 +1,91 @@
+import pickle
+import pytest
+from bot.channel_settings import ChannelSettings, InMemorySettingsBackend, SqliteSettingsBackend
+from bot.custom_dice import MAX_DICE_SETS_PER_GUILD, CustomDiceSetRegistry, parse_emoji, parse_name
+from bot.dice import CustomDiceSet, DiceSet
+from bot.interactions import command_name_and_options
+from bot.message import MessageGenerator
+from bot.roll import Roll, RollHistory, RollPhase
+
+EMOJI = ('🍎', '🍐', '<:cherry:123>', '<a:grape:456>', '🍋', '🍉')
+
+def test_parse_emoji_and_name():
+    assert parse_emoji('🍎 🍐 <:cherry:123><a:grape:456> 🍋  🍉') == EMOJI
+    with pytest.raises(ValueError):
+        parse_emoji('🍎 🍐 🍋')
+    with pytest.raises(ValueError):
+        parse_emoji('🍎 🍎 🍐 🍋 🍉 🍇')
+    assert parse_emoji('1️⃣ 2️⃣ #️⃣ 👍🏽 🇩🇪 👨‍👩‍👧') == ('1️⃣', '2️⃣', '#️⃣', '👍🏽', '🇩🇪', '👨‍👩‍👧')
+    # Markdown, text, and the separator of the dice counts would break the roll messages.
+    for face in ['**🍎**', '🍎×', '×', 'x', 'é', '`🍎`', '||🍎||', '<@123>']:
+        with pytest.raises(ValueError):
+            parse_emoji(f'{face} 🍐 <:cherry:123> <a:grape:456> 🍋 🍉')
+    assert parse_name('  Fruit salad ') == 'Fruit salad'
+    with pytest.raises(ValueError):
+        parse_name('no <@mentions>')
+
+def test_custom_dice_sets_render_their_emoji():
+    dice_set = CustomDiceSet(1, guild_id=2, name='fruit', emoji=EMOJI)
+    assert dice_set.value == 'c1'
+    assert pickle.loads(pickle.dumps(dice_set)) == dice_set
+    roll_history = RollHistory()
+    roll_history.add_roll(RollPhase.INITIAL, Roll([1, 1, 3, 4]))
+    message = MessageGenerator(dice_set).generate_roll_message(roll_history)
+    assert 'Basic: 🍎 🍎' in message
+    assert '<:cherry:123>' in message and '<a:grape:456>' in message
+
+@pytest.mark.asyncio
+async def test_registry_replaces_sets_by_name_and_resolves_old_ids():
+    registry = CustomDiceSetRegistry(ChannelSettings(InMemorySettingsBackend()))
+    first = await registry.create(1, 'fruit', EMOJI)
+    second = await registry.create(1, 'fruit', tuple(reversed(EMOJI)))
+    assert await registry.get(1, 'fruit') == second
+    assert await registry.get(2, 'fruit') is None
+    # Buttons of earlier rolls keep the set they were rolled with.
+    assert await registry.resolve(first.value) == first
+    assert await registry.resolve('octane') == DiceSet.OCTANE
+    assert await registry.resolve('c999') == DiceSet.OCTANE
+
+@pytest.mark.asyncio
+async def test_registry_limits_sets_per_guild_and_evicts_guilds():
+    backend = InMemorySettingsBackend()
+    registry = CustomDiceSetRegistry(ChannelSettings(backend), max_guilds=1)
+    for i in range(MAX_DICE_SETS_PER_GUILD):
+        await registry.create(1, f'set {i}', EMOJI)
+    with pytest.raises(ValueError):
+        await registry.create(1, 'one too many', EMOJI)
+    # Replacing an existing set is still allowed.
+    await registry.create(1, 'set 0', EMOJI)
+
+    await registry.guild_dice_sets(2)
+    assert list(registry._guilds) == [2]
+    # Sets created by another process are found on the next lookup.
+    await backend.add_custom_dice_set(2, 'late', EMOJI)
+    assert (await registry.get(2, 'late')).name == 'late'
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_stores_custom_dice_sets(tmp_path):
+    path = str(tmp_path / 'settings.db')
+    backend = SqliteSettingsBackend(path)
+    fruit = await backend.add_custom_dice_set(1, 'fruit', EMOJI)
+    await backend.add_custom_dice_set(1, 'fruit', tuple(reversed(EMOJI)))
+    await backend.set_dice_sets({10: fruit, 11: DiceSet.NUMBERS})
+    await backend.close()
+
+    backend = SqliteSettingsBackend(path)
+    assert await backend.get_dice_set(10) == fruit
+    assert (await backend.get_dice_set(10)).emoji == EMOJI
+    assert await backend.get_dice_set(11) == DiceSet.NUMBERS
+    [latest] = await backend.get_custom_dice_sets(1)
+    assert latest.emoji == tuple(reversed(EMOJI))
+    assert await backend.get_custom_dice_sets(2) == []
+    await backend.close()
+
+def test_subcommands_are_flattened():
+    data = {'name': 'diceset', 'options': [
+        {'name': 'create', 'type': 1, 'options': [
+            {'name': 'name', 'type': 3, 'value': 'fruit'},
+            {'name': 'emoji', 'type': 3, 'value': '🍎'}]}]}
+    assert command_name_and_options(data) == ('diceset create', {'name': 'fruit', 'emoji': '🍎'})
+    assert command_name_and_options({'name': 'roll', 'options': [{'name': 'number_of_dice', 'type': 4, 'value': 3}]}) \
+        == ('roll', {'number_of_dice': 3})
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import pathlib
+import time
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from nacl.signing import SigningKey
+from bot import interactions
+from bot.channel_settings import InMemorySettingsBackend, channel_settings
+from bot.controller import EMBED_COLOR, send_response
+from bot.interactions import InteractionsApi, InteractionsServer
+
+# Interaction payloads as recorded from Discord
+PAYLOADS = pathlib.Path(__file__).parent / 'payloads'
+
+
+def load_payload(name: str) -> dict:
+    return json.loads((PAYLOADS / f'{name}.json').read_text())
+
+
+class RecordingApi(InteractionsApi):
+    """Records the webhook requests, instead of sending them to Discord."""
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def request(self, method, path, payload):
+        self.requests.append((method, path, payload))
+        return {}
+
+
+@pytest.fixture
+def signing_key():
+    return SigningKey.generate()
+
+@pytest.fixture(autouse=True)
+def in_memory_channel_settings(monkeypatch):
+    monkeypatch.setattr(channel_settings, 'backend', InMemorySettingsBackend())
+
+
+def serve(signing_key: SigningKey, api: InteractionsApi, **kwargs) -> TestClient:
+    server = InteractionsServer(signing_key.verify_key.encode().hex(), api=api, **kwargs)
+    return TestClient(TestServer(server.create_app()))
+
+async def post_interaction(client: TestClient, signing_key: SigningKey, payload: dict) -> dict:
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time()))
+    response = await client.post('/interactions', data=body, headers={
+        'Content-Type': 'application/json',
+        'X-Signature-Ed25519': signing_key.sign(timestamp.encode() + body).signature.hex(),
+        'X-Signature-Timestamp': timestamp,
+    })
+    assert response.status == 200
+    return await response.json()
+
+
+@pytest.mark.asyncio
+async def test_ping_is_answered_with_pong(signing_key):
+    async with serve(signing_key, RecordingApi()) as client:
+        assert await post_interaction(client, signing_key, load_payload('ping')) == {'type': 1}
+
+@pytest.mark.asyncio
+async def test_requests_with_invalid_signatures_are_rejected(signing_key):
+    body = json.dumps(load_payload('ping')).encode()
+    forged = SigningKey.generate().sign(b'1700000000' + body).signature.hex()
+    async with serve(signing_key, RecordingApi()) as client:
+        for headers in [
+            {},
+            {'X-Signature-Ed25519': forged, 'X-Signature-Timestamp': '1700000000'},
+            {'X-Signature-Ed25519': 'not hex', 'X-Signature-Timestamp': '1700000000'},
+        ]:
+            response = await client.post('/interactions', data=body, headers=headers)
+            assert response.status == 401
+
+@pytest.mark.asyncio
+async def test_roll_command_and_reroll_button(signing_key):
+    api = RecordingApi()
+    async with serve(signing_key, api) as client:
+        response = await post_interaction(client, signing_key, load_payload('roll_command'))
+        assert response['type'] == 4
+        assert response['data']['embeds'][0]['color'] == EMBED_COLOR.value
+        custom_ids = [button['custom_id']
+                      for row in response['data']['components'] for button in row['components']]
+        reroll_id = next(custom_id for custom_id in custom_ids if custom_id.startswith('roll:reroll:'))
+
+        # Press the re-roll button on the message sent in response.
+        payload = load_payload('reroll_button')
+        payload['data']['custom_id'] = reroll_id
+        payload['message']['embeds'] = response['data']['embeds']
+        payload['message']['components'] = response['data']['components']
+        response = await post_interaction(client, signing_key, payload)
+        assert response['type'] == 7
+        assert 'Re-roll' in response['data']['embeds'][0]['description']
+    assert api.requests == []
+
+@pytest.mark.asyncio
+async def test_button_of_another_user_is_rejected(signing_key):
+    payload = load_payload('reroll_button')
+    payload['member']['user']['id'] = '1270000000000000002'
+    async with serve(signing_key, RecordingApi()) as client:
+        response = await post_interaction(client, signing_key, payload)
+    assert response['type'] == 4
+    assert response['data']['flags'] == 64
+
+@pytest.mark.asyncio
+async def test_slow_handlers_are_deferred_and_respond_with_a_followup(signing_key, mocker):
+    async def slow_coin(interaction, options):
+        await asyncio.sleep(0.1)
+        await send_response(interaction, content='Heads')
+    mocker.patch.dict(interactions.COMMANDS, {'coin': slow_coin})
+    payload = load_payload('roll_command')
+    payload['data'] = {'id': '1290000000000000011', 'name': 'coin', 'type': 1}
+
+    api = RecordingApi()
+    async with serve(signing_key, api, response_deadline=0.01) as client:
+        response = await post_interaction(client, signing_key, payload)
+        assert response == {'type': 5}
+        for _ in range(100):
+            if api.requests:
+                break
+            await asyncio.sleep(0.01)
+    assert api.requests == [('POST', f'/webhooks/{payload["application_id"]}/{payload["token"]}', {'content': 'Heads'})]
+
+@pytest.mark.asyncio
+async def test_ephemeral_responses_of_slow_handlers_delete_the_public_deferral(signing_key, mocker):
+    async def slow_odds(interaction, options):
+        await asyncio.sleep(0.1)
+        await send_response(interaction, content='Too many dice', ephemeral=True)
+    mocker.patch.dict(interactions.COMMANDS, {'odds': slow_odds})
+    payload = load_payload('roll_command')
+    payload['data'] = {'id': '1290000000000000012', 'name': 'odds', 'type': 1}
+
+    api = RecordingApi()
+    async with serve(signing_key, api, response_deadline=0.01) as client:
+        assert await post_interaction(client, signing_key, payload) == {'type': 5}
+        for _ in range(100):
+            if len(api.requests) == 2:
+                break
+            await asyncio.sleep(0.01)
+    webhook = f'/webhooks/{payload["application_id"]}/{payload["token"]}'
+    assert api.requests == [
+        ('DELETE', f'{webhook}/messages/@original', None),
+        ('POST', webhook, {'content': 'Too many dice', 'flags': 64})]
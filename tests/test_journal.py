@@ -0,0 +1,121 @@
+import asyncio
+import os
+import pytest
+from bot.dice import DiceSet
+from bot.journal import HEADER_SIZE, RECORD_SIZE, JournalReader, RollJournal
+from bot.roll import Roll, RollHistory, RollPhase
+from bot.roll_state import encode_roll_history
+
+def _roll_history(*rolls):
+    roll_history = RollHistory()
+    for phase, roll in zip([RollPhase.INITIAL, RollPhase.REROLL, RollPhase.ALL_IN], rolls):
+        roll_history.add_roll(phase, roll)
+    return roll_history
+
+def _failed_reroll():
+    roll = Roll([1, 1, 2, 3])
+    roll.mark_as_failed_reroll()
+    return roll
+
+@pytest.mark.asyncio
+async def test_journaled_rolls_can_be_read_back(tmp_path):
+    journal = RollJournal(str(tmp_path))
+    journal.start()
+    rolls = [
+        (_roll_history(Roll([1, 1, 2, 3, 4, 6])), DiceSet.OCTANE, 10, 20, 30),
+        (_roll_history(Roll([1, 1, 2, 5]), _failed_reroll()), DiceSet.HOMESTEAD, None, 21, 31),
+        (_roll_history(Roll([6] * 100_000 + [1])), DiceSet.NUMBERS, 10, 20, 2**64 - 1),
+    ]
+    for roll_history, dice_set, guild_id, channel_id, user_id in rolls:
+        journal.record(roll_history, dice_set, guild_id=guild_id, channel_id=channel_id, user_id=user_id)
+    await journal.close()
+
+    entries = JournalReader(str(tmp_path)).find()
+    assert len(entries) == 3
+    for entry, (roll_history, dice_set, guild_id, channel_id, user_id) in zip(entries, rolls):
+        assert (entry.dice_set, entry.guild_id, entry.channel_id, entry.user_id) == (
+            dice_set, guild_id, channel_id, user_id)
+        assert encode_roll_history(entry.roll_history) == encode_roll_history(roll_history)
+    assert entries[1].roll_history.get_roll(RollPhase.REROLL).failed_reroll
+
+@pytest.mark.asyncio
+async def test_segments_rotate_and_filters_apply_across_them(tmp_path):
+    journal = RollJournal(str(tmp_path), records_per_segment=3, max_batch_size=2)
+    journal.start()
+    for i in range(7):
+        journal.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=i % 2, user_id=i)
+    await journal.close()
+
+    reader = JournalReader(str(tmp_path))
+    assert [os.path.basename(path) for path in reader.segments()] == [
+        'rolls-000001.journal', 'rolls-000002.journal', 'rolls-000003.journal']
+    assert reader.count() == 7
+    assert [entry.user_id for entry in reader.find(channel_id=0)] == [0, 2, 4, 6]
+    assert [entry.user_id for entry in reader.find(channel_id=0, last=2)] == [4, 6]
+
+@pytest.mark.asyncio
+async def test_rolls_are_only_journaled_once_started(tmp_path):
+    journal = RollJournal(str(tmp_path / 'journal'))
+    journal.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=1)
+    await journal.close()
+    assert not os.path.exists(tmp_path / 'journal')
+
+@pytest.mark.asyncio
+async def test_partial_record_is_dropped_when_the_journal_reopens(tmp_path):
+    journal = RollJournal(str(tmp_path))
+    journal.start()
+    journal.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=1)
+    await journal.close()
+    # Simulate a crash in the middle of a write.
+    path = JournalReader(str(tmp_path)).segments()[0]
+    with open(path, 'ab') as f:
+        f.write(b'\0' * (RECORD_SIZE // 2))
+    assert JournalReader(str(tmp_path)).count() == 1
+
+    journal = RollJournal(str(tmp_path))
+    journal.start()
+    journal.record(_roll_history(Roll([4, 5, 6])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=2)
+    await journal.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 2 * RECORD_SIZE
+    assert [entry.user_id for entry in JournalReader(str(tmp_path)).find()] == [1, 2]
+
+def test_reader_rejects_files_of_another_format(tmp_path):
+    (tmp_path / 'rolls-000001.journal').write_bytes(b'NOTAJRNL' + b'\0' * 200)
+    with pytest.raises(ValueError):
+        JournalReader(str(tmp_path)).count()
+
+@pytest.mark.asyncio
+async def test_segments_of_processes_sharing_the_directory_are_merged(tmp_path):
+    journals = [RollJournal(str(tmp_path), writer=writer) for writer in ['worker0', 'worker1']]
+    for journal in journals:
+        journal.start()
+    for user_id, journal in enumerate([journals[0], journals[1], journals[0]]):
+        journal.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=user_id)
+        await journal.flush()
+        await asyncio.sleep(0.002)
+    for journal in journals:
+        await journal.close()
+
+    reader = JournalReader(str(tmp_path))
+    assert [os.path.basename(path) for path in reader.segments()] == [
+        'rolls-worker0-000001.journal', 'rolls-worker1-000001.journal']
+    assert [entry.user_id for entry in reader.find()] == [0, 1, 2]
+    assert [entry.user_id for entry in reader.find(last=1)] == [2]
+
+@pytest.mark.asyncio
+async def test_a_segment_locked_by_another_writer_is_skipped(tmp_path):
+    first, second = RollJournal(str(tmp_path), writer='replica'), RollJournal(str(tmp_path), writer='replica')
+    for journal in [first, second]:
+        journal.start()
+    first.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=1)
+    await first.flush()
+    # The first journal keeps its segment locked, so the second one starts the next segment.
+    second.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=2)
+    await second.flush()
+    first.record(_roll_history(Roll([1, 2, 3])), DiceSet.OCTANE, guild_id=1, channel_id=1, user_id=3)
+    await first.close()
+    await second.close()
+
+    reader = JournalReader(str(tmp_path))
+    assert [len(reader.read_segment(path)) for path in reader.segments()] == [2, 1]
+    assert sorted(entry.user_id for entry in reader.find()) == [1, 2, 3]
@@ -0,0 +1,30 @@
+import pytest
+from bot.config import Config
+from bot.lazy import Lazy, is_created, resolve
+
+class Counter:
+    instances = 0
+
+    def __init__(self):
+        Counter.instances += 1
+        self.value = 1
+
+def test_lazy_creates_object_on_first_use():
+    Counter.instances = 0
+    proxy = Lazy(Counter)
+    assert not is_created(proxy)
+    assert Counter.instances == 0
+
+    assert proxy.value == 1
+    proxy.value = 2
+    assert resolve(proxy).value == 2
+    assert is_created(proxy)
+    assert Counter.instances == 1
+
+def test_config_only_requires_token_on_access(monkeypatch):
+    monkeypatch.delenv('DISCORD_TOKEN', raising=False)
+    monkeypatch.setattr('bot.config.load_dotenv', lambda: None)
+    config = Config()
+    assert config.compute_workers == 2
+    with pytest.raises(ValueError):
+        config.token
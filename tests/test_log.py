@@ -0,0 +1,81 @@
+import io
+import json
+import logging
+from types import SimpleNamespace
+import pytest
+from bot.log import (
+    SAMPLED,
+    DeferredFormatQueueHandler,
+    JsonFormatter,
+    SamplingFilter,
+    log_interaction,
+    parse_sample_rates,
+    setup_logging)
+
+def _record(level=logging.INFO, msg='Rolled %d dice', args=(3,), **extra):
+    record = logging.LogRecord('bot.test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+@pytest.fixture
+def read_log():
+    """Sets up logging, and returns a function that stops it and returns the bot's log entries."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    stream = io.StringIO()
+    listener = setup_logging(logging.DEBUG, {logging.DEBUG: 0.0}, stream)
+    def read():
+        if listener._thread:
+            listener.stop()
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        return [entry for entry in entries if entry['logger'].startswith('bot.')]
+    yield read
+    read()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(_record(channel_id=42)))
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'bot.test'
+    assert entry['message'] == 'Rolled 3 dice'
+    assert entry['channel_id'] == 42
+
+def test_sampling_filter_only_samples_high_volume_records():
+    sampling_filter = SamplingFilter({logging.INFO: 0.0})
+    assert sampling_filter.filter(_record())
+    assert not sampling_filter.filter(_record(**SAMPLED))
+    assert sampling_filter.filter(_record(level=logging.WARNING, **SAMPLED))
+
+def test_queue_handler_defers_formatting():
+    record = DeferredFormatQueueHandler(None).prepare(_record())
+    assert record.msg == 'Rolled 3 dice'
+    assert record.args is None
+
+def test_parse_sample_rates():
+    assert parse_sample_rates('debug=0.01, INFO=0.5') == {logging.DEBUG: 0.01, logging.INFO: 0.5}
+    assert parse_sample_rates('') == {}
+    with pytest.raises(ValueError):
+        parse_sample_rates('LOUD=1')
+
+@pytest.mark.asyncio
+async def test_log_interaction_adds_context(read_log):
+
+    class Controller:
+        @log_interaction('roll')
+        async def handle_roll(self, interaction, num_dice):
+            logging.getLogger('bot.test').warning('Rolling %d dice', num_dice)
+            logging.getLogger('bot.test').debug('Sampled away', extra=SAMPLED)
+            return num_dice
+
+    interaction = SimpleNamespace(id=1, guild_id=2, channel_id=3, user=SimpleNamespace(id=4))
+    assert await Controller().handle_roll(interaction, 5) == 5
+    entries = read_log()
+    assert [entry['message'] for entry in entries] == ['Rolling 5 dice', 'Handled roll']
+    for entry in entries:
+        assert entry['interaction_id'] == 1
+        assert entry['guild_id'] == 2
+        assert entry['channel_id'] == 3
+        assert entry['command'] == 'roll'
+    assert entries[1]['duration_ms'] >= 0
+    assert 'sampled' not in entries[1]
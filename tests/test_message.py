@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+import discord
+import pytest
+from bot.dice import DiceSet
+from bot.message import (
+    MAX_EMBED_DESCRIPTION_LENGTH,
+    MAX_MESSAGE_EMBEDS_LENGTH,
+    MessageGenerator,
+    MessageParser,
+    build_render_tables,
+    paginate,
+    render_tables)
+from bot.roll import Roll, RollHistory, RollPhase
+
+def _roll_history(*rolls):
+    roll_history = RollHistory()
+    for phase, roll in zip(RollPhase, rolls):
+        roll_history.add_roll(phase, roll)
+    return roll_history
+
+def _parse(pages, dice_set):
+    message = SimpleNamespace(embeds=[discord.Embed(description=page) for page in pages])
+    return MessageParser(SimpleNamespace(message=message), dice_set).roll_history
+
+def test_small_roll_is_not_compact():
+    message = MessageGenerator(DiceSet.NUMBERS).generate_roll_message(_roll_history(Roll([1, 1, 2, 6, 6, 6])))
+    assert message == '\nRoll: :one: :one: :two: :six: :six: :six:\n----------\n1 Critical: :six: :six: :six:\n1 Basic: :one: :one:\n1 N/A: :two:'
+
+def test_large_roll_is_compact():
+    roll_history = _roll_history(Roll.from_counts([400, 380, 290, 350, 330, 1]))
+    message = MessageGenerator(DiceSet.OCTANE).generate_roll_message(roll_history)
+    assert len(message) < MAX_EMBED_DESCRIPTION_LENGTH
+    assert '\nRoll: <:1octane:1312661394075816026>×400 ' in message
+    assert '\n1 N/A: <:6octane:1312661464963743754>\n' not in message
+
+@pytest.mark.parametrize('dice_set', list(DiceSet))
+@pytest.mark.parametrize('counts', [[1, 2, 3, 4, 5, 6], [30, 20, 25, 30, 21, 1], [3000, 2000, 1, 1700, 1700, 1600]])
+def test_messages_fit_and_round_trip(dice_set, counts):
+    initial_roll = Roll.from_counts(counts)
+    free_reroll = Roll.from_counts([count if count > 1 else 1 - (face == 3) for face, count in enumerate(counts)])
+    roll_history = _roll_history(initial_roll, Roll([1]), free_reroll)
+    del roll_history.rolls[RollPhase.REROLL]
+
+    pages = MessageGenerator(dice_set).generate_roll_pages(roll_history)
+    assert all(len(page) <= MAX_EMBED_DESCRIPTION_LENGTH for page in pages)
+    assert sum(len(page) for page in pages) <= MAX_MESSAGE_EMBEDS_LENGTH
+
+    parsed = _parse(pages, dice_set)
+    assert parsed.get_roll(RollPhase.INITIAL).counts == initial_roll.counts
+    assert parsed.get_roll(RollPhase.FREE_REROLL).counts == free_reroll.counts
+
+def test_paginate_splits_at_line_boundaries():
+    message = '\n'.join(['a' * 10] * 5)
+    assert paginate(message, max_length=25) == ['a' * 10 + '\n' + 'a' * 10] * 2 + ['a' * 10]
+    assert paginate(message, max_length=100) == [message]
+
+def test_render_tables_are_shared():
+    build_render_tables()
+    tables = render_tables(DiceSet.NUMBERS)
+    assert render_tables(DiceSet.NUMBERS) is tables
+    assert MessageGenerator(DiceSet.NUMBERS).emoji_dice_converter is tables.converter
+    assert render_tables(DiceSet.OCTANE, 'dev') is not render_tables(DiceSet.OCTANE, 'prod')
+    assert tables.dice_fragment(6, 4) == ':six: :six: :six: :six:'
+    assert tables.dice_fragment(6, 12) == ' '.join([':six:'] * 12)
+    assert tables.dice_fragment(6, 12, compact=True) == ':six:×12'
+    assert tables.dice_fragment(6, 1, compact=True) == ':six:'
+
+def test_parser_restores_failed_rerolls():
+    failed_reroll = Roll([1, 1, 3, 4, 4, 5])
+    failed_reroll.mark_as_failed_reroll()
+    failed_all_in = Roll([1, 1, 2, 3, 3, 6])
+    failed_all_in.mark_as_failed_all_in()
+    roll_history = _roll_history(Roll([1, 1, 2, 4, 4, 6]), failed_reroll)
+    roll_history.add_roll(RollPhase.ALL_IN, failed_all_in)
+
+    parsed = _parse([MessageGenerator(DiceSet.SABACC).generate_roll_message(roll_history)], DiceSet.SABACC)
+    for phase, roll in roll_history.rolls.items():
+        assert parsed.get_roll(phase).counts == roll.counts
+        assert parsed.get_roll(phase).failed_reroll == roll.failed_reroll
+        assert parsed.get_roll(phase).matches == roll.matches
+
+def test_parser_ignores_lines_after_separator():
+    parsed = _parse(['Roll: :one: :one: :two:\n----------\nRoll: :three:'], DiceSet.NUMBERS)
+    assert parsed.get_roll(RollPhase.INITIAL).dice == [1, 1, 2]
+
+@pytest.mark.parametrize('description', [
+    'Roll: :one: :seven:',
+    'Roll: :one:×x',
+    'Re-roll :thumbsup:: :one:',
+    'No roll here',
+])
+def test_parser_rejects_invalid_messages(description):
+    with pytest.raises(ValueError):
+        _parse([description], DiceSet.NUMBERS)
@@ -0,0 +1,68 @@
+import aiohttp
+import pytest
+from bot.metrics import MetricsRegistry, MetricsServer, StageTimer
+
+def test_counter_renders_total_per_label():
+    registry = MetricsRegistry()
+    counter = registry.counter('rerolls', 'Rerolls.', 'action')
+    counter.inc('reroll')
+    counter.inc('reroll')
+    counter.inc('all_in')
+
+    assert registry.render() == (
+        '# HELP rerolls Rerolls.\n'
+        '# TYPE rerolls counter\n'
+        'rerolls_total{action="reroll"} 2\n'
+        'rerolls_total{action="all_in"} 1\n')
+
+def test_gauge_renders_last_value_per_label():
+    registry = MetricsRegistry()
+    gauge = registry.gauge('shard_latency', 'Latency.', 'shard')
+    gauge.set(0.5, '0')
+    gauge.set(0.25, '0')
+    gauge.set(float('nan'), '1')
+
+    assert registry.render().splitlines()[2:] == [
+        'shard_latency{shard="0"} 0.25',
+        'shard_latency{shard="1"} NaN',
+    ]
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency', 'Latency.', buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1.0"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        'latency_sum 2.65',
+        'latency_count 4',
+    ]
+
+def test_stage_timer_observes_duration_even_on_error():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('stage_seconds', 'Stages.', 'stage')
+    with StageTimer(histogram, 'render'):
+        pass
+    with pytest.raises(ValueError):
+        with StageTimer(histogram, 'parse'):
+            raise ValueError()
+
+    assert histogram.values.keys() == {'render', 'parse'}
+    assert 'stage_seconds_count{stage="parse"} 1' in registry.render()
+
+@pytest.mark.asyncio
+async def test_server_serves_metrics():
+    registry = MetricsRegistry()
+    registry.counter('rolls', 'Rolls.').inc()
+    server = MetricsServer(registry)
+    await server.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{server.port}/metrics') as response:
+                assert response.status == 200
+                assert 'rolls_total 1' in await response.text()
+    finally:
+        await server.stop()
@@ -0,0 +1,48 @@
+import itertools
+import pytest
+from collections import Counter
+from bot.odds import MAX_ODDS_DICE, OddsCalculator, RollOdds, compute_roll_odds
+from bot.roll import Roll
+
+@pytest.mark.parametrize('num_dice', [1, 2, 3, 4, 5])
+def test_matches_brute_force_enumeration(num_dice):
+    profile_outcomes = Counter()
+    score_outcomes = Counter()
+    for dice in itertools.product(range(1, 7), repeat=num_dice):
+        roll = Roll(list(dice))
+        profile = tuple(sorted((num_matches for num_matches, faces in roll.matches.items() if num_matches > 1
+                                for _ in faces), reverse=True))
+        profile_outcomes[profile] += 1
+        score_outcomes[roll.score] += 1
+
+    odds = compute_roll_odds(num_dice)
+    assert odds.profile_outcomes == profile_outcomes
+    assert odds.score_outcomes == score_outcomes
+
+def test_probabilities_sum_to_one():
+    odds = compute_roll_odds(30)
+    assert sum(odds.profile_outcomes.values()) == odds.total_outcomes
+    assert sum(odds.score_probabilities().values()) == pytest.approx(1)
+    assert sum(odds.best_success_probabilities().values()) == pytest.approx(1)
+
+def test_known_probabilities():
+    odds = compute_roll_odds(2)
+    assert odds.success_probability() == pytest.approx(1 / 6)
+    assert odds.profile_probabilities() == pytest.approx({(): 5 / 6, (2,): 1 / 6})
+
+def test_invalid_number_of_dice():
+    with pytest.raises(ValueError):
+        compute_roll_odds(0)
+    with pytest.raises(ValueError):
+        compute_roll_odds(MAX_ODDS_DICE + 1)
+
+def test_serialization_round_trip():
+    odds = compute_roll_odds(12)
+    restored = RollOdds.from_dict(odds.to_dict())
+    assert restored.profile_outcomes == odds.profile_outcomes
+    assert restored.score_outcomes == odds.score_outcomes
+
+def test_calculator_uses_disk_cache(tmp_path):
+    odds = OddsCalculator(str(tmp_path)).roll_odds(8)
+    assert (tmp_path / 'odds_8.json').exists()
+    assert OddsCalculator(str(tmp_path)).roll_odds(8).profile_outcomes == odds.profile_outcomes
@@ -0,0 +1,52 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bot.interactions import InteractionsApi
+from bot.ratelimit import RateLimitTracker, rate_limits, request_scope
+
+def test_request_scope_is_the_major_parameter():
+    assert request_scope('https://discord.com/api/v10/channels/123/messages/456') == 'channel:123'
+    assert request_scope('https://discord.com/api/v10/interactions/789/abc/callback') == 'interaction:789'
+    assert request_scope('https://discord.com/api/v10/webhooks/1/tok-en/messages/@original') == 'webhook:1/tok-en'
+    assert request_scope('https://discord.com/api/v10/gateway/bot') is None
+
+def test_exhausted_bucket_delays_requests_until_reset():
+    tracker = RateLimitTracker()
+    url = 'https://discord.com/api/v10/channels/123/messages'
+    tracker.record(url, 200, {'X-RateLimit-Bucket': 'a', 'X-RateLimit-Remaining': '1', 'X-RateLimit-Reset-After': '5'})
+    assert tracker.delay(['channel:123']) == 0
+    tracker.record(url, 200, {'X-RateLimit-Bucket': 'a', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '5'})
+    assert 4 < tracker.delay(['channel:123']) <= 5
+    assert tracker.delay(['channel:456']) == 0
+
+def test_global_rate_limit_delays_every_scope():
+    tracker = RateLimitTracker()
+    tracker.record('https://discord.com/api/v10/channels/123/messages', 429,
+                   {'Retry-After': '2', 'X-RateLimit-Global': 'true'})
+    assert 1 < tracker.delay(['channel:456']) <= 2
+
+@pytest.mark.asyncio
+async def test_webhook_requests_are_retried_and_tracked_against_a_server_returning_429s():
+    requests = []
+
+    async def handle_edit(request):
+        requests.append(await request.json())
+        if len(requests) == 1:
+            return web.json_response(
+                {'message': 'You are being rate limited.', 'retry_after': 0.05, 'global': False}, status=429,
+                headers={'Retry-After': '0.05', 'X-RateLimit-Bucket': 'edit', 'X-RateLimit-Scope': 'user'})
+        return web.json_response({'id': '1'}, headers={
+            'X-RateLimit-Bucket': 'edit', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '3'})
+
+    app = web.Application()
+    app.router.add_patch('/api/v10/webhooks/{application_id}/{token}/messages/@original', handle_edit)
+    async with TestServer(app) as server:
+        api = InteractionsApi(base_url=str(server.make_url('/api/v10')))
+        try:
+            result = await api.request('PATCH', '/webhooks/1/token/messages/@original', {'content': 'Edited'})
+        finally:
+            await api.close()
+
+    assert result == {'id': '1'}
+    assert requests == [{'content': 'Edited'}] * 2
+    assert 2 < rate_limits.delay(['webhook:1/token']) <= 3
@@ -0,0 +1,52 @@
+from collections import Counter
+import pytest
+from bot.rng import NUM_FACES, DiceSource, dice_source, generate_faces
+from bot.roll import RollPhase, Roller
+from bot.roll_state import decode_roll_history, encode_roll_history
+
+def test_faces_are_uniform():
+    faces = generate_faces(lambda n: bytes(range(256)) * (n // 256 + 1), 10_000)
+    counts = Counter(faces[:252 * 39])
+    # The dropped bytes would otherwise make the lower faces more likely.
+    assert set(counts) == set(range(NUM_FACES))
+    assert len(set(counts.values())) == 1
+
+def test_dealing_across_refills_keeps_every_face():
+    source = DiceSource(seed=1, buffer_size=64)
+    dealt = b''.join(source.faces(num_dice) for num_dice in [10, 50, 1, 200, 7] * 20)
+    replayed = DiceSource(seed=1, buffer_size=64)
+    assert dealt == b''.join(replayed.faces(num_dice) for num_dice in [10, 50, 1, 200, 7] * 20)
+    assert sum(DiceSource(seed=2, buffer_size=64).counts(100_000)) == 100_000
+
+def test_unseeded_sources_differ():
+    assert DiceSource().faces(100) != DiceSource().faces(100)
+    assert DiceSource().new_key() is None
+
+@pytest.fixture
+def seeded_dice_source():
+    dice_source.seed(42)
+    yield dice_source
+    dice_source.seed(None)
+
+def test_seeded_roll_and_rerolls_replay_from_the_roll_state(seeded_dice_source):
+    roller = Roller(num_dice=8, key=1234)
+    roller.roll()
+    state = encode_roll_history(roller.roll_history)
+    roller.free_reroll()
+
+    # Restore the roll from its state, as the reroll buttons do, and reroll again.
+    replayed = Roller(roll_history=decode_roll_history(state))
+    replayed.free_reroll()
+    for phase in [RollPhase.INITIAL, RollPhase.FREE_REROLL]:
+        assert replayed.roll_history.get_roll(phase).counts == roller.roll_history.get_roll(phase).counts
+
+def test_seeded_rolls_get_random_keys_and_streams_of_the_source_seed():
+    first, second = DiceSource(seed=1), DiceSource(seed=1)
+    # Restarting with the same seed doesn't deal the same rolls again.
+    assert len({first.new_key() for _ in range(3)} | {second.new_key() for _ in range(3)}) == 6
+    assert first.roll_source(7, 1).faces(100) == second.roll_source(7, 1).faces(100)
+    # Knowing the key of a roll doesn't tell its dice without the source's seed.
+    assert DiceSource(seed=2).roll_source(7, 1).faces(100) != first.roll_source(7, 1).faces(100)
+    assert first.roll_source(None, 1) is first
+    unseeded = DiceSource()
+    assert unseeded.roll_source(7, 1) is unseeded
@@ -55,3 +55,30 @@ def test_is_better_than():
     assert not large_roll_with_4_basic.is_better_than(large_roll_with_1_extreme)
     assert not large_roll_with_1_extreme.is_better_than(large_roll_with_3_critical)
     assert not large_roll_with_3_critical.is_better_than(large_roll_with_1_extreme)
+
+def test_from_counts():
+    roll = Roll.from_counts([2, 0, 1, 0, 0, 3])
+    assert roll.dice == [1, 1, 3, 6, 6, 6]
+    assert roll.num_dice == 6
+    assert roll.matches == {2: [1], 1: [3], 3: [6]}
+    assert roll.matched_counts() == [2, 0, 0, 0, 0, 3]
+
+def test_score():
+    assert Roll([1, 2, 3, 4, 5, 6]).score == 0
+    assert Roll([1, 1, 2, 3, 3, 3]).score == 12
+    roll = Roll([1, 1, 2, 3, 3, 3])
+    roll.mark_as_failed_reroll()
+    assert roll.score == 9, 'Lost successes should not count'
+
+def test_mark_as_failed_all_in_without_non_matched_dice():
+    roll = Roll([1, 1, 3, 3, 3])
+    roll.mark_as_failed_all_in()
+    assert roll.matches == {}
+    assert roll.failed_matches == {2: [1], 3: [3]}
+    assert roll.score == 0
+
+def test_large_roll():
+    roll = Roll.from_counts([1000, 1000, 1000, 1000, 1000, 1])
+    assert roll.num_dice == 5001
+    assert roll.non_matched_dice() == [6]
+    assert roll.is_better_than(Roll.from_counts([999, 1000, 1000, 1000, 1000, 2]))
@@ -0,0 +1,59 @@
+import pytest
+from bot.roll import Roll, RollHistory, RollPhase
+from bot.roll_state import encode_roll_history, decode_roll_history
+
+def _history(**rolls):
+    roll_history = RollHistory()
+    for phase_name, roll in rolls.items():
+        roll_history.add_roll(RollPhase[phase_name.upper()], roll)
+    return roll_history
+
+def _assert_same_history(actual, expected):
+    assert actual.num_dice == expected.num_dice
+    assert actual.rolls.keys() == expected.rolls.keys()
+    for phase, roll in expected.rolls.items():
+        assert actual.get_roll(phase).dice == roll.dice
+        assert actual.get_roll(phase).matches == roll.matches
+        assert actual.get_roll(phase).failed_reroll == roll.failed_reroll
+        assert actual.get_roll(phase).failed_matches == roll.failed_matches
+
+def test_round_trip_initial_roll():
+    roll_history = _history(initial=Roll([1, 1, 2, 4, 4, 6]))
+    _assert_same_history(decode_roll_history(encode_roll_history(roll_history)), roll_history)
+
+def test_round_trip_failed_reroll_and_all_in():
+    failed_reroll = Roll([1, 1, 3, 4, 4, 5])
+    failed_reroll.mark_as_failed_reroll()
+    failed_all_in = Roll([1, 1, 2, 3, 3, 6])
+    failed_all_in.mark_as_failed_all_in()
+    roll_history = _history(
+        initial=Roll([1, 1, 2, 4, 4, 6]),
+        reroll=failed_reroll,
+        all_in=failed_all_in)
+    _assert_same_history(decode_roll_history(encode_roll_history(roll_history)), roll_history)
+
+def test_round_trip_large_pool():
+    roll_history = _history(
+        initial=Roll([1] * 200 + [6] * 150 + [3]),
+        free_reroll=Roll([1] * 200 + [6] * 151))
+    _assert_same_history(decode_roll_history(encode_roll_history(roll_history)), roll_history)
+
+def test_encoding_is_compact():
+    roll_history = _history(
+        initial=Roll([1, 1, 2, 3, 4, 4, 5, 6]),
+        reroll=Roll([1, 1, 2, 2, 4, 4, 5, 6]),
+        all_in=Roll([1, 1, 2, 2, 4, 4, 5, 5]))
+    assert len(encode_roll_history(roll_history)) <= 26
+
+@pytest.mark.parametrize('state', ['', 'AA', 'Ag', 'AQEBAQEB', 'AQEBAQEBAQE', '!!!'])
+def test_decode_invalid_state(state):
+    with pytest.raises(ValueError):
+        decode_roll_history(state)
+
+def test_round_trip_key():
+    roll_history = _history(initial=Roll([1, 1, 2, 4, 4, 6]))
+    roll_history.key = 2**32 - 1
+    decoded = decode_roll_history(encode_roll_history(roll_history))
+    _assert_same_history(decoded, roll_history)
+    assert decoded.key == roll_history.key
+    assert decode_roll_history(encode_roll_history(_history(initial=Roll([1, 2])))).key is None
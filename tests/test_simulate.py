@@ -0,0 +1,90 @@
+import itertools
+import numpy as np
+import pytest
+from bot.odds import compute_roll_odds
+from bot.roll import Roll, RollHistory, RollPhase, Roller
+from bot.roll_state import encode_roll_history, decode_roll_history
+from bot.simulate import MAX_SIMULATE_DICE, Strategy, lowest_success_scores, scores, simulate
+
+class ScriptedRoller(Roller):
+    """A roller that rolls the given dice instead of random ones."""
+    def __init__(self, roll_history, dice):
+        super().__init__(roll_history=roll_history)
+        self.dice = dice
+
+    def roll_counts(self, num_dice):
+        assert num_dice == len(self.dice)
+        return Roll(list(self.dice)).counts
+
+def _expected_final_score(roll_history, actions):
+    """Computes the exact expected final score by enumerating all rerolls with Roller."""
+    roll_history_can = {
+        'reroll': roll_history.can_reroll,
+        'free_reroll': roll_history.can_free_reroll,
+        'all_in': roll_history.can_go_all_in,
+    }
+    if not actions or not roll_history_can[actions[0]]():
+        return roll_history.get_final_roll().score
+    last_roll = roll_history.get_final_roll() if actions[0] == 'all_in' else roll_history.get_roll(RollPhase.INITIAL)
+    num_rerolled = len(last_roll.non_matched_dice())
+    state = encode_roll_history(roll_history)
+    total = 0
+    for dice in itertools.product(range(1, 7), repeat=num_rerolled):
+        history = decode_roll_history(state)
+        getattr(ScriptedRoller(history, dice), actions[0])()
+        total += _expected_final_score(history, actions[1:])
+    return total / 6 ** num_rerolled
+
+def _exact_mean_score(num_dice, actions):
+    total = 0
+    for dice in itertools.product(range(1, 7), repeat=num_dice):
+        roll_history = RollHistory()
+        roll_history.add_roll(RollPhase.INITIAL, Roll(list(dice)))
+        total += _expected_final_score(roll_history, actions)
+    return total / 6 ** num_dice
+
+STRATEGY_ACTIONS = {
+    Strategy.KEEP: [],
+    Strategy.REROLL: ['reroll'],
+    Strategy.FREE_REROLL: ['free_reroll'],
+    Strategy.REROLL_ALL_IN: ['reroll', 'all_in'],
+    Strategy.FREE_REROLL_ALL_IN: ['free_reroll', 'all_in'],
+}
+
+@pytest.mark.parametrize('num_dice, strategy', [
+    (3, strategy) for strategy in Strategy] + [(4, Strategy.REROLL_ALL_IN)])
+def test_simulation_follows_roll_rules(num_dice, strategy):
+    exact_mean = _exact_mean_score(num_dice, STRATEGY_ACTIONS[strategy])
+    result = simulate(num_dice, strategy, trials=400_000, seed=1234)
+    assert result.trials == 400_000
+    assert result.mean_score() == pytest.approx(exact_mean, rel=0.02)
+
+def test_keep_matches_exact_odds():
+    result = simulate(8, Strategy.KEEP, trials=400_000, seed=1234)
+    odds = compute_roll_odds(8)
+    assert result.mean_score() == pytest.approx(odds.expected_score(), rel=0.02)
+    assert result.rate(result.successes) == pytest.approx(odds.success_probability(), abs=0.005)
+    assert result.rerolls == result.all_ins == 0
+
+def test_scores_match_roll():
+    rolls = [Roll([1, 1, 2, 3, 3, 3]), Roll([1, 2, 3, 4, 5, 6]), Roll([6] * 12 + [1, 1])]
+    counts = np.array([roll.counts for roll in rolls])
+    assert scores(counts).tolist() == [roll.score for roll in rolls]
+    failed_roll_scores = []
+    for roll in rolls:
+        if roll.score:
+            roll.mark_as_failed_reroll()
+        failed_roll_scores.append(roll.score)
+    assert (scores(counts) - lowest_success_scores(counts)).tolist() == failed_roll_scores
+
+def test_seeded_simulation_is_reproducible():
+    first = simulate(6, Strategy.FREE_REROLL_ALL_IN, trials=1000, seed=42)
+    second = simulate(6, Strategy.FREE_REROLL_ALL_IN, trials=1000, seed=42)
+    assert first.total_score == second.total_score
+    assert first.failed_all_ins == second.failed_all_ins
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        simulate(MAX_SIMULATE_DICE + 1, Strategy.KEEP, trials=10)
+    with pytest.raises(ValueError):
+        simulate(6, Strategy.KEEP, trials=0)
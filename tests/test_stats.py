@@ -0,0 +1,118 @@
+import pytest
+from bot.message import MessageGenerator
+from bot.roll import Roll, RollHistory, RollPhase, Roller
+from bot import stats
+from bot.stats import RollStats, StatsStore, expected_successes, success_probability
+
+def _roll_history(*rolls):
+    roll_history = RollHistory()
+    for phase, roll in rolls:
+        roll_history.add_roll(phase, roll)
+    return roll_history
+
+def test_expected_successes_and_success_probability():
+    assert expected_successes(1) == pytest.approx(0)
+    assert expected_successes(2) == pytest.approx(1 / 6)
+    assert success_probability(2) == pytest.approx(1 / 6)
+    assert success_probability(7) == 1.0
+    # Each of the six faces shows at least twice in almost every huge roll.
+    assert expected_successes(100_000) == pytest.approx(6)
+
+def test_expected_successes_match_simulated_rolls():
+    num_dice, trials = 5, 20_000
+    successes = 0
+    for _ in range(trials):
+        roller = Roller(num_dice=num_dice)
+        roller.roll()
+        successes += sum(1 for count in roller.roll_history.get_roll(RollPhase.INITIAL).counts if count > 1)
+    assert successes / trials == pytest.approx(expected_successes(num_dice), rel=0.05)
+
+def test_rolls_and_rerolls_update_user_channel_and_guild():
+    store = StatsStore('unused.json')
+    roll_history = _roll_history((RollPhase.INITIAL, Roll([1, 1, 1, 2, 2, 3])))
+    store.record(roll_history, guild_id=1, channel_id=2, user_id=3)
+    roll_history.add_roll(RollPhase.REROLL, Roll([1, 1, 1, 2, 2, 2]))
+    store.record(roll_history, guild_id=1, channel_id=2, user_id=3)
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 2, 3]))), guild_id=None, channel_id=4, user_id=3)
+
+    user = store.get('user', 3)
+    assert (user.rolls, user.dice, user.successes, user.successful_rolls) == (2, 9, 2, 1)
+    assert user.tiers == [1, 0, 0, 1, 0, 0, 0]
+    assert (user.attempts, user.improved) == ([1, 0, 0], [1, 0, 0])
+    assert user.expected_successes == pytest.approx(expected_successes(6) + expected_successes(3))
+    assert store.get('channel', 2).rolls == 1
+    assert store.get('guild', 1).rolls == 1
+    assert store.get('guild', 5).rolls == 0
+
+def test_failed_rerolls_count_as_not_improved():
+    store = StatsStore('unused.json')
+    failed = Roll([1, 1, 2, 3])
+    failed.mark_as_failed_reroll()
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3])), (RollPhase.REROLL, failed)),
+                 guild_id=1, channel_id=2, user_id=3)
+    # A free reroll that didn't improve the result isn't marked as failed.
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3])), (RollPhase.FREE_REROLL, Roll([1, 1, 2, 4]))),
+                 guild_id=1, channel_id=2, user_id=3)
+    assert store.get('user', 3).improved == [0, 0, 0]
+    assert store.get('user', 3).attempts == [1, 1, 0]
+
+@pytest.mark.asyncio
+async def test_statistics_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'stats' / 'roll_stats.json')
+    store = StatsStore(path)
+    await store.start()
+    store.record(_roll_history((RollPhase.INITIAL, Roll([6, 6, 6, 6, 6, 6, 6]))), guild_id=1, channel_id=2, user_id=3)
+    await store.close()
+
+    restarted = StatsStore(path)
+    # Rolls recorded before the snapshot is loaded are kept.
+    restarted.record(_roll_history((RollPhase.INITIAL, Roll([1, 2]))), guild_id=1, channel_id=2, user_id=3)
+    await restarted.start()
+    await restarted.close()
+    user = restarted.get('user', 3)
+    assert (user.rolls, user.dice) == (2, 9)
+    assert user.tiers == [1, 0, 0, 0, 0, 0, 1]
+    assert len(restarted) == 3
+
+def test_stats_message():
+    store = StatsStore('unused.json')
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3]))), guild_id=1, channel_id=2, user_id=3)
+    message = MessageGenerator().generate_stats_message('Roll statistics', store.get('user', 3))
+    assert 'Rolls: 1 (average pool: 4.0 dice)' in message
+    assert 'Basic: 100.00%' in message
+    assert 'Re-rolls: none yet' in message
+    assert 'No rolls yet' in MessageGenerator().generate_stats_message('Roll statistics', store.get('user', 4))
+
+@pytest.mark.asyncio
+async def test_snapshot_is_not_changed_by_later_rolls(tmp_path):
+    store = StatsStore(str(tmp_path / 'roll_stats.json'))
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3]))), guild_id=1, channel_id=2, user_id=3)
+    written = []
+    store._write = written.append
+    await store.snapshot()
+    store.record(_roll_history((RollPhase.INITIAL, Roll([4, 4, 4, 5]))), guild_id=1, channel_id=2, user_id=3)
+    [snapshot] = written
+    assert snapshot['user:3'][:3] == [1, 4, [0, 0, 1, 0, 0, 0, 0]]
+
+@pytest.mark.asyncio
+async def test_snapshots_only_copy_the_changed_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(stats, 'SNAPSHOT_BATCH_SIZE', 1)
+    copied = []
+    to_list = RollStats.to_list
+    monkeypatch.setattr(RollStats, 'to_list', lambda self: copied.append(self) or to_list(self))
+    path = str(tmp_path / 'roll_stats.json')
+    store = StatsStore(path)
+    await store.start()
+    store.record(_roll_history((RollPhase.INITIAL, Roll([1, 1, 2, 3]))), guild_id=1, channel_id=2, user_id=3)
+    await store.snapshot()
+    assert len(copied) == 3
+
+    store.record(_roll_history((RollPhase.INITIAL, Roll([4, 4, 4, 5]))), guild_id=None, channel_id=None, user_id=4)
+    await store.close()
+    assert copied[3:] == [store.get('user', 4)]
+
+    restarted = StatsStore(path)
+    await restarted.start()
+    await restarted.close()
+    assert len(restarted) == 4
+    assert restarted.get('user', 3).rolls == restarted.get('user', 4).rolls == 1